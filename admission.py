@@ -0,0 +1,245 @@
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+
+from flask import jsonify, request
+
+from auth import token_user_id
+from core.db import DB_PATH, get_db, is_postgres
+
+logger = logging.getLogger(__name__)
+
+# Admission control in front of every route: a token bucket per caller (user
+# id from the access token, else client IP) and route class, plus load
+# shedding of reads when SQLite's write queue backs up, so writes such as
+# update_request keep getting through.
+
+# (tokens per second, burst) per route class
+LIMITS = {
+    'read': (10.0, 40),
+    'write': (2.0, 10),
+    'chat': (3.0, 15),
+    'compute': (0.2, 3),  # matching and route planning
+    'auth': (0.5, 5),  # scrypt on every call; also slows password guessing
+    'auth_ip': (5.0, 50),  # all auth calls from one address, whichever account
+}
+CHAT_ENDPOINTS = {'create_message', 'get_messages', 'get_conversations'}
+COMPUTE_ENDPOINTS = {'run_donation_matching', 'foodbank_pickup_route'}
+AUTH_ENDPOINTS = {'login', 'register', 'change_password'}
+EXEMPT_ENDPOINTS = {'health_check', 'admission_metrics', 'static'}
+
+# Shed these classes when waiting for the write lock takes longer than this
+SHED_CLASSES = {'read', 'compute'}
+SHED_THRESHOLD = float(os.environ.get('SHED_THRESHOLD_MS', 250)) / 1000
+PROBE_INTERVAL = 1.0  # seconds between write-lock probes
+SHARED_DB = os.environ.get('RATE_LIMIT_DB')  # path to share buckets across gunicorn workers
+
+def route_class(endpoint, method):
+    if endpoint in AUTH_ENDPOINTS:
+        return 'auth'
+    if endpoint in CHAT_ENDPOINTS:
+        return 'chat'
+    if endpoint in COMPUTE_ENDPOINTS:
+        return 'compute'
+    return 'read' if method in ('GET', 'HEAD') else 'write'
+
+def caller_key(route):
+    # remote_addr, not X-Forwarded-For: the header is whatever the client
+    # says unless ProxyFix (TRUSTED_PROXIES in app.py) vouches for it
+    user_id = token_user_id()
+    if user_id is not None:
+        return f"user:{user_id}"
+    if route == 'auth':
+        # Per account and address: guessing one account's password stays
+        # slow, but failing logins elsewhere can't lock its owner out
+        email = (request.get_json(silent=True) or {}).get('email')
+        if isinstance(email, str) and email:
+            return f"email:{email.strip().lower()}:ip:{request.remote_addr}"
+    return f"ip:{request.remote_addr}"
+
+def bucket_keys(route):
+    """(bucket key, limit) for every bucket this call takes a token from."""
+    keys = [(f"{caller_key(route)}:{route}", LIMITS[route])]
+    if route == 'auth':
+        # One address trying many accounts is still throttled as a whole
+        keys.append((f"ip:{request.remote_addr}:auth_ip", LIMITS['auth_ip']))
+    return keys
+
+def _refill(tokens, updated, now, rate, burst):
+    return min(burst, tokens + (now - updated) * rate)
+
+class MemoryBuckets:
+    """Token buckets for this process only."""
+
+    def __init__(self):
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, burst, now=None):
+        now = now or time.time()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (burst, now))
+            tokens = _refill(tokens, updated, now, rate, burst)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > 100000:
+                # Full buckets carry no state worth keeping
+                self._buckets = {k: v for k, v in self._buckets.items()
+                                 if _refill(*v, now, rate, burst) < burst}
+        return allowed, 0 if allowed else (1 - tokens) / rate
+
+class SQLiteBuckets:
+    """Token buckets in a small side database so all workers share the limits."""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute('''CREATE TABLE IF NOT EXISTS rate_buckets
+                     (key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)''')
+        conn.execute('PRAGMA journal_mode=WAL')
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=1.0, isolation_level=None)
+            self._local.conn = conn
+        return conn
+
+    def take(self, key, rate, burst, now=None):
+        now = now or time.time()
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT tokens, updated FROM rate_buckets WHERE key = ?', (key,)).fetchone()
+            tokens = _refill(*row, now, rate, burst) if row else burst
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            conn.execute('INSERT OR REPLACE INTO rate_buckets (key, tokens, updated) VALUES (?, ?, ?)',
+                         (key, tokens, now))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return allowed, 0 if allowed else (1 - tokens) / rate
+
+class WriteLockProbe:
+    """Samples how long a writer waits for the database, once a second."""
+
+    def __init__(self, db_path=DB_PATH, interval=PROBE_INTERVAL, timeout=2.0):
+        self.db_path = db_path
+        self.interval = interval
+        self.timeout = timeout
+        self.last = 0.0
+        self._waiting_since = None
+        self._started = False
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        threading.Thread(target=self._run, name='write-lock-probe', daemon=True).start()
+
+    @property
+    def latency(self):
+        # A probe still stuck waiting for the lock counts for its wait so far
+        waiting_since = self._waiting_since
+        pending = time.monotonic() - waiting_since if waiting_since else 0.0
+        return max(self.last, pending)
+
+    def sample(self):
+        start = self._waiting_since = time.monotonic()
+        try:
+            if is_postgres():
+                # PostgreSQL writers don't queue on one lock; what backs up
+                # is the connection pool, so time a checkout and a round trip
+                conn = get_db()
+                try:
+                    conn.execute('SELECT 1')
+                finally:
+                    conn.close()
+                return time.monotonic() - start
+            conn = sqlite3.connect(self.db_path, timeout=self.timeout, isolation_level=None)
+            try:
+                conn.execute('BEGIN IMMEDIATE')
+                conn.execute('ROLLBACK')
+            except sqlite3.OperationalError:
+                pass  # timed out waiting; the elapsed time says enough
+            finally:
+                conn.close()
+            return time.monotonic() - start
+        finally:
+            self._waiting_since = None
+
+    def _run(self):
+        while True:
+            try:
+                self.last = self.sample()
+            except Exception as e:
+                logger.warning(f"Write-lock probe failed: {e}")
+            time.sleep(self.interval)
+
+class AdmissionControl:
+    def __init__(self, buckets=None, probe=None):
+        self.buckets = buckets or (SQLiteBuckets(SHARED_DB) if SHARED_DB else MemoryBuckets())
+        self.probe = probe or WriteLockProbe()
+        self.counters = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def _count(self, route, outcome):
+        with self._lock:
+            self.counters[(route, outcome)] += 1
+
+    def _reject(self, route, outcome, retry_after, error):
+        self._count(route, outcome)
+        response = jsonify({"success": False, "error": error})
+        response.status_code = 429
+        response.headers['Retry-After'] = str(max(1, math.ceil(retry_after)))
+        return response
+
+    def admit(self):
+        """before_request hook: returns a 429 response, or None to let the request through."""
+        if request.method == 'OPTIONS' or request.endpoint in EXEMPT_ENDPOINTS or request.endpoint is None:
+            return None
+        self.probe.start()
+        route = route_class(request.endpoint, request.method)
+
+        if route in SHED_CLASSES and self.probe.latency > SHED_THRESHOLD:
+            return self._reject(route, 'shed', self.probe.latency * 2, "Server busy, try again shortly")
+
+        allowed, retry_after = True, 0
+        for key, (rate, burst) in bucket_keys(route):
+            try:
+                allowed, retry_after = self.buckets.take(key, rate, burst)
+            except sqlite3.Error as e:
+                # The limiter must never take the API down with it
+                logger.warning(f"Rate limit backend error, admitting request: {e}")
+                allowed, retry_after = True, 0
+            if not allowed:
+                break
+        if not allowed:
+            return self._reject(route, 'rate_limited', retry_after, "Too many requests")
+        self._count(route, 'admitted')
+        return None
+
+    def metrics(self):
+        with self._lock:
+            counters = dict(self.counters)
+        routes = sorted({route for route, _ in counters})
+        return {
+            'backend': 'sqlite' if isinstance(self.buckets, SQLiteBuckets) else 'memory',
+            'write_lock_wait_ms': round(self.probe.latency * 1000, 1),
+            'shed_threshold_ms': SHED_THRESHOLD * 1000,
+            'routes': {route: {outcome: counters.get((route, outcome), 0)
+                               for outcome in ('admitted', 'rate_limited', 'shed')}
+                       for route in routes},
+        }
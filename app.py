@@ -1,92 +1,210 @@
 import json
 import traceback
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, make_response, g
 from flask_cors import CORS
-import sqlite3
+from werkzeug.middleware.proxy_fix import ProxyFix
 from datetime import datetime
 import base64
 from io import BytesIO
-from PIL import Image
 import os
+import hashlib
 import logging
+from core.db import IntegrityError, get_db
+from core.schema import USER_FIELDS, init_db
+from core.codec import (COMPRESS_MIN_BYTES, MSGPACK, choose_encoding, compress, pack,
+                        wants_msgpack, worth_compressing)
+from auth import TOKEN_TTL, issue_token, require_auth, user_cache
+from credentials import CredentialsBusy, hash_password, verify_password
+from admission import AdmissionControl
+from replicas import read_db, read_router
+from jobs import open_queue, queue_stats
+from tasks import queue_listing_images, queue_read_receipt, schedule_maintenance
+from avatar_store import save_avatar, load_avatar
+from rollups import apply_request_change, farmer_summary, foodbank_summary, county_donations
+from bulk_ops import (MAX_BULK_ROWS, REQUEST_TRANSITIONS, parse_csv_rows, validate_listing_rows,
+                      insert_listings, validate_request_updates, apply_request_updates, deactivate_sold_out)
+from matching import get_demand, set_demand, run_matching
+from routing import DEFAULT_CAPACITY_KG, foodbank_route
+from projections import save_farm_profile, supply_projections
+from events import catch_up, latest_event_id, record
+from messaging import archived_messages, query_conversations
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 CORS(app)
+# Behind a reverse proxy, trust this many X-Forwarded-For hops so remote_addr
+# (which rate limiting keys on) is the client's address; 0 when exposed directly
+TRUSTED_PROXIES = int(os.environ.get('TRUSTED_PROXIES', 0))
+if TRUSTED_PROXIES:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXIES)
+admission = AdmissionControl()
+app.before_request(admission.admit)
 
 # Database setup
-def init_db():
-    conn = sqlite3.connect('food_donation.db')
-    c = conn.cursor()
-    
-    # Create tables
-    c.execute('''CREATE TABLE IF NOT EXISTS users
-                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                 name TEXT NOT NULL,
-                 email TEXT UNIQUE NOT NULL,
-                 password TEXT NOT NULL,
-                 role TEXT NOT NULL,
-                 location TEXT,
-                 phone TEXT,
-                 profile_pic TEXT,
-                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
-    
-    c.execute('''CREATE TABLE IF NOT EXISTS listings
-                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                 farmer_id INTEGER NOT NULL,
-                 produce_type TEXT NOT NULL,
-                 quantity REAL NOT NULL,
-                 price REAL DEFAULT 0,
-                 description TEXT,
-                 harvest_date TEXT,
-                 best_before TEXT,
-                 organic BOOLEAN DEFAULT 0,
-                 images TEXT,
-                 status TEXT DEFAULT 'active',
-                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                 FOREIGN KEY (farmer_id) REFERENCES users(id))''')
-    
-    c.execute('''CREATE TABLE IF NOT EXISTS requests
-                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                 listing_id INTEGER NOT NULL,
-                 buyer_id INTEGER,
-                 foodbank_id INTEGER,
-                 quantity REAL NOT NULL,
-                 purpose TEXT,
-                 status TEXT DEFAULT 'pending',
-                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                 FOREIGN KEY (listing_id) REFERENCES listings(id),
-                 FOREIGN KEY (buyer_id) REFERENCES users(id),
-                 FOREIGN KEY (foodbank_id) REFERENCES users(id))''')
-    
-    c.execute('''CREATE TABLE IF NOT EXISTS messages
-                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                 sender_id INTEGER NOT NULL,
-                 receiver_id INTEGER NOT NULL,
-                 content TEXT NOT NULL,
-                 read BOOLEAN DEFAULT 0,
-                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                 FOREIGN KEY (sender_id) REFERENCES users(id),
-                 FOREIGN KEY (receiver_id) REFERENCES users(id))''')
-    
-    conn.commit()
-    conn.close()
-
 init_db()
+schedule_maintenance()
 
 # Helper functions
-def get_db():
-    conn = sqlite3.connect('food_donation.db')
-    conn.row_factory = sqlite3.Row
-    return conn
-
 def validate_user(email, password):
     conn = get_db()
-    user = conn.execute('SELECT * FROM users WHERE email = ? AND password = ?', 
-                       (email, password)).fetchone()
-    conn.close()
-    return dict(user) if user else None
+    try:
+        user = conn.execute(f'SELECT {USER_FIELDS}, password FROM users WHERE email = ?',
+                            (email,)).fetchone()
+    finally:
+        conn.close()
+    # An unknown email is checked against a dummy hash, so it takes as long
+    # as a wrong password and response times don't reveal who has an account
+    matches, needs_rehash = verify_password(password, user['password'] if user else None)
+    if not matches:
+        return None
+    user = dict(user)
+    del user['password']
+    if needs_rehash:
+        # Legacy plaintext (or an older cost): upgrade now that we know the password
+        try:
+            new_hash = hash_password(password)
+        except CredentialsBusy:
+            # The login itself succeeded; the upgrade can wait for the next one
+            logger.info(f"Skipping password rehash for user {user['id']}: hash pool busy")
+            return user
+        conn = get_db()
+        try:
+            conn.execute('UPDATE users SET password = ? WHERE id = ?', (new_hash, user['id']))
+            conn.commit()
+        finally:
+            conn.close()
+    return user
+
+# Queries shared by the single-resource routes and /dashboard
+def query_farmer_listings(conn, farmer_id):
+    rows = conn.execute('SELECT * FROM listings WHERE farmer_id = ?', (farmer_id,)).fetchall()
+    return [dict(row) for row in rows]
+
+def query_active_listings(conn):
+    # Get listings with farmer info for the buyer view
+    rows = conn.execute('''
+        SELECT l.*, u.name as farmer_name, u.location 
+        FROM listings l
+        JOIN users u ON l.farmer_id = u.id
+        WHERE l.status = 'active'
+    ''').fetchall()
+    return [dict(row) for row in rows]
+
+def query_donation_listings(conn):
+    # Get free listings (price = 0) for food banks
+    rows = conn.execute('''
+        SELECT l.*, u.name as farmer_name, u.location 
+        FROM listings l
+        JOIN users u ON l.farmer_id = u.id
+        WHERE l.status = 'active' AND l.price = 0
+    ''').fetchall()
+    return [dict(row) for row in rows]
+
+def query_farmer_requests(conn, farmer_id):
+    rows = conn.execute('''
+        SELECT r.*, l.produce_type, 
+               COALESCE(u1.name, u2.name) as requester_name,
+               COALESCE(r.buyer_id, r.foodbank_id) as requester_id
+        FROM requests r
+        JOIN listings l ON r.listing_id = l.id
+        LEFT JOIN users u1 ON r.buyer_id = u1.id
+        LEFT JOIN users u2 ON r.foodbank_id = u2.id
+        WHERE l.farmer_id = ?
+    ''', (farmer_id,)).fetchall()
+    return [dict(row) for row in rows]
+
+def query_buyer_requests(conn, buyer_id):
+    rows = conn.execute('''
+        SELECT r.*, l.produce_type, u.name as farmer_name
+        FROM requests r
+        JOIN listings l ON r.listing_id = l.id
+        JOIN users u ON l.farmer_id = u.id
+        WHERE r.buyer_id = ?
+    ''', (buyer_id,)).fetchall()
+    return [dict(row) for row in rows]
+
+def query_foodbank_requests(conn, foodbank_id):
+    rows = conn.execute('''
+        SELECT r.*, l.produce_type, u.name as farmer_name
+        FROM requests r
+        JOIN listings l ON r.listing_id = l.id
+        JOIN users u ON l.farmer_id = u.id
+        WHERE r.foodbank_id = ?
+    ''', (foodbank_id,)).fetchall()
+    return [dict(row) for row in rows]
+
+# What each role's dashboard needs, keyed by the section name in the response
+DASHBOARD_SECTIONS = {
+    'farmer': {
+        'listings': query_farmer_listings,
+        'requests': query_farmer_requests,
+        'conversations': query_conversations,
+    },
+    'buyer': {
+        'listings': lambda conn, user_id: query_active_listings(conn),
+        'requests': query_buyer_requests,
+        'conversations': query_conversations,
+    },
+    'foodbank': {
+        'listings': lambda conn, user_id: query_donation_listings(conn),
+        'requests': query_foodbank_requests,
+        'conversations': query_conversations,
+    },
+}
+
+def response_etag(etag):
+    # The MessagePack form of the same data gets its own ETag
+    if wants_msgpack(request.headers.get('Accept')):
+        etag += '-msgpack'
+    return etag
+
+def event_etag(conn, *scope):
+    # Every write appends to the event log in its own transaction, so the
+    # newest event id versions everything read on this connection
+    return response_etag('-'.join(str(part) for part in ('ev', latest_event_id(conn), *scope)))
+
+def not_modified(etag):
+    response = make_response('', 304)
+    response.set_etag(etag)
+    response.cache_control.no_cache = True
+    return response
+
+def json_response(payload, etag=None):
+    # Compact JSON with an ETag (a hash of the body unless the caller has a
+    # cheaper one); a matching If-None-Match gets a bodiless 304
+    body = json.dumps(payload, separators=(',', ':'), default=str)
+    response = make_response(body)
+    response.mimetype = 'application/json'
+    response.set_etag(etag or response_etag(hashlib.sha1(body.encode('utf-8')).hexdigest()))
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+@app.after_request
+def track_writes(response):
+    # The writer's next reads stay on the primary until the replica has this
+    if request.method not in ('GET', 'HEAD', 'OPTIONS') and response.status_code < 400 and g.get('user'):
+        read_router.note_write(g.user['id'])
+    return response
+
+@app.after_request
+def encode_response(response):
+    # Content negotiation for every JSON response: MessagePack (images as raw
+    # bytes) when the client asks for it, then brotli/gzip for larger bodies
+    if response.mimetype != 'application/json' or response.direct_passthrough or response.status_code == 304:
+        return response
+    response.vary.add('Accept')
+    response.vary.add('Accept-Encoding')
+    if wants_msgpack(request.headers.get('Accept')):
+        response.set_data(pack(json.loads(response.get_data())))
+        response.mimetype = MSGPACK
+    encoding = choose_encoding(request.headers.get('Accept-Encoding'))
+    if encoding and response.content_length >= COMPRESS_MIN_BYTES:
+        body = response.get_data()
+        if worth_compressing(body):
+            response.set_data(compress(body, encoding))
+            response.headers['Content-Encoding'] = encoding
+    return response
 
 # API Endpoints
 @app.route('/')
@@ -96,201 +214,260 @@ def home():
 @app.route('/login', methods=['POST'])
 def login():
     data = request.json
-    user = validate_user(data['email'], data['password'])
+    try:
+        user = validate_user(data['email'], data['password'])
+    except CredentialsBusy as e:
+        return jsonify({"success": False, "message": str(e)}), 503
     
     if user and user['role'].lower() == data['role'].lower():
-        return jsonify({"success": True, "user": user})
+        return jsonify({"success": True, "user": user, "token": issue_token(user), "expires_in": TOKEN_TTL})
     return jsonify({"success": False, "message": "Invalid credentials or role"})
 
 @app.route('/register', methods=['POST'])
 def register():
     data = request.json
+    try:
+        password_hash = hash_password(data['password'])
+    except CredentialsBusy as e:
+        return jsonify({"success": False, "message": str(e)}), 503
     conn = get_db()
     
     try:
         profile_pic = data.get('profile_pic', None)
         
-        c = conn.cursor()
-        c.execute('''INSERT INTO users 
-                     (name, email, password, role, location, phone, profile_pic)
-                     VALUES (?, ?, ?, ?, ?, ?, ?)''',
-                 (data['name'], data['email'], data['password'], data['role'],
-                  data.get('location'), data.get('phone'), profile_pic))
+        user_id = conn.insert('''INSERT INTO users 
+                     (name, email, password, role, location, phone)
+                     VALUES (?, ?, ?, ?, ?, ?)''',
+                 (data['name'], data['email'], password_hash, data['role'],
+                  data.get('location'), data.get('phone')))
+        record(conn, 'user_registered', user_id, user_id=user_id, role=data['role'])
+        
+        if profile_pic:
+            try:
+                save_avatar(conn, user_id, profile_pic)
+            except Exception as e:
+                logger.warning(f"Ignoring invalid profile picture on register: {e}")
         
         conn.commit()
-        user_id = c.lastrowid
-        user = dict(conn.execute('SELECT * FROM users WHERE id = ?', (user_id,)).fetchone())
+        user = dict(conn.execute(f'SELECT {USER_FIELDS} FROM users WHERE id = ?', (user_id,)).fetchone())
         conn.close()
-        return jsonify({"success": True, "user": user})
-    except sqlite3.IntegrityError:
+        return jsonify({"success": True, "user": user, "token": issue_token(user), "expires_in": TOKEN_TTL})
+    except IntegrityError:
         conn.close()
         return jsonify({"success": False, "message": "Email already exists"})
 
 @app.route('/listings', methods=['GET', 'POST'])
+@require_auth(roles=['Farmer'], methods=['POST'])
 def listings():
     if 'images[]' in request.files:
         images = request.files.getlist('images[]')
         image_data = []
         for img in images:
             if img.filename != '':
-                try:
-                    # Validate it's an image
-                    Image.open(img.stream)
-                    img.stream.seek(0)
-                    image_data.append(base64.b64encode(img.read()).decode('utf-8'))
-                except:
-                    continue
+                # Checked by the validate_listing_images job, not here
+                image_data.append(base64.b64encode(img.read()).decode('utf-8'))
     else:
         image_data = []
 
     if request.method == 'POST':
         data = request.json
         conn = get_db()
-        c = conn.cursor()
         
-        c.execute('''INSERT INTO listings 
+        listing_id = conn.insert('''INSERT INTO listings 
                      (farmer_id, produce_type, quantity, price, description, 
                       harvest_date, best_before, organic, images)
                      VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)''',
-                 (data['farmer_id'], data['produce_type'], data['quantity'],
+                 (g.user['id'], data['produce_type'], data['quantity'],
                   data.get('price', 0), data.get('description'),
                   data['harvest_date'], data['best_before'],
-                  data.get('organic', False),
+                  bool(data.get('organic', False)),
                   json.dumps(data.get('images', []))))
+        record(conn, 'listing_created', g.user['id'], listing_id=listing_id, produce_type=data['produce_type'],
+               quantity=data['quantity'], price=data.get('price', 0), status='active')
         
         conn.commit()
-        listing_id = c.lastrowid
         listing = dict(conn.execute('SELECT * FROM listings WHERE id = ?', (listing_id,)).fetchone())
         conn.close()
+        if data.get('images'):
+            queue_listing_images(listing_id)
         return jsonify({"success": True, "listing": listing})
     
     # GET method
-    conn = get_db()
-    listings = conn.execute('SELECT * FROM listings WHERE status = "active"').fetchall()
-    conn.close()
-    return jsonify([dict(row) for row in listings])
+    conn = read_db()
+    try:
+        conn.begin_read()
+        etag = event_etag(conn, 'listings')
+        if etag in request.if_none_match:
+            return not_modified(etag)
+        listings = conn.execute("SELECT * FROM listings WHERE status = 'active'").fetchall()
+        conn.commit()
+    finally:
+        conn.close()
+    return json_response([dict(row) for row in listings], etag)
 
 @app.route('/listings/farmer/<int:farmer_id>', methods=['GET'])
 def farmer_listings(farmer_id):
-    conn = get_db()
-    listings = conn.execute('SELECT * FROM listings WHERE farmer_id = ?', (farmer_id,)).fetchall()
+    conn = read_db()
+    listings = query_farmer_listings(conn, farmer_id)
     conn.close()
-    return jsonify([dict(row) for row in listings])
+    return jsonify(listings)
 
 @app.route('/listings/<int:listing_id>', methods=['DELETE'])
+@require_auth(roles=['Farmer'])
 def delete_listing(listing_id):
     conn = get_db()
-    conn.execute('DELETE FROM listings WHERE id = ?', (listing_id,))
-    conn.commit()
-    conn.close()
+    try:
+        deleted = conn.execute('DELETE FROM listings WHERE id = ? AND farmer_id = ?',
+                               (listing_id, g.user['id'])).rowcount
+        if deleted:
+            record(conn, 'listing_deleted', g.user['id'], listing_id=listing_id)
+        conn.commit()
+    except IntegrityError:
+        # Only PostgreSQL enforces the requests -> listings foreign key
+        return jsonify({"success": False, "error": "Listing has requests, mark it inactive instead"}), 409
+    finally:
+        conn.close()
+    if not deleted:
+        return jsonify({"success": False, "error": "Listing not found"}), 404
     return jsonify({"success": True})
 
 @app.route('/listings/active', methods=['GET'])
 def active_listings():
-    conn = get_db()
-    # Get listings with farmer info for the buyer view
-    listings = conn.execute('''
-        SELECT l.*, u.name as farmer_name, u.location 
-        FROM listings l
-        JOIN users u ON l.farmer_id = u.id
-        WHERE l.status = "active"
-    ''').fetchall()
-    conn.close()
-    return jsonify([dict(row) for row in listings])
+    conn = read_db()
+    try:
+        conn.begin_read()
+        etag = event_etag(conn, 'listings', 'active')
+        if etag in request.if_none_match:
+            return not_modified(etag)
+        listings = query_active_listings(conn)
+        conn.commit()
+    finally:
+        conn.close()
+    return json_response(listings, etag)
 
 # Add this endpoint for food bank donations
 @app.route('/listings/donations', methods=['GET'])
 def donation_listings():
-    conn = get_db()
-    # Get free listings (price = 0) for food banks
-    listings = conn.execute('''
-        SELECT l.*, u.name as farmer_name, u.location 
-        FROM listings l
-        JOIN users u ON l.farmer_id = u.id
-        WHERE l.status = "active" AND l.price = 0
-    ''').fetchall()
-    conn.close()
-    return jsonify([dict(row) for row in listings])
+    conn = read_db()
+    try:
+        conn.begin_read()
+        etag = event_etag(conn, 'listings', 'donations')
+        if etag in request.if_none_match:
+            return not_modified(etag)
+        listings = query_donation_listings(conn)
+        conn.commit()
+    finally:
+        conn.close()
+    return json_response(listings, etag)
 
 @app.route('/listings/<int:listing_id>/status', methods=['PUT'])
+@require_auth(roles=['Farmer'])
 def update_listing_status(listing_id):
     data = request.json
     conn = get_db()
     try:
-        conn.execute('UPDATE listings SET status = ? WHERE id = ?',
-                    (data['status'], listing_id))
+        updated = conn.execute('UPDATE listings SET status = ? WHERE id = ? AND farmer_id = ?',
+                               (data['status'], listing_id, g.user['id'])).rowcount
+        if updated:
+            record(conn, 'listing_status_changed', g.user['id'], listing_id=listing_id, status=data['status'])
         conn.commit()
+        if not updated:
+            return jsonify({"success": False, "error": "Listing not found"}), 404
         return jsonify({"success": True})
     except Exception as e:
         return jsonify({"success": False, "error": str(e)}), 500
     finally:
         conn.close()
 
+@app.route('/listings/bulk', methods=['POST'])
+@require_auth(roles=['Farmer'])
+def bulk_listings():
+    # JSON array (or {"listings": [...]}) or a multipart CSV upload in "file".
+    # Every row is validated first; nothing is written unless all rows are
+    # valid, or ?partial=1 is given to insert just the valid ones.
+    if 'file' in request.files:
+        rows = parse_csv_rows(request.files['file'])
+    else:
+        data = request.get_json(silent=True)
+        rows = data.get('listings') if isinstance(data, dict) else data
+    if not isinstance(rows, list) or not rows:
+        return jsonify({"success": False, "error": "No listings provided"}), 400
+    if len(rows) > MAX_BULK_ROWS:
+        return jsonify({"success": False, "error": f"At most {MAX_BULK_ROWS} listings per upload"}), 400
+
+    results, valid = validate_listing_rows(rows, g.user['id'])
+    partial = request.args.get('partial') == '1'
+    if not valid or (len(valid) < len(rows) and not partial):
+        return jsonify({"success": False, "error": "Some rows are invalid, nothing was saved",
+                        "results": results}), 400
+
+    conn = get_db()
+    try:
+        insert_listings(conn, valid, results, actor_id=g.user['id'])
+        conn.commit()
+        for (index, params) in valid:
+            if params[-1] != '[]':
+                queue_listing_images(results[index]['listing_id'])
+        return jsonify({"success": True, "created": len(valid), "results": results})
+    except Exception as e:
+        conn.rollback()
+        return jsonify({"success": False, "error": str(e)}), 500
+    finally:
+        conn.close()
+
 @app.route('/requests', methods=['POST'])
+@require_auth(roles=['Buyer', 'Food Bank'])
 def create_request():
     data = request.json
+    # The requester is whoever holds the token, never an id from the body
+    is_foodbank = g.user['role'].lower() == 'food bank'
     conn = get_db()
-    c = conn.cursor()
     
-    c.execute('''INSERT INTO requests 
+    request_id = conn.insert('''INSERT INTO requests 
                  (listing_id, buyer_id, foodbank_id, quantity, purpose, status)
                  VALUES (?, ?, ?, ?, ?, ?)''',
-             (data['listing_id'], data.get('buyer_id'), data.get('foodbank_id'),
-              data['quantity'], data.get('purpose'), data.get('status', 'pending')))
+             (data['listing_id'], None if is_foodbank else g.user['id'], g.user['id'] if is_foodbank else None,
+              data['quantity'], data.get('purpose'), 'pending'))
+    # New requests always wait for the farmer; a status in the body is ignored
+    apply_request_change(conn, request_id, None, 'pending')
+    record(conn, 'request_created', g.user['id'], request_id=request_id, listing_id=data['listing_id'],
+           quantity=data['quantity'], status='pending')
     
     conn.commit()
-    request_id = c.lastrowid
     req = dict(conn.execute('SELECT * FROM requests WHERE id = ?', (request_id,)).fetchone())
     conn.close()
     return jsonify({"success": True, "request": req})
 
 # Get requests for a farmer (all requests for their listings)
 @app.route('/requests/farmer/<int:farmer_id>', methods=['GET'])
+@require_auth(owner='farmer_id')
 def farmer_requests(farmer_id):
-    conn = get_db()
-    requests = conn.execute('''
-        SELECT r.*, l.produce_type, 
-               COALESCE(u1.name, u2.name) as requester_name,
-               COALESCE(r.buyer_id, r.foodbank_id) as requester_id
-        FROM requests r
-        JOIN listings l ON r.listing_id = l.id
-        LEFT JOIN users u1 ON r.buyer_id = u1.id
-        LEFT JOIN users u2 ON r.foodbank_id = u2.id
-        WHERE l.farmer_id = ?
-    ''', (farmer_id,)).fetchall()
+    conn = read_db()
+    requests = query_farmer_requests(conn, farmer_id)
     conn.close()
-    return jsonify([dict(row) for row in requests])
+    return jsonify(requests)
 
 # Get requests made by a buyer
 @app.route('/requests/buyer/<int:buyer_id>', methods=['GET'])
+@require_auth(owner='buyer_id')
 def buyer_requests(buyer_id):
-    conn = get_db()
-    requests = conn.execute('''
-        SELECT r.*, l.produce_type, u.name as farmer_name
-        FROM requests r
-        JOIN listings l ON r.listing_id = l.id
-        JOIN users u ON l.farmer_id = u.id
-        WHERE r.buyer_id = ?
-    ''', (buyer_id,)).fetchall()
+    conn = read_db()
+    requests = query_buyer_requests(conn, buyer_id)
     conn.close()
-    return jsonify([dict(row) for row in requests])
+    return jsonify(requests)
 
 # Get requests made by a food bank
 @app.route('/requests/foodbank/<int:foodbank_id>', methods=['GET'])
+@require_auth(owner='foodbank_id')
 def foodbank_requests(foodbank_id):
-    conn = get_db()
-    requests = conn.execute('''
-        SELECT r.*, l.produce_type, u.name as farmer_name
-        FROM requests r
-        JOIN listings l ON r.listing_id = l.id
-        JOIN users u ON l.farmer_id = u.id
-        WHERE r.foodbank_id = ?
-    ''', (foodbank_id,)).fetchall()
+    conn = read_db()
+    requests = query_foodbank_requests(conn, foodbank_id)
     conn.close()
-    return jsonify([dict(row) for row in requests])
+    return jsonify(requests)
 
 # Update request status
 @app.route('/requests/<int:request_id>', methods=['PUT'])
+@require_auth()
 def update_request(request_id):
     conn = None
     try:
@@ -299,7 +476,7 @@ def update_request(request_id):
         if not data:
             return jsonify({"success": False, "error": "No data provided"}), 400
         
-        required_fields = ['status', 'quantity', 'listing_id', 'farmer_id']
+        required_fields = ['status']
         if not all(field in data for field in required_fields):
             return jsonify({
                 "success": False,
@@ -322,15 +499,24 @@ def update_request(request_id):
 
         request_data = dict(request_data)
         
-        # Authorization check
-        if int(request_data['listing_farmer_id']) != int(data['farmer_id']):
+        # Authorization check: the farmer decides, the requester confirms receipt
+        is_owner = int(request_data['listing_farmer_id']) == g.user['id']
+        confirms_receipt = (g.user['id'] in (request_data['buyer_id'], request_data['foodbank_id'])
+                            and data['status'] == 'completed' and request_data['status'] == 'approved')
+        if not (is_owner or confirms_receipt):
             return jsonify({
                 "success": False,
                 "error": "Unauthorized - you don't own this listing"
             }), 403
 
+        if data['status'] not in REQUEST_TRANSITIONS.get(request_data['status'], set()):
+            return jsonify({
+                "success": False,
+                "error": f"Can't move a request from {request_data['status']} to {data['status']}"
+            }), 400
+
         # Convert quantities to float for comparison
-        requested_qty = float(data['quantity'])
+        requested_qty = float(request_data['quantity'])
         available_qty = float(request_data['available_quantity'])
 
         # Quantity validation
@@ -346,6 +532,7 @@ def update_request(request_id):
             SET status = ?
             WHERE id = ?
         ''', (data['status'], request_id))
+        apply_request_change(conn, request_id, request_data['status'], data['status'])
 
         # Update listing quantity if approved
         if data['status'] == 'approved':
@@ -353,7 +540,12 @@ def update_request(request_id):
                 UPDATE listings
                 SET quantity = quantity - ?
                 WHERE id = ?
-            ''', (requested_qty, data['listing_id']))
+            ''', (requested_qty, request_data['listing_id']))
+            record(conn, 'quantity_decremented', g.user['id'], listing_id=request_data['listing_id'],
+                   quantity=requested_qty, request_id=request_id)
+            deactivate_sold_out(conn, [request_data['listing_id']], g.user['id'])
+        record(conn, f"request_{data['status']}", g.user['id'], request_id=request_id,
+               listing_id=request_data['listing_id'], previous=request_data['status'])
 
         conn.commit()
         return jsonify({"success": True, "message": "Request updated successfully"})
@@ -373,15 +565,111 @@ def update_request(request_id):
         if conn:
             conn.close()
 
+@app.route('/requests/bulk', methods=['PUT'])
+@require_auth(roles=['Farmer'])
+def bulk_update_requests():
+    # {"updates": [{"request_id": 5, "status": "approved"}, ...]}
+    data = request.get_json(silent=True) or {}
+    updates = data.get('updates')
+    if not isinstance(updates, list) or not updates:
+        return jsonify({"success": False, "error": "Need a list of updates"}), 400
+    if len(updates) > MAX_BULK_ROWS:
+        return jsonify({"success": False, "error": f"At most {MAX_BULK_ROWS} updates per call"}), 400
+
+    conn = get_db()
+    try:
+        # Lock out other writers so listing stock can't change between the checks and the writes
+        conn.begin_write('listings', 'requests')
+        results, valid = validate_request_updates(conn, g.user['id'], updates)
+        partial = request.args.get('partial') == '1'
+        if not valid or (len(valid) < len(updates) and not partial):
+            conn.rollback()
+            return jsonify({"success": False, "error": "Some updates are invalid, nothing was saved",
+                            "results": results}), 400
+        apply_request_updates(conn, valid, actor_id=g.user['id'])
+        conn.commit()
+        return jsonify({"success": True, "updated": len(valid), "results": results})
+    except Exception as e:
+        conn.rollback()
+        app.logger.error(f"Error in bulk request update: {str(e)}")
+        return jsonify({"success": False, "error": str(e)}), 500
+    finally:
+        conn.close()
+
+# What a food bank needs, used by the donation matcher
+@app.route('/foodbank/<int:foodbank_id>/demand', methods=['GET', 'PUT'])
+@require_auth(roles=['Food Bank'], owner='foodbank_id')
+def foodbank_demand(foodbank_id):
+    conn = get_db()
+    try:
+        if request.method == 'PUT':
+            data = request.get_json(silent=True) or {}
+            try:
+                set_demand(conn, foodbank_id, data.get('demand', []))
+            except (TypeError, ValueError) as e:
+                return jsonify({"success": False, "error": str(e)}), 400
+            record(conn, 'demand_updated', foodbank_id, foodbank_id=foodbank_id)
+            conn.commit()
+        return jsonify({"success": True, "demand": get_demand(conn, foodbank_id)})
+    finally:
+        conn.close()
+
+# Pickup tour over the food bank's approved requests
+@app.route('/foodbank/<int:foodbank_id>/route', methods=['GET'])
+@require_auth(owner='foodbank_id')
+def foodbank_pickup_route(foodbank_id):
+    try:
+        capacity_kg = float(request.args.get('capacity_kg', DEFAULT_CAPACITY_KG))
+        depot = None
+        if request.args.get('lat') and request.args.get('lon'):
+            depot = (float(request.args['lat']), float(request.args['lon']))
+    except ValueError:
+        return jsonify({"success": False, "error": "capacity_kg, lat and lon must be numbers"}), 400
+    if capacity_kg <= 0:
+        return jsonify({"success": False, "error": "capacity_kg must be greater than 0"}), 400
+
+    conn = read_db()
+    try:
+        route = foodbank_route(conn, foodbank_id, capacity_kg, depot)
+        return jsonify({"success": True, **route})
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    finally:
+        conn.close()
+
+@app.route('/matching/run', methods=['POST'])
+@require_auth(roles=['Food Bank'])
+def run_donation_matching():
+    # Matches for the calling food bank; {"dry_run": true} returns the
+    # allocation without creating requests. `python matching.py run` matches everyone.
+    data = request.get_json(silent=True) or {}
+    conn = get_db()
+    try:
+        conn.begin_write('listings', 'requests')
+        summary = run_matching(conn, g.user['id'], bool(data.get('dry_run')), actor_id=g.user['id'])
+        conn.commit()
+        return jsonify({"success": True, **summary})
+    except Exception as e:
+        conn.rollback()
+        app.logger.error(f"Error running donation matching: {str(e)}")
+        return jsonify({"success": False, "error": str(e)}), 500
+    finally:
+        conn.close()
+
 @app.route('/messages', methods=['POST'])
+@require_auth()
 def create_message():
     data = request.json
     conn = get_db()
     try:
-        conn.execute('''
+        message_id = conn.insert('''
             INSERT INTO messages (sender_id, receiver_id, content)
             VALUES (?, ?, ?)
-        ''', (data['sender_id'], data['receiver_id'], data['content']))
+        ''', (g.user['id'], data['receiver_id'], data['content']))
+        created_at = conn.execute('SELECT created_at FROM messages WHERE id = ?', (message_id,)).fetchone()[0]
+        record(conn, 'message_sent', g.user['id'], message_id=message_id, sender_id=g.user['id'],
+               receiver_id=data['receiver_id'], created_at=created_at)
+        catch_up(conn, 'conversations')
         conn.commit()
         return jsonify({"success": True})
     except Exception as e:
@@ -390,8 +678,9 @@ def create_message():
         conn.close()
 
 @app.route('/messages/<int:user1_id>/<int:user2_id>', methods=['GET'])
+@require_auth(owner='user1_id')
 def get_messages(user1_id, user2_id):
-    conn = get_db()
+    conn = read_db()
     try:
         messages = conn.execute('''
             SELECT m.*, u.name as sender_name
@@ -402,43 +691,117 @@ def get_messages(user1_id, user2_id):
             ORDER BY created_at
         ''', (user1_id, user2_id, user2_id, user1_id)).fetchall()
         
-        # Mark received messages as read
-        conn.execute('''
-            UPDATE messages SET read = 1
-            WHERE receiver_id = ? AND sender_id = ? AND read = 0
-        ''', (user1_id, user2_id))
-        conn.commit()
+        # Mark received messages as read in the background
+        unread = [msg['id'] for msg in messages if msg['receiver_id'] == user1_id and not msg['read']]
+        if unread:
+            queue_read_receipt(user1_id, user2_id, max(unread))
         
-        return jsonify([dict(msg) for msg in messages])
+        messages = [dict(msg) for msg in messages]
+        if request.args.get('archived') == '1':
+            # Older months live in partition files, opened only on request
+            hot_ids = {msg['id'] for msg in messages}
+            messages = [msg for msg in archived_messages(conn, user1_id, user2_id)
+                        if msg['id'] not in hot_ids] + messages
+        return jsonify(messages)
     except Exception as e:
         return jsonify({"success": False, "error": str(e)}), 500
     finally:
         conn.close()
 
 @app.route('/conversations/<int:user_id>', methods=['GET'])
+@require_auth(owner='user_id')
 def get_conversations(user_id):
-    conn = get_db()
+    conn = read_db()
     try:
-        conversations = conn.execute('''
-            SELECT 
-                CASE WHEN sender_id = ? THEN receiver_id ELSE sender_id END as partner_id,
-                u.name as partner_name,
-                MAX(m.created_at) as last_message_time,
-                SUM(CASE WHEN receiver_id = ? AND read = 0 THEN 1 ELSE 0 END) as unread_count
-            FROM messages m
-            JOIN users u ON CASE WHEN m.sender_id = ? THEN m.receiver_id ELSE m.sender_id END = u.id
-            WHERE sender_id = ? OR receiver_id = ?
-            GROUP BY partner_id, partner_name
-            ORDER BY last_message_time DESC
-        ''', (user_id, user_id, user_id, user_id, user_id)).fetchall()
-        
-        return jsonify([dict(conv) for conv in conversations])
+        conversations = query_conversations(conn, user_id)
+        return jsonify(conversations)
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+    finally:
+        conn.close()
+
+@app.route('/dashboard/<role>/<int:user_id>', methods=['GET'])
+@require_auth(owner='user_id')
+def dashboard(role, user_id):
+    role = role.lower().replace(' ', '').replace('_', '')
+    sections = DASHBOARD_SECTIONS.get(role)
+    if sections is None:
+        return jsonify({"success": False, "error": f"Unknown role: {role}"}), 404
+    
+    conn = read_db()
+    try:
+        # One read transaction so every section comes from the same snapshot
+        conn.begin_read()
+        # Nothing written since the client's copy: skip the queries entirely
+        etag = event_etag(conn, 'dashboard', role, user_id)
+        if etag in request.if_none_match:
+            return not_modified(etag)
+        payload = {name: query(conn, user_id) for name, query in sections.items()}
+        conn.commit()
     except Exception as e:
         return jsonify({"success": False, "error": str(e)}), 500
     finally:
         conn.close()
+    
+    payload['role'] = role
+    payload['user_id'] = user_id
+    return json_response(payload, etag)
+
+@app.route('/analytics/farmer/<int:farmer_id>', methods=['GET'])
+@require_auth(owner='farmer_id')
+def farmer_analytics(farmer_id):
+    conn = read_db()
+    try:
+        return jsonify(farmer_summary(conn, farmer_id))
+    finally:
+        conn.close()
+
+@app.route('/analytics/foodbank/<int:foodbank_id>', methods=['GET'])
+@require_auth(owner='foodbank_id')
+def foodbank_analytics(foodbank_id):
+    conn = read_db()
+    try:
+        return jsonify(foodbank_summary(conn, foodbank_id))
+    finally:
+        conn.close()
+
+@app.route('/analytics/counties', methods=['GET'])
+def county_analytics():
+    conn = read_db()
+    try:
+        return jsonify(county_donations(conn))
+    finally:
+        conn.close()
+
+# Precomputed by `python projections.py refresh`; never calls the model
+@app.route('/projections/supply', methods=['GET'])
+def projected_supply():
+    conn = read_db()
+    try:
+        return json_response(supply_projections(conn, request.args.get('county'),
+                                                 request.args.get('source')))
+    finally:
+        conn.close()
+
+@app.route('/farm_profile/<int:farmer_id>', methods=['PUT'])
+@require_auth(roles=['Farmer'], owner='farmer_id')
+def update_farm_profile(farmer_id):
+    data = request.get_json(silent=True)
+    if not data:
+        return jsonify({"success": False, "error": "No data provided"}), 400
+    conn = get_db()
+    try:
+        save_farm_profile(conn, farmer_id, data)
+        record(conn, 'farm_profile_saved', farmer_id, farmer_id=farmer_id)
+        conn.commit()
+        return jsonify({"success": True})
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    finally:
+        conn.close()
 
 @app.route('/update_profile', methods=['PUT'])
+@require_auth()
 def update_profile():
     data = request.json
     conn = get_db()
@@ -447,11 +810,13 @@ def update_profile():
             UPDATE users 
             SET name = ?, location = ?, phone = ?
             WHERE id = ?
-        ''', (data['name'], data['location'], data['phone'], data['user_id']))
+        ''', (data['name'], data['location'], data['phone'], g.user['id']))
+        record(conn, 'user_updated', g.user['id'], user_id=g.user['id'])
         conn.commit()
+        user_cache.invalidate(g.user['id'])
         
         # Return updated user data
-        user = conn.execute('SELECT * FROM users WHERE id = ?', (data['user_id'],)).fetchone()
+        user = conn.execute(f'SELECT {USER_FIELDS} FROM users WHERE id = ?', (g.user['id'],)).fetchone()
         return jsonify({"success": True, "user": dict(user)})
     except Exception as e:
         return jsonify({"success": False, "error": str(e)}), 500
@@ -459,57 +824,59 @@ def update_profile():
         conn.close()
 
 @app.route('/change_password', methods=['POST'])
+@require_auth()
 def change_password():
     data = request.json
     conn = get_db()
     try:
         # Verify current password
-        user = conn.execute('SELECT * FROM users WHERE id = ? AND password = ?',
-                          (data['user_id'], data['current_password'])).fetchone()
-        if not user:
-            return jsonify({"success": False, "message": "Current password is incorrect"}), 401
+        user = conn.execute('SELECT password FROM users WHERE id = ?', (g.user['id'],)).fetchone()
+        matches, _ = verify_password(data['current_password'], user['password'] if user else None)
+        if not matches:
+            # 403, not 401: the session itself is still valid
+            return jsonify({"success": False, "message": "Current password is incorrect"}), 403
         
         # Update password
         conn.execute('UPDATE users SET password = ? WHERE id = ?',
-                   (data['new_password'], data['user_id']))
+                   (hash_password(data['new_password']), g.user['id']))
+        record(conn, 'password_changed', g.user['id'], user_id=g.user['id'])
         conn.commit()
         return jsonify({"success": True})
+    except CredentialsBusy as e:
+        return jsonify({"success": False, "message": str(e)}), 503
     except Exception as e:
         return jsonify({"success": False, "error": str(e)}), 500
     finally:
         conn.close()
 
 @app.route('/update_profile_pic', methods=['PUT'])
+@require_auth()
 def update_profile_pic():
     conn = None
     try:
         data = request.get_json()
-        if not data or 'user_id' not in data or 'profile_pic' not in data:
+        if not data or 'profile_pic' not in data:
             return jsonify({"success": False, "error": "Missing required fields"}), 400
         
         conn = get_db()
         cursor = conn.cursor()
         
-        # Verify user exists first
-        user = cursor.execute('SELECT id FROM users WHERE id = ?', (data['user_id'],)).fetchone()
-        if not user:
-            return jsonify({"success": False, "error": "User not found"}), 404
-        
-        # Update profile picture
-        cursor.execute('''
-            UPDATE users 
-            SET profile_pic = ?
-            WHERE id = ?
-        ''', (data['profile_pic'], data['user_id']))
+        # Store the thumbnail in the avatar store; the users row keeps a reference
+        try:
+            save_avatar(conn, g.user['id'], data['profile_pic'])
+        except Exception as e:
+            return jsonify({"success": False, "error": f"Invalid image: {str(e)}"}), 400
+        record(conn, 'avatar_updated', g.user['id'], user_id=g.user['id'])
         
         conn.commit()
+        user_cache.invalidate(g.user['id'])
         
         # Get updated user data
-        updated_user = cursor.execute('''
-            SELECT id, name, email, role, location, phone, profile_pic
+        updated_user = cursor.execute(f'''
+            SELECT {USER_FIELDS}
             FROM users 
             WHERE id = ?
-        ''', (data['user_id'],)).fetchone()
+        ''', (g.user['id'],)).fetchone()
         
         return jsonify({
             "success": True,
@@ -529,6 +896,23 @@ def update_profile_pic():
         if conn:
             conn.close()
 
+@app.route('/avatars/<int:user_id>', methods=['GET'])
+def get_avatar(user_id):
+    conn = get_db()
+    avatar = load_avatar(conn, user_id)
+    conn.close()
+    if not avatar:
+        return jsonify({"success": False, "error": "Avatar not found"}), 404
+    
+    response = make_response(bytes(avatar['thumbnail']))
+    response.mimetype = 'image/jpeg'
+    response.set_etag(avatar['etag'])
+    # URLs carry ?v=<etag>, so a given URL never changes content
+    response.cache_control.public = True
+    response.cache_control.max_age = 31536000
+    response.cache_control.immutable = True
+    return response.make_conditional(request)
+
 @app.route('/health', methods=['GET'])
 def health_check():
     try:
@@ -545,6 +929,16 @@ def health_check():
             "error": str(e)
         }), 500
     
+# Admitted / rate-limited / shed counts per route class, and replica lag
+@app.route('/metrics', methods=['GET'])
+def admission_metrics():
+    jobs_conn = open_queue()
+    try:
+        jobs = queue_stats(jobs_conn)
+    finally:
+        jobs_conn.close()
+    return jsonify({**admission.metrics(), 'replica': read_router.metrics(), 'jobs': jobs})
+
 @app.route('/debug/request/<int:request_id>')
 def debug_request(request_id):
     conn = get_db()
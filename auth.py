@@ -0,0 +1,125 @@
+import functools
+import logging
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+from flask import g, jsonify, request
+from itsdangerous import BadSignature, URLSafeTimedSerializer
+
+from core.db import get_db
+from core.schema import USER_FIELDS
+
+logger = logging.getLogger(__name__)
+
+# Signed access tokens: the payload is the user id, so verifying one is an
+# HMAC check, not a query. User records (for role checks) come from an
+# in-process LRU, so an authorized request normally costs no extra queries.
+
+TOKEN_TTL = 12 * 60 * 60  # seconds
+TOKEN_SALT = 'access-token'
+USER_CACHE_SIZE = 1024
+USER_CACHE_TTL = 60  # seconds; bounds staleness across worker processes
+
+_secret = os.environ.get('SECRET_KEY')
+if not _secret:
+    # Tokens stop verifying on restart; set SECRET_KEY in production
+    logger.warning("SECRET_KEY is not set, using a random key for this process")
+    _secret = secrets.token_hex(32)
+_serializer = URLSafeTimedSerializer(_secret, salt=TOKEN_SALT)
+
+def issue_token(user):
+    return _serializer.dumps({'uid': user['id']})
+
+def verify_token(token):
+    """Return the user id the token was issued to, or None if invalid or expired."""
+    try:
+        return _serializer.loads(token, max_age=TOKEN_TTL)['uid']
+    except (BadSignature, KeyError, TypeError):  # SignatureExpired is a BadSignature
+        return None
+
+class UserCache:
+    """LRU of user records by id with a short TTL, safe to share between threads."""
+
+    def __init__(self, max_entries=USER_CACHE_SIZE, ttl=USER_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry and now - entry[0] < self.ttl:
+                self._entries.move_to_end(user_id)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        user = self._load(user_id)
+        if user is not None:
+            with self._lock:
+                self._entries[user_id] = (now, user)
+                self._entries.move_to_end(user_id)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return user
+
+    def _load(self, user_id):
+        conn = get_db()
+        try:
+            row = conn.execute(f'SELECT {USER_FIELDS} FROM users WHERE id = ?', (user_id,)).fetchone()
+            return dict(row) if row else None
+        finally:
+            conn.close()
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
+user_cache = UserCache()
+
+def _bearer_token():
+    header = request.headers.get('Authorization', '')
+    scheme, _, token = header.partition(' ')
+    return token.strip() if scheme.lower() == 'bearer' else None
+
+def token_user_id():
+    """User id from the request's bearer token, without loading the user."""
+    token = _bearer_token()
+    return verify_token(token) if token else None
+
+def require_auth(roles=None, owner=None, methods=None):
+    """Reject the request unless it carries a valid token; sets g.user.
+
+    roles limits the endpoint to those user roles; owner names a URL
+    parameter that must equal the caller's user id; methods limits the
+    check to those HTTP methods (e.g. POST on a route that also serves GET).
+    """
+    roles = {role.lower() for role in roles} if roles else None
+
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if methods and request.method not in methods:
+                return view(*args, **kwargs)
+            user_id = verify_token(_bearer_token() or '')
+            user = user_cache.get(user_id) if user_id is not None else None
+            if user is None:
+                return jsonify({"success": False, "error": "Login required"}), 401
+            if roles and user['role'].lower() not in roles:
+                return jsonify({"success": False, "error": "Not allowed for your role"}), 403
+            if owner and kwargs.get(owner) != user['id']:
+                return jsonify({"success": False, "error": "Unauthorized"}), 403
+            g.user = user
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator
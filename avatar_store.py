@@ -0,0 +1,56 @@
+import hashlib
+import logging
+
+from image_prep import make_thumbnail
+
+logger = logging.getLogger(__name__)
+
+# Every avatar is stored and served as one fixed-size square thumbnail
+AVATAR_SIZE = 128
+AVATAR_QUALITY = 85
+AVATAR_PREFIX = 'avatars/'
+
+def init_avatar_store(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS avatars
+                 (user_id INTEGER PRIMARY KEY,
+                 thumbnail BLOB NOT NULL,
+                 etag TEXT NOT NULL,
+                 updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                 FOREIGN KEY (user_id) REFERENCES users(id))''')
+
+def is_avatar_ref(value):
+    return isinstance(value, str) and value.startswith(AVATAR_PREFIX)
+
+def avatar_ref(user_id, etag):
+    # The version query string changes with the image, so clients can cache forever
+    return f"{AVATAR_PREFIX}{user_id}?v={etag}"
+
+def save_avatar(conn, user_id, image):
+    """Store a thumbnail for the user and point users.profile_pic at it."""
+    thumbnail = make_thumbnail(image, AVATAR_SIZE, AVATAR_QUALITY, square=True)
+    etag = hashlib.sha1(thumbnail).hexdigest()[:16]
+    conn.execute('''INSERT INTO avatars (user_id, thumbnail, etag, updated_at)
+                    VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+                    ON CONFLICT (user_id) DO UPDATE SET thumbnail = excluded.thumbnail,
+                        etag = excluded.etag, updated_at = excluded.updated_at''',
+                 (user_id, thumbnail, etag))
+    ref = avatar_ref(user_id, etag)
+    conn.execute('UPDATE users SET profile_pic = ? WHERE id = ?', (ref, user_id))
+    return ref
+
+def load_avatar(conn, user_id):
+    return conn.execute('SELECT thumbnail, etag FROM avatars WHERE user_id = ?',
+                        (user_id,)).fetchone()
+
+def migrate_inline_avatars(conn):
+    # Move base64 images still stored on the users row into the avatar store
+    rows = conn.execute('''SELECT id, profile_pic FROM users
+                           WHERE profile_pic IS NOT NULL AND profile_pic != ''
+                           AND profile_pic NOT LIKE ?''', (AVATAR_PREFIX + '%',)).fetchall()
+    for user_id, profile_pic in rows:
+        try:
+            save_avatar(conn, user_id, profile_pic)
+        except Exception as e:
+            logger.warning(f"Dropping unreadable profile picture for user {user_id}: {e}")
+            conn.execute('UPDATE users SET profile_pic = NULL WHERE id = ?', (user_id,))
+    return len(rows)
@@ -0,0 +1,73 @@
+import argparse
+import gzip
+import json
+import statistics
+import time
+
+from core import codec
+from core.db import get_db
+
+# Compares the wire formats the API can negotiate on a real listings payload:
+# bytes on the wire, server encode time and client decode time per format.
+
+def listings_payload(db_path=None):
+    conn = get_db(db_path)
+    try:
+        rows = conn.execute('''SELECT l.*, u.name as farmer_name, u.location
+                               FROM listings l JOIN users u ON l.farmer_id = u.id''').fetchall()
+        return [dict(row) for row in rows]
+    finally:
+        conn.close()
+
+def _timed(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - start)
+    return result, statistics.median(times) * 1000
+
+def encodings():
+    yield 'json', lambda p: json.dumps(p, separators=(',', ':'), default=str).encode(), json.loads
+    if codec.msgpack is not None:
+        yield 'msgpack', codec.pack, codec.unpack
+
+def compressions():
+    yield 'identity', None, lambda body: body
+    yield 'gzip', 'gzip', gzip.decompress
+    if codec.brotli is not None:
+        yield 'br', 'br', codec.brotli.decompress
+
+def benchmark(payload, repeat=20):
+    results = []
+    for name, encode, decode in encodings():
+        for compression, encoding, decompress in compressions():
+            # Mirror the API: bodies that don't compress well are sent as-is
+            if encoding and not codec.worth_compressing(encode(payload)):
+                compression, encoding, decompress = f'{compression} (skipped)', None, lambda body: body
+            def server():
+                body = encode(payload)
+                return codec.compress(body, encoding) if encoding else body
+            wire, encode_ms = _timed(server, repeat)
+            _, decode_ms = _timed(lambda: decode(decompress(wire)), repeat)
+            results.append((f'{name}+{compression}', len(wire), encode_ms, decode_ms))
+    return results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare API payload encodings")
+    parser.add_argument('--db', default=None)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args(argv)
+
+    payload = listings_payload(args.db)
+    results = benchmark(payload, args.repeat)
+    baseline = results[0][1]
+    print(f"{len(payload)} listings")
+    print(f"{'format':<26}{'bytes':>12}{'vs json':>9}{'encode ms':>11}{'decode ms':>11}")
+    for name, size, encode_ms, decode_ms in results:
+        print(f"{name:<26}{size:>12,}{size / baseline:>8.0%}{encode_ms:>11.2f}{decode_ms:>11.2f}")
+    if codec.msgpack is None or codec.brotli is None:
+        print("(install msgpack and brotli to compare every format)")
+
+if __name__ == '__main__':
+    main()
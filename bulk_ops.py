@@ -0,0 +1,163 @@
+import csv
+import io
+import json
+from datetime import date
+
+from events import record
+from rollups import apply_request_change
+
+MAX_BULK_ROWS = 500
+REQUEST_STATUSES = {'approved', 'rejected', 'completed', 'pending'}
+# Moves allowed from each status; approving twice would take the stock twice
+REQUEST_TRANSITIONS = {
+    'pending': {'approved', 'rejected'},
+    'rejected': {'pending'},
+    'approved': {'completed'},
+    'completed': set(),
+}
+TRUE_VALUES = {'1', 'true', 'yes', 'y'}
+
+# ----- Listings -----
+def parse_csv_rows(file_storage):
+    text = io.TextIOWrapper(file_storage.stream, encoding='utf-8-sig')
+    return [dict(row) for row in csv.DictReader(text)]
+
+def _parse_date(value, field):
+    try:
+        return date.fromisoformat(str(value).strip()).isoformat()
+    except ValueError:
+        raise ValueError(f"{field} must be a YYYY-MM-DD date")
+
+def validate_listing_row(row, default_farmer_id=None):
+    """Return the INSERT parameters for one listing, or raise ValueError."""
+    farmer_id = default_farmer_id or row.get('farmer_id')
+    if not farmer_id:
+        raise ValueError("farmer_id is required")
+    produce_type = str(row.get('produce_type') or '').strip()
+    if not produce_type:
+        raise ValueError("produce_type is required")
+    try:
+        quantity = float(row.get('quantity'))
+        price = float(row.get('price') or 0)
+    except (TypeError, ValueError):
+        raise ValueError("quantity and price must be numbers")
+    if quantity <= 0:
+        raise ValueError("quantity must be greater than 0")
+    if price < 0:
+        raise ValueError("price can't be negative")
+    harvest_date = _parse_date(row.get('harvest_date'), 'harvest_date')
+    best_before = _parse_date(row.get('best_before'), 'best_before')
+    if best_before < harvest_date:
+        raise ValueError("best_before is before harvest_date")
+    organic = row.get('organic', False)
+    if isinstance(organic, str):
+        organic = organic.strip().lower() in TRUE_VALUES
+    images = row.get('images') or []
+    if isinstance(images, str):
+        images = json.loads(images)
+    return (int(farmer_id), produce_type, quantity, price, row.get('description'),
+            harvest_date, best_before, bool(organic), json.dumps(images))
+
+def validate_listing_rows(rows, default_farmer_id=None):
+    results = []
+    valid = []
+    for index, row in enumerate(rows):
+        try:
+            valid.append((index, validate_listing_row(row, default_farmer_id)))
+            results.append({"row": index, "success": True})
+        except (ValueError, TypeError) as e:
+            results.append({"row": index, "success": False, "error": str(e)})
+    return results, valid
+
+def insert_listings(conn, valid, results, actor_id=None):
+    listing_ids = conn.insert_many('''INSERT INTO listings
+                                      (farmer_id, produce_type, quantity, price, description,
+                                       harvest_date, best_before, organic, images)
+                                      VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)''', [params for _, params in valid])
+    for listing_id, (index, params) in zip(listing_ids, valid):
+        results[index]['listing_id'] = listing_id
+        record(conn, 'listing_created', actor_id, listing_id=listing_id, produce_type=params[1],
+               quantity=params[2], price=params[3], status='active')
+
+# ----- Requests -----
+def validate_request_updates(conn, farmer_id, updates):
+    """Check ownership, status and stock for every update before applying any."""
+    results = []
+    request_ids = []
+    for index, update in enumerate(updates):
+        try:
+            request_ids.append(int(update['request_id']))
+        except (KeyError, TypeError, ValueError):
+            request_ids.append(None)
+
+    known_ids = [rid for rid in request_ids if rid is not None]
+    placeholders = ', '.join('?' for _ in known_ids) or 'NULL'
+    rows = conn.execute(f'''
+        SELECT r.id, r.listing_id, r.quantity, r.status,
+               l.farmer_id as listing_farmer_id, l.quantity as available_quantity
+        FROM requests r
+        JOIN listings l ON r.listing_id = l.id
+        WHERE r.id IN ({placeholders})
+    ''', known_ids).fetchall()
+    found = {row['id']: dict(row) for row in rows}
+
+    # Approvals in the same batch draw down the same listing stock
+    remaining = {row['listing_id']: float(row['available_quantity']) for row in found.values()}
+    valid = []
+    seen = set()
+    for index, (update, request_id) in enumerate(zip(updates, request_ids)):
+        result = {"row": index, "request_id": request_id, "success": False}
+        results.append(result)
+        status = update.get('status') if isinstance(update, dict) else None
+        req = found.get(request_id)
+        duplicate = request_id in seen
+        seen.add(request_id)
+        if request_id is None:
+            result['error'] = "request_id is required"
+        elif duplicate:
+            result['error'] = "Request is listed more than once"
+        elif req is None:
+            result['error'] = "Request not found"
+        elif int(req['listing_farmer_id']) != int(farmer_id):
+            result['error'] = "Unauthorized - you don't own this listing"
+        elif status not in REQUEST_STATUSES:
+            result['error'] = f"status must be one of: {', '.join(sorted(REQUEST_STATUSES))}"
+        elif status not in REQUEST_TRANSITIONS.get(req['status'], set()):
+            result['error'] = f"Can't move a request from {req['status']} to {status}"
+        elif status == 'approved' and float(req['quantity']) > remaining[req['listing_id']]:
+            result['error'] = (f"Requested quantity ({req['quantity']}) exceeds available "
+                               f"quantity ({remaining[req['listing_id']]})")
+        else:
+            if status == 'approved':
+                remaining[req['listing_id']] -= float(req['quantity'])
+            result['success'] = True
+            valid.append((req, status))
+    return results, valid
+
+def deactivate_sold_out(conn, listing_ids, actor_id=None):
+    # Approvals that take a listing's last kg also take it off the market;
+    # call in the same transaction as the decrement
+    for listing_id in listing_ids:
+        updated = conn.execute('''UPDATE listings SET status = 'inactive'
+                                  WHERE id = ? AND quantity <= 0 AND status = 'active' ''',
+                               (listing_id,)).rowcount
+        if updated:
+            record(conn, 'listing_status_changed', actor_id, listing_id=listing_id, status='inactive')
+
+def apply_request_updates(conn, valid, actor_id=None):
+    conn.executemany('UPDATE requests SET status = ? WHERE id = ?',
+                     [(status, req['id']) for req, status in valid])
+    decrements = {}
+    for req, status in valid:
+        if status == 'approved':
+            decrements[req['listing_id']] = decrements.get(req['listing_id'], 0) + float(req['quantity'])
+    conn.executemany('UPDATE listings SET quantity = quantity - ? WHERE id = ?',
+                     [(qty, listing_id) for listing_id, qty in decrements.items()])
+    deactivate_sold_out(conn, decrements, actor_id)
+    for req, status in valid:
+        apply_request_change(conn, req['id'], req['status'], status)
+        if status == 'approved':
+            record(conn, 'quantity_decremented', actor_id, listing_id=req['listing_id'],
+                   quantity=float(req['quantity']), request_id=req['id'])
+        record(conn, f'request_{status}', actor_id, request_id=req['id'],
+               listing_id=req['listing_id'], previous=req['status'])
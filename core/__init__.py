@@ -0,0 +1,3 @@
+# Shared pieces for the Flask backend and the Streamlit frontend. Nothing in
+# this package opens the database, touches the network or imports heavy
+# libraries at import time.
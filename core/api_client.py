@@ -0,0 +1,82 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from core.codec import accept_headers, decode_response
+
+PAGE_DEADLINE = 8.0  # seconds shared by every GET a page issues
+MAX_WORKERS = 8
+
+_session = None
+_session_lock = threading.Lock()
+_executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix='api-fetch')
+
+def http_session():
+    # One keep-alive session per process; requests.Session is safe for
+    # concurrent GETs once its adapters are mounted
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            # Ask for MessagePack and compression when the server offers them
+            _session.headers.update(accept_headers())
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=MAX_WORKERS * 2)
+            _session.mount('http://', adapter)
+            _session.mount('https://', adapter)
+        return _session
+
+# Returned in place of data when the server answers 304 to an If-None-Match
+NOT_MODIFIED = object()
+
+def _get(url, timeout, etag=None, headers=None):
+    headers = dict(headers or {})
+    if etag:
+        headers['If-None-Match'] = etag
+    response = http_session().get(url, timeout=timeout, headers=headers)
+    if response.status_code == 304:
+        return NOT_MODIFIED, etag
+    response.raise_for_status()
+    return decode_response(response), response.headers.get('ETag')
+
+def fetch_many(base_url, endpoints, deadline=PAGE_DEADLINE, etags=None, headers=None):
+    """GET every endpoint concurrently and stop waiting once the deadline passes.
+
+    Returns (results, errors, etags, elapsed, responses): results maps
+    endpoint -> parsed JSON (or NOT_MODIFIED) for the calls that finished in
+    time, errors maps endpoint -> message for the rest, etags holds any ETags
+    the server sent, and responses keeps the HTTP responses of calls that got
+    an error status, so the caller can act on a 401 or 429 as for one call.
+    """
+    start = time.monotonic()
+    base_url = base_url.rstrip('/')
+    etags = etags or {}
+    futures = {
+        _executor.submit(_get, f"{base_url}/{endpoint}", deadline, etags.get(endpoint), headers): endpoint
+        for endpoint in dict.fromkeys(endpoints)
+    }
+    done, pending = wait(futures, timeout=deadline)
+
+    results = {}
+    errors = {}
+    new_etags = {}
+    responses = {}
+    for future in done:
+        endpoint = futures[future]
+        try:
+            results[endpoint], etag = future.result()
+            if etag:
+                new_etags[endpoint] = etag
+        except requests.exceptions.RequestException as e:
+            errors[endpoint] = str(e)
+            if e.response is not None:
+                responses[endpoint] = e.response
+        except ValueError as e:
+            errors[endpoint] = f"Invalid response body: {e}"
+    for future in pending:
+        # Slow calls finish in the background; the page renders without them
+        future.cancel()
+        errors[futures[future]] = f"Timed out after {deadline:.0f}s"
+    return results, errors, new_etags, time.monotonic() - start, responses
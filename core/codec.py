@@ -0,0 +1,98 @@
+import base64
+import binascii
+import gzip
+import json
+import zlib
+
+# Wire formats shared by the API and its clients. JSON is always available;
+# MessagePack (images as raw bytes instead of base64) and brotli are used
+# only when their packages are installed on both ends.
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+JSON = 'application/json'
+MSGPACK = 'application/msgpack'
+COMPRESS_MIN_BYTES = 1024  # below this the headers cost more than compression saves
+GZIP_LEVEL = 5
+BROTLI_QUALITY = 4  # fast enough to run per response
+SAMPLE_BYTES = 32 * 1024
+
+def _accepted(header, token):
+    # True if token is listed in an Accept/Accept-Encoding header with q > 0
+    for part in (header or '').split(','):
+        name, *params = part.split(';')
+        if name.strip().lower() == token:
+            for param in params:
+                key, _, value = param.strip().partition('=')
+                if key.strip().lower() == 'q':
+                    try:
+                        return float(value) > 0
+                    except ValueError:
+                        return True  # a garbled weight doesn't opt out
+            return True
+    return False
+
+def wants_msgpack(accept_header):
+    return msgpack is not None and _accepted(accept_header, MSGPACK)
+
+def choose_encoding(accept_encoding):
+    if brotli is not None and _accepted(accept_encoding, 'br'):
+        return 'br'
+    if _accepted(accept_encoding, 'gzip'):
+        return 'gzip'
+    return None
+
+def worth_compressing(body):
+    # Raw JPEG/PNG bytes in a MessagePack body barely shrink, so try a quick
+    # level-1 pass over two samples before spending time on the whole body
+    middle = len(body) // 2
+    sample = body[:SAMPLE_BYTES] + body[middle:middle + SAMPLE_BYTES]
+    return len(zlib.compress(sample, 1)) < len(sample) * 0.9
+
+def compress(body, encoding):
+    if encoding == 'br':
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL)
+
+def _images_to_bytes(value):
+    # listings.images is stored as a JSON string of base64 images
+    try:
+        images = json.loads(value) if isinstance(value, str) else value
+        if not isinstance(images, list):
+            return value
+        return [base64.b64decode(image, validate=True) if isinstance(image, str) else image
+                for image in images]
+    except (binascii.Error, ValueError):
+        return value
+
+def _binary_images(payload):
+    if isinstance(payload, list):
+        return [_binary_images(item) for item in payload]
+    if isinstance(payload, dict):
+        return {key: _images_to_bytes(value) if key == 'images' and value else _binary_images(value)
+                for key, value in payload.items()}
+    return payload
+
+def pack(payload):
+    return msgpack.packb(_binary_images(payload), use_bin_type=True, default=str)
+
+def unpack(body):
+    return msgpack.unpackb(body, raw=False)
+
+def accept_headers():
+    # What clients send so the API answers in the most compact form available
+    accept = f'{MSGPACK}, {JSON};q=0.9' if msgpack is not None else JSON
+    encodings = 'br, gzip' if brotli is not None else 'gzip'
+    return {'Accept': accept, 'Accept-Encoding': encodings}
+
+def decode_response(response):
+    """Parse a requests.Response body as MessagePack or JSON by its Content-Type."""
+    if response.headers.get('Content-Type', '').startswith(MSGPACK):
+        return unpack(response.content)
+    return response.json()
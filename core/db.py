@@ -0,0 +1,282 @@
+import os
+import re
+import sqlite3
+import threading
+from contextlib import contextmanager
+from functools import lru_cache
+
+# Storage backends. DATABASE_URL=postgresql://... stores everything in
+# PostgreSQL through a connection pool, so several API nodes can share one
+# database; otherwise it's the SQLite file at FOOD_DONATION_DB. Either way
+# get_db() hands out a connection with the sqlite3 interface the code is
+# written against (execute/executemany/cursor/commit/rollback/close, rows
+# readable by name and by index), plus the calls whose SQL differs:
+#   insert(sql, params) -> id of the new row
+#   insert_many(sql, rows) -> ids of the new rows, in order
+#   begin_read() -> start a transaction that reads one consistent snapshot
+#   begin_write(*tables) -> start a transaction no other writer can interleave with
+#   vacuum(*tables) -> reclaim the space of deleted rows without blocking other connections
+# Queries use ? placeholders, single-quoted strings, TRUE/FALSE for flags and
+# ON CONFLICT upserts, which both backends understand.
+
+DB_PATH = os.environ.get('FOOD_DONATION_DB', 'food_donation.db')
+DATABASE_URL = os.environ.get('DATABASE_URL', '')
+# Optional read replica: 'wal' (read-only connections to the primary file in
+# WAL mode), a SQLite copy kept fresh by `python replicas.py refresh`, or a
+# postgresql:// streaming replica
+READ_REPLICA = os.environ.get('READ_REPLICA', '')
+POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 10))  # per API process
+POOL_TIMEOUT = 10.0  # seconds to wait for a free pooled connection
+VACUUM_STEP_PAGES = 256  # free pages returned per incremental_vacuum write
+
+# Raised on constraint violations by both backends
+IntegrityError = sqlite3.IntegrityError
+
+def is_postgres(url=None):
+    return (url if url is not None else DATABASE_URL).startswith(('postgres://', 'postgresql://'))
+
+class SQLiteConnection(sqlite3.Connection):
+    dialect = 'sqlite'
+
+    def insert(self, sql, params=()):
+        return self.execute(sql, params).lastrowid
+
+    def insert_many(self, sql, rows):
+        # Rows inserted by one executemany in one transaction get consecutive ids
+        rows = list(rows)
+        self.executemany(sql, rows)
+        last_id = self.execute('SELECT last_insert_rowid()').fetchone()[0]
+        return list(range(last_id - len(rows) + 1, last_id + 1)) if rows else []
+
+    def begin_read(self):
+        self.execute('BEGIN')
+
+    def begin_write(self, *tables):
+        # SQLite has one writer for the whole file
+        self.execute('BEGIN IMMEDIATE')
+
+    def vacuum(self, *tables):
+        # Only files in auto_vacuum=INCREMENTAL mode (2) can shrink online; each
+        # step is its own short write so other writers get in between steps.
+        # Returns the number of pages given back to the filesystem.
+        self.commit()
+        if self.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+            return 0
+        start = free = self.execute('PRAGMA freelist_count').fetchone()[0]
+        while free:
+            # executescript steps the pragma to the end; execute() frees one page
+            self.executescript(f'PRAGMA incremental_vacuum({VACUUM_STEP_PAGES});')
+            remaining = self.execute('PRAGMA freelist_count').fetchone()[0]
+            if remaining >= free:
+                break
+            free = remaining
+        return start - free
+
+# ----- PostgreSQL -----
+# Types and defaults that SQLite spells differently. Timestamps are kept as
+# 'YYYY-MM-DD HH:MM:SS' text in UTC, exactly what SQLite's CURRENT_TIMESTAMP
+# stores, so string comparisons and SUBSTR(created_at, 1, 10) agree.
+PG_NOW = "to_char(now() AT TIME ZONE 'UTC', 'YYYY-MM-DD HH24:MI:SS')"
+PG_DDL = [
+    (re.compile(r'\bINTEGER PRIMARY KEY AUTOINCREMENT\b', re.I), 'SERIAL PRIMARY KEY'),
+    (re.compile(r'\bBLOB\b', re.I), 'BYTEA'),
+    (re.compile(r'\bREAL\b', re.I), 'DOUBLE PRECISION'),
+    (re.compile(r'(?<!CURRENT_)\bTIMESTAMP\b', re.I), 'TEXT'),
+]
+_CURRENT_TIMESTAMP = re.compile(r'\bCURRENT_TIMESTAMP\b', re.I)
+_TOKENS = re.compile(r"('(?:[^']|'')*')|(\?)|(%)")
+
+@lru_cache(maxsize=512)
+def pg_sql(sql, has_params=True):
+    """Rewrite a query written for SQLite into psycopg2's dialect."""
+    if sql.lstrip().upper().startswith('CREATE TABLE'):
+        for pattern, replacement in PG_DDL:
+            sql = pattern.sub(replacement, sql)
+    sql = _CURRENT_TIMESTAMP.sub(PG_NOW, sql)
+    if not has_params:
+        return sql
+
+    def token(match):
+        literal, placeholder, _ = match.groups()
+        if literal:
+            return literal.replace('%', '%%')
+        return '%s' if placeholder else '%%'
+    return _TOKENS.sub(token, sql)
+
+@contextmanager
+def _sqlite_errors():
+    # Raise psycopg2's errors as the sqlite3 ones callers already catch
+    import psycopg2
+    try:
+        yield
+    except psycopg2.IntegrityError as e:
+        raise IntegrityError(str(e)) from e
+    except (psycopg2.OperationalError, psycopg2.ProgrammingError) as e:
+        # SQLite reports lost connections, bad SQL and missing tables alike
+        raise sqlite3.OperationalError(str(e)) from e
+    except psycopg2.Error as e:
+        raise sqlite3.DatabaseError(str(e)) from e
+
+class PgCursor:
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def execute(self, sql, params=()):
+        params = tuple(params) if params else None
+        with _sqlite_errors():
+            self._cursor.execute(pg_sql(sql, params is not None), params)
+        return self
+
+    def executemany(self, sql, rows):
+        with _sqlite_errors():
+            self._cursor.executemany(pg_sql(sql), [tuple(row) for row in rows])
+        return self
+
+    def fetchone(self):
+        return self._cursor.fetchone()
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+class PgConnection:
+    dialect = 'postgres'
+
+    def __init__(self, pool, raw):
+        self._pool = pool
+        self._raw = raw
+
+    def cursor(self):
+        import psycopg2.extras
+        return PgCursor(self._raw.cursor(cursor_factory=psycopg2.extras.DictCursor))
+
+    def execute(self, sql, params=()):
+        return self.cursor().execute(sql, params)
+
+    def executemany(self, sql, rows):
+        return self.cursor().executemany(sql, rows)
+
+    def insert(self, sql, params=()):
+        return self.execute(sql.rstrip() + ' RETURNING id', params).fetchone()[0]
+
+    def insert_many(self, sql, rows):
+        # Ids from a sequence aren't consecutive under concurrent writers
+        return [self.insert(sql, row) for row in rows]
+
+    def begin_read(self):
+        self.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ')
+
+    def begin_write(self, *tables):
+        # Block other writers to these tables (not readers) until commit,
+        # like BEGIN IMMEDIATE does for the whole SQLite file
+        if tables:
+            self.execute(f"LOCK TABLE {', '.join(tables)} IN SHARE ROW EXCLUSIVE MODE")
+
+    def vacuum(self, *tables):
+        # Plain VACUUM only takes a lock that still allows reads and writes,
+        # but can't run inside a transaction
+        self._raw.commit()
+        self._raw.autocommit = True
+        try:
+            with _sqlite_errors():
+                for table in tables:
+                    self._raw.cursor().execute(f'VACUUM (ANALYZE) {table}')
+        finally:
+            self._raw.autocommit = False
+        return None
+
+    def commit(self):
+        with _sqlite_errors():
+            self._raw.commit()
+
+    def rollback(self):
+        with _sqlite_errors():
+            self._raw.rollback()
+
+    def close(self):
+        if self._raw is None:
+            return
+        raw, self._raw = self._raw, None
+        self._pool.putconn(raw)
+
+    def __del__(self):
+        # A connection dropped without close() still goes back to the pool
+        self.close()
+
+def _register_numpy():
+    # sqlite3 takes numpy scalars as the floats/ints they subclass; psycopg2
+    # would quote their repr, so adapt them to plain Python numbers first
+    try:
+        import numpy as np
+    except ImportError:
+        return
+    from psycopg2.extensions import adapt, register_adapter
+    for np_type, py_type in ((np.float64, float), (np.float32, float), (np.int64, int), (np.int32, int), (np.bool_, bool)):
+        register_adapter(np_type, lambda value, py_type=py_type: adapt(py_type(value)))
+
+class PgPool:
+    """Fixed-size psycopg2 pool; get() waits for a free connection instead of failing."""
+
+    def __init__(self, url, size=POOL_SIZE):
+        from psycopg2.pool import ThreadedConnectionPool
+        _register_numpy()
+        self._pool = ThreadedConnectionPool(1, size, url)
+        self._slots = threading.BoundedSemaphore(size)
+
+    def get(self):
+        if not self._slots.acquire(timeout=POOL_TIMEOUT):
+            raise sqlite3.OperationalError("Timed out waiting for a database connection")
+        try:
+            with _sqlite_errors():
+                return PgConnection(self, self._pool.getconn())
+        except Exception:
+            self._slots.release()
+            raise
+
+    def putconn(self, raw):
+        try:
+            # Whatever the caller left uncommitted is discarded
+            raw.rollback()
+            self._pool.putconn(raw)
+        except Exception:
+            self._pool.putconn(raw, close=True)
+        finally:
+            self._slots.release()
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+def _pg_pool(url):
+    with _pools_lock:
+        if url not in _pools:
+            _pools[url] = PgPool(url)
+        return _pools[url]
+
+def get_db(path=None):
+    """Connection to the configured database, or to the SQLite file at path."""
+    if path is None and is_postgres():
+        return _pg_pool(DATABASE_URL).get()
+    conn = sqlite3.connect(path or DB_PATH, factory=SQLiteConnection)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+def get_replica_db():
+    """Read-only connection to the replica, or None when there isn't one."""
+    if not READ_REPLICA:
+        return None
+    if is_postgres(READ_REPLICA):
+        return _pg_pool(READ_REPLICA).get()
+    path = DB_PATH if READ_REPLICA == 'wal' else READ_REPLICA
+    conn = sqlite3.connect(f'file:{path}?mode=ro', uri=True, factory=SQLiteConnection)
+    conn.row_factory = sqlite3.Row
+    return conn
@@ -0,0 +1,94 @@
+from core.db import READ_REPLICA, get_db
+
+# Columns returned to clients; profile_pic only holds an avatar reference
+USER_FIELDS = 'id, name, email, role, location, phone, profile_pic, created_at'
+
+def init_db(path=None):
+    # Feature tables live with the modules that own them; those modules pull
+    # in numpy/pandas/PIL, so they're only imported when the schema is built
+    from avatar_store import init_avatar_store, migrate_inline_avatars
+    from rollups import init_rollups, rebuild_rollups
+    from matching import init_matching
+    from projections import init_projections
+    from messaging import init_messaging
+    from events import catch_up, init_events, load_projections
+
+    conn = get_db(path)
+    if conn.dialect == 'sqlite':
+        # Lets a new file shrink online (see vacuum() in core/db.py); an
+        # existing one switches over with `python messaging.py vacuum --full`
+        conn.execute('PRAGMA auto_vacuum=INCREMENTAL')
+    if READ_REPLICA == 'wal' and conn.dialect == 'sqlite':
+        # Readers on their own connections then never block the writer
+        conn.execute('PRAGMA journal_mode=WAL')
+    c = conn.cursor()
+    
+    # Create tables
+    c.execute('''CREATE TABLE IF NOT EXISTS users
+                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                 name TEXT NOT NULL,
+                 email TEXT UNIQUE NOT NULL,
+                 password TEXT NOT NULL,
+                 role TEXT NOT NULL,
+                 location TEXT,
+                 phone TEXT,
+                 profile_pic TEXT,
+                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
+    
+    c.execute('''CREATE TABLE IF NOT EXISTS listings
+                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                 farmer_id INTEGER NOT NULL,
+                 produce_type TEXT NOT NULL,
+                 quantity REAL NOT NULL,
+                 price REAL DEFAULT 0,
+                 description TEXT,
+                 harvest_date TEXT,
+                 best_before TEXT,
+                 organic BOOLEAN DEFAULT FALSE,
+                 images TEXT,
+                 status TEXT DEFAULT 'active',
+                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                 FOREIGN KEY (farmer_id) REFERENCES users(id))''')
+    
+    c.execute('''CREATE TABLE IF NOT EXISTS requests
+                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                 listing_id INTEGER NOT NULL,
+                 buyer_id INTEGER,
+                 foodbank_id INTEGER,
+                 quantity REAL NOT NULL,
+                 purpose TEXT,
+                 status TEXT DEFAULT 'pending',
+                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                 county TEXT,
+                 FOREIGN KEY (listing_id) REFERENCES listings(id),
+                 FOREIGN KEY (buyer_id) REFERENCES users(id),
+                 FOREIGN KEY (foodbank_id) REFERENCES users(id))''')
+    
+    c.execute('''CREATE TABLE IF NOT EXISTS messages
+                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                 sender_id INTEGER NOT NULL,
+                 receiver_id INTEGER NOT NULL,
+                 content TEXT NOT NULL,
+                 read BOOLEAN DEFAULT FALSE,
+                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                 FOREIGN KEY (sender_id) REFERENCES users(id),
+                 FOREIGN KEY (receiver_id) REFERENCES users(id))''')
+    
+    init_avatar_store(conn)
+    migrate_inline_avatars(conn)
+    
+    init_rollups(conn)
+    if not conn.execute('SELECT 1 FROM daily_rollups LIMIT 1').fetchone():
+        rebuild_rollups(conn)
+    
+    init_matching(conn)
+    init_projections(conn)
+    
+    init_events(conn)
+    init_messaging(conn)
+    for name in load_projections():
+        catch_up(conn, name)
+    
+    conn.commit()
+    conn.close()
+
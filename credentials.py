@@ -0,0 +1,112 @@
+import argparse
+import base64
+import hashlib
+import hmac
+import os
+import secrets
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+# Password hashing with scrypt. Hashes are stored as
+#   scrypt$<n>$<r>$<p>$<salt>$<hash>
+# so the cost can be raised later: rows hashed at an older cost, and legacy
+# plaintext rows, are rehashed on the next successful login. The KDF runs in
+# a small process pool so a burst of logins can't starve request threads.
+
+SCRYPT_N = int(os.environ.get('PASSWORD_SCRYPT_N', 2 ** 14))  # ~16 MB and tens of ms per hash
+SCRYPT_R = 8
+SCRYPT_P = 1
+HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', 2))  # 0 hashes on the calling thread
+MAX_PENDING = HASH_WORKERS * 8  # queued hashes beyond this are refused rather than piling up
+QUEUE_TIMEOUT = 2.0  # seconds to wait for a slot before giving up
+PREFIX = 'scrypt'
+
+class CredentialsBusy(Exception):
+    """Too many hashes are already queued; the caller should answer 503."""
+
+def _scrypt(password, salt, n, r, p):
+    return hashlib.scrypt(password.encode('utf-8'), salt=salt, n=n, r=r, p=p,
+                          maxmem=128 * r * (n + p + 2), dklen=32)
+
+_pool = None
+_pool_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(max(MAX_PENDING, 1))
+
+def _run(password, salt, n, r, p):
+    if HASH_WORKERS <= 0:
+        return _scrypt(password, salt, n, r, p)
+    global _pool
+    if not _slots.acquire(timeout=QUEUE_TIMEOUT):
+        raise CredentialsBusy("Too many logins in progress, try again shortly")
+    try:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ProcessPoolExecutor(max_workers=HASH_WORKERS)
+        return _pool.submit(_scrypt, password, salt, n, r, p).result()
+    finally:
+        _slots.release()
+
+def _b64(data):
+    return base64.b64encode(data).decode('ascii')
+
+def hash_password(password, n=SCRYPT_N, r=SCRYPT_R, p=SCRYPT_P):
+    salt = secrets.token_bytes(16)
+    digest = _run(password, salt, n, r, p)
+    return f'{PREFIX}${n}${r}${p}${_b64(salt)}${_b64(digest)}'
+
+def is_hashed(stored):
+    return isinstance(stored, str) and stored.startswith(PREFIX + '$')
+
+# Salt for the throwaway scrypt run on a missing hash, so an unknown email
+# costs the same as a wrong password
+_DUMMY_SALT = secrets.token_bytes(16)
+
+def verify_password(password, stored):
+    """Return (matches, needs_rehash) for a password against a stored value."""
+    if not stored:
+        _run(password, _DUMMY_SALT, SCRYPT_N, SCRYPT_R, SCRYPT_P)
+        return False, False
+    if not is_hashed(stored):
+        # Legacy plaintext row
+        matches = hmac.compare_digest(password.encode('utf-8'), stored.encode('utf-8'))
+        return matches, matches
+    try:
+        _, n, r, p, salt, digest = stored.split('$')
+        n, r, p = int(n), int(r), int(p)
+        salt, digest = base64.b64decode(salt), base64.b64decode(digest)
+    except ValueError:
+        return False, False
+    matches = hmac.compare_digest(_run(password, salt, n, r, p), digest)
+    return matches, matches and (n, r, p) != (SCRYPT_N, SCRYPT_R, SCRYPT_P)
+
+def benchmark(n=SCRYPT_N, seconds=5.0, workers=None):
+    workers = workers or os.cpu_count()
+    salt = secrets.token_bytes(16)
+    start, done = time.perf_counter(), 0
+    while time.perf_counter() - start < seconds:
+        _scrypt('correct horse battery staple', salt, n, SCRYPT_R, SCRYPT_P)
+        done += 1
+    per_core = done / (time.perf_counter() - start)
+    print(f"scrypt n={n} r={SCRYPT_R} p={SCRYPT_P}: {1000 / per_core:.1f} ms per hash, "
+          f"{per_core:.1f} logins/sec per core")
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        batch = max(int(per_core * seconds), workers)
+        start = time.perf_counter()
+        list(pool.map(_scrypt, ['pw'] * batch, [salt] * batch, [n] * batch,
+                      [SCRYPT_R] * batch, [SCRYPT_P] * batch))
+        total = batch / (time.perf_counter() - start)
+    print(f"{workers} worker processes: {total:.1f} logins/sec")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure password hashing throughput")
+    parser.add_argument('command', choices=['benchmark'])
+    parser.add_argument('--n', type=int, default=SCRYPT_N, help="scrypt cost (power of two)")
+    parser.add_argument('--seconds', type=float, default=5.0)
+    parser.add_argument('--workers', type=int)
+    args = parser.parse_args(argv)
+    benchmark(args.n, args.seconds, args.workers)
+
+if __name__ == '__main__':
+    main()
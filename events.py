@@ -0,0 +1,176 @@
+import argparse
+import importlib
+import json
+
+from core.db import get_db
+
+# Append-only log of marketplace state changes. Every mutation records its
+# events on the same connection, inside the same transaction, so the log
+# and the tables never disagree. Projections are read models built from the
+# log: each keeps the id of the last event it applied in projection_offsets,
+# catch_up() applies whatever is newer, and replay() rebuilds one from zero.
+# The newest event id also versions all marketplace data, which makes it a
+# cheap ETag (see latest_event_id).
+
+PROJECTION_MODULES = ['messaging']  # imported so their @projection functions register
+EVENT_BATCH = 500
+PG_EVENTS_LOCK = 4049  # advisory lock key; see record()
+
+_projections = {}
+
+def init_events(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS events
+                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                 kind TEXT NOT NULL,
+                 actor_id INTEGER,
+                 data TEXT NOT NULL,
+                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS projection_offsets
+                 (name TEXT PRIMARY KEY,
+                 last_event_id INTEGER NOT NULL DEFAULT 0,
+                 updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
+    if conn.execute('SELECT 1 FROM events LIMIT 1').fetchone() is None:
+        backfill(conn)
+
+def record(conn, kind, actor_id=None, **data):
+    """Append an event; commits (or rolls back) with the caller's transaction."""
+    if conn.dialect == 'postgres':
+        # Ids come from a sequence, so without this a transaction could commit
+        # an id lower than one a projection has already read past
+        conn.execute('SELECT pg_advisory_xact_lock(?)', (PG_EVENTS_LOCK,))
+    return conn.insert('INSERT INTO events (kind, actor_id, data) VALUES (?, ?, ?)',
+                       (kind, actor_id, json.dumps(data, default=str)))
+
+def latest_event_id(conn):
+    return conn.execute('SELECT COALESCE(MAX(id), 0) FROM events').fetchone()[0]
+
+def read_events(conn, after=0, kinds=None, limit=EVENT_BATCH):
+    filters, params = ['id > ?'], [after]
+    if kinds:
+        filters.append(f"kind IN ({', '.join('?' for _ in kinds)})")
+        params.extend(kinds)
+    rows = conn.execute(f'''SELECT id, kind, actor_id, data, created_at FROM events
+                            WHERE {' AND '.join(filters)} ORDER BY id LIMIT ?''', (*params, limit)).fetchall()
+    return [dict(row, data=json.loads(row['data'])) for row in rows]
+
+def backfill(conn):
+    # A log started on an existing database opens with the current state, so
+    # replaying from zero still sees every listing, request and message
+    for row in conn.execute('SELECT id, farmer_id, produce_type, quantity, price, status FROM listings ORDER BY id').fetchall():
+        record(conn, 'listing_created', row['farmer_id'], listing_id=row['id'], produce_type=row['produce_type'],
+               quantity=row['quantity'], price=row['price'], status=row['status'], backfill=True)
+    for row in conn.execute('SELECT id, listing_id, buyer_id, foodbank_id, quantity, status FROM requests ORDER BY id').fetchall():
+        record(conn, 'request_created', row['buyer_id'] or row['foodbank_id'], request_id=row['id'],
+               listing_id=row['listing_id'], quantity=row['quantity'], status=row['status'], backfill=True)
+    for row in conn.execute('SELECT id, sender_id, receiver_id, read, created_at FROM messages ORDER BY id').fetchall():
+        record(conn, 'message_sent', row['sender_id'], message_id=row['id'], sender_id=row['sender_id'],
+               receiver_id=row['receiver_id'], created_at=row['created_at'], backfill=True)
+        if row['read']:
+            record(conn, 'messages_read', row['receiver_id'], receiver_id=row['receiver_id'],
+                   sender_id=row['sender_id'], count=1, backfill=True)
+
+# ----- Projections -----
+def projection(name, kinds, tables):
+    """Register fn(conn, event) as projection `name`, fed events of these kinds.
+
+    tables are the read-model tables it owns; replay() empties them first.
+    """
+    def decorator(fn):
+        _projections[name] = (fn, tuple(kinds), tuple(tables))
+        return fn
+    return decorator
+
+def load_projections():
+    for module in PROJECTION_MODULES:
+        importlib.import_module(module)
+    return sorted(_projections)
+
+def _projection(name):
+    if name not in _projections:
+        load_projections()
+    return _projections[name]
+
+def _offset(conn, name):
+    conn.execute('''INSERT INTO projection_offsets (name, last_event_id) VALUES (?, 0)
+                    ON CONFLICT (name) DO NOTHING''', (name,))
+    # A no-op write so concurrent catch-ups of the same projection queue up
+    conn.execute('UPDATE projection_offsets SET name = name WHERE name = ?', (name,))
+    return conn.execute('SELECT last_event_id FROM projection_offsets WHERE name = ?', (name,)).fetchone()[0]
+
+def catch_up(conn, name, batch=EVENT_BATCH):
+    """Apply events newer than the projection's offset; returns how many. Caller commits."""
+    apply, kinds, _ = _projection(name)
+    offset = start = _offset(conn, name)
+    applied = 0
+    while True:
+        events = read_events(conn, offset, kinds, batch)
+        for event in events:
+            apply(conn, event)
+        applied += len(events)
+        if len(events) < batch:
+            break
+        offset = events[-1]['id']
+    # Skip past the events of other kinds too, so the next call starts here
+    offset = max(offset, latest_event_id(conn))
+    if offset != start:
+        conn.execute('''UPDATE projection_offsets SET last_event_id = ?, updated_at = CURRENT_TIMESTAMP
+                        WHERE name = ?''', (offset, name))
+    return applied
+
+def replay(conn, name):
+    """Rebuild a projection from the start of the log. Caller commits."""
+    _, _, tables = _projection(name)
+    _offset(conn, name)
+    for table in tables:
+        conn.execute(f'DELETE FROM {table}')
+    conn.execute('UPDATE projection_offsets SET last_event_id = 0 WHERE name = ?', (name,))
+    return catch_up(conn, name)
+
+def projection_status(conn):
+    latest = latest_event_id(conn)
+    offsets = {row['name']: row['last_event_id'] for row in
+               conn.execute('SELECT name, last_event_id FROM projection_offsets').fetchall()}
+    return {name: {'last_event_id': offsets.get(name, 0), 'behind': latest - offsets.get(name, 0)}
+            for name in load_projections()}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Inspect the event log and rebuild projections")
+    sub = parser.add_subparsers(dest='command', required=True)
+    sub.add_parser('status', help="How far each projection is behind the log")
+    catch = sub.add_parser('catch-up', help="Apply new events to every projection")
+    catch.add_argument('name', nargs='?')
+    rebuild = sub.add_parser('replay', help="Rebuild a projection from the first event")
+    rebuild.add_argument('name')
+    tail = sub.add_parser('tail', help="Print events after an id")
+    tail.add_argument('--after', type=int, default=0)
+    tail.add_argument('--limit', type=int, default=50)
+    parser.add_argument('--db', help="SQLite file (default: DATABASE_URL or FOOD_DONATION_DB)")
+    args = parser.parse_args(argv)
+
+    names = load_projections()
+    conn = get_db(args.db)
+    try:
+        if args.command == 'status':
+            print(f"latest event: {latest_event_id(conn)}")
+            for name, status in projection_status(conn).items():
+                print(f"{name:<20} at {status['last_event_id']:>8}  behind {status['behind']}")
+        elif args.command == 'tail':
+            for event in read_events(conn, args.after, limit=args.limit):
+                print(f"{event['id']:>8} {event['created_at']} {event['kind']:<24} "
+                      f"actor={event['actor_id']} {json.dumps(event['data'])}")
+        else:
+            if args.command == 'replay':
+                if args.name not in names:
+                    raise SystemExit(f"Unknown projection {args.name!r}; have: {', '.join(names)}")
+                print(f"{args.name}: replayed {replay(conn, args.name)} events")
+            else:
+                for name in ([args.name] if args.name else names):
+                    print(f"{name}: applied {catch_up(conn, name)} events")
+            conn.commit()
+    finally:
+        conn.close()
+
+if __name__ == '__main__':
+    # Projection modules register with `events`, not this __main__ copy
+    import events
+    events.main()
@@ -0,0 +1,186 @@
+import argparse
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import tempfile
+from collections import defaultdict
+from datetime import datetime
+
+from core.db import DB_PATH
+from messaging import partition_path
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+EXPORT_DIR = 'exports'
+WATERMARK_FILE = '_watermarks.json'
+BACKUP_PAGES = 256  # pages copied per step; writers can commit between steps
+
+# Arrow type for each declared SQLite column type (anything else is a
+# string, timestamps included), and how a stored value is converted to it.
+# SQLite lets one column hold ints in some rows and floats in others, so
+# every part of a table is written with the same schema, not an inferred one
+ARROW_TYPES = {'INTEGER': 'int64', 'REAL': 'float64', 'BOOLEAN': 'bool_'}
+CONVERTERS = {'int64': int, 'double': float, 'bool': bool, 'string': str}
+
+# Columns never exported (image payloads and credentials), and the columns
+# that change after insert, which are re-exported as a narrow state table
+EXPORT_TABLES = {
+    'users': {'drop': ['password', 'profile_pic'], 'mutable': ['name', 'role', 'location', 'phone']},
+    'listings': {'drop': ['images'], 'mutable': ['quantity', 'price', 'status']},
+    'requests': {'drop': [], 'mutable': ['status']},
+    'messages': {'drop': [], 'mutable': ['read']},
+}
+
+def snapshot_database(db_path, snapshot_path):
+    # The backup API copies a consistent image of the DB in small steps and
+    # restarts if another connection writes mid-copy, so the app never waits on us
+    source = sqlite3.connect(f'file:{db_path}?mode=ro', uri=True)
+    target = sqlite3.connect(snapshot_path)
+    try:
+        source.backup(target, pages=BACKUP_PAGES)
+    finally:
+        target.close()
+        source.close()
+
+def _load_watermarks(export_dir):
+    try:
+        with open(os.path.join(export_dir, WATERMARK_FILE)) as f:
+            return json.load(f)
+    except OSError:
+        return {}
+
+def _save_watermarks(export_dir, watermarks):
+    path = os.path.join(export_dir, WATERMARK_FILE)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(watermarks, f, indent=2)
+    os.replace(path + '.tmp', path)
+
+def _table_columns(conn, table):
+    return [row[1] for row in conn.execute(f'PRAGMA table_info({table})')]
+
+def _archive_months(conn):
+    # Archived message months live in their own SQLite files, not in the
+    # snapshot; message_archives says which months have one
+    if not conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'message_archives'").fetchone():
+        return []
+    return [row[0] for row in conn.execute('SELECT month FROM message_archives ORDER BY month')]
+
+def _check_archives(conn):
+    missing = [partition_path(month) for month in _archive_months(conn) if not os.path.exists(partition_path(month))]
+    if missing:
+        raise FileNotFoundError(f"Message archives are missing, so archived messages can't be exported: "
+                                f"{', '.join(missing)}")
+
+def _archived_rows(conn, table, columns, where, params):
+    if table != 'messages':
+        return []
+    rows = []
+    for month in _archive_months(conn):
+        part = sqlite3.connect(f'file:{partition_path(month)}?mode=ro', uri=True)
+        try:
+            present = set(_table_columns(part, 'messages'))
+            select = ', '.join(col if col in present else 'NULL' for col in columns)
+            rows += part.execute(f'SELECT {select} FROM messages {where}', params).fetchall()
+        finally:
+            part.close()
+    return rows
+
+def _merged_rows(conn, table, columns, where, params):
+    # A month being archived while the snapshot was taken can have rows in
+    # both places; the copies are identical, so keep one per id
+    rows = conn.execute(f'SELECT {", ".join(columns)} FROM {table} {where}', params).fetchall()
+    archived = _archived_rows(conn, table, columns, where, params)
+    if not archived:
+        return rows
+    return sorted({row[0]: row for row in archived + rows}.values(), key=lambda row: row[0])
+
+def _arrow_schema(conn, table, columns):
+    import pyarrow as pa
+    declared = {row[1]: row[2].upper() for row in conn.execute(f'PRAGMA table_info({table})')}
+    return pa.schema([(col, getattr(pa, ARROW_TYPES.get(declared.get(col), 'string'))()) for col in columns])
+
+def _write_parquet(rows, schema, path):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    data = {}
+    for i, field in enumerate(schema):
+        convert = CONVERTERS[str(field.type)]
+        data[field.name] = [None if row[i] is None else convert(row[i]) for row in rows]
+    table = pa.Table.from_pydict(data, schema=schema)
+    pq.write_table(table, path + '.tmp', compression='zstd')
+    os.replace(path + '.tmp', path)
+
+def export_table(conn, table, spec, export_dir, watermark):
+    available = _table_columns(conn, table)
+    columns = [col for col in available if col not in spec['drop']]
+    rows = _merged_rows(conn, table, columns, 'WHERE id > ? ORDER BY id', (watermark,))
+
+    # New rows, partitioned by the month they were created
+    schema = _arrow_schema(conn, table, columns)
+    created_index = columns.index('created_at') if 'created_at' in columns else None
+    partitions = defaultdict(list)
+    for row in rows:
+        month = str(row[created_index])[:7] if created_index is not None and row[created_index] else 'unknown'
+        partitions[month].append(row)
+    for month, part_rows in partitions.items():
+        path = os.path.join(export_dir, table, f'month={month}',
+                            f'part-{part_rows[0][0]:010d}-{part_rows[-1][0]:010d}.parquet')
+        _write_parquet(part_rows, schema, path)
+
+    # Latest values of the columns that change in place (status, quantity...)
+    mutable = [col for col in spec['mutable'] if col in available]
+    if mutable:
+        state_columns = ['id'] + mutable
+        state_rows = _merged_rows(conn, table, state_columns, 'ORDER BY id', ())
+        _write_parquet(state_rows, _arrow_schema(conn, table, state_columns),
+                       os.path.join(export_dir, f'{table}_state', 'current.parquet'))
+
+    new_watermark = rows[-1][0] if rows else watermark
+    return len(rows), new_watermark
+
+def export(db_path=DB_PATH, export_dir=EXPORT_DIR, full=False):
+    os.makedirs(export_dir, exist_ok=True)
+    watermarks = {} if full else _load_watermarks(export_dir)
+    with tempfile.TemporaryDirectory() as tmp:
+        snapshot_path = os.path.join(tmp, 'snapshot.db')
+        snapshot_database(db_path, snapshot_path)
+        conn = sqlite3.connect(snapshot_path)
+        try:
+            # Before anything is deleted: a --full run without the archived
+            # months would replace the old parts with only the hot messages
+            _check_archives(conn)
+            if full:
+                # Start from scratch so re-exported rows don't duplicate old parts
+                for table in EXPORT_TABLES:
+                    shutil.rmtree(os.path.join(export_dir, table), ignore_errors=True)
+            existing = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+            summary = {}
+            for table, spec in EXPORT_TABLES.items():
+                if table not in existing:
+                    continue
+                exported, watermarks[table] = export_table(conn, table, spec, export_dir,
+                                                           watermarks.get(table, 0))
+                summary[table] = exported
+        finally:
+            conn.close()
+    watermarks['exported_at'] = datetime.now().isoformat()
+    _save_watermarks(export_dir, watermarks)
+    return summary
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export food_donation.db to partitioned Parquet for offline analysis")
+    parser.add_argument('--db', default=DB_PATH, help="SQLite file (default: FOOD_DONATION_DB)")
+    parser.add_argument('--output', default=EXPORT_DIR)
+    parser.add_argument('--full', action='store_true', help="Ignore watermarks and export every row again")
+    args = parser.parse_args(argv)
+
+    summary = export(args.db, args.output, args.full)
+    for table, rows in summary.items():
+        logger.info(f"{table}: {rows} new rows")
+
+if __name__ == '__main__':
+    main()
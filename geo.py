@@ -0,0 +1,67 @@
+import math
+
+EARTH_RADIUS_KM = 6371.0
+
+# Approximate centroids of Kenya's 47 counties; users.location holds a
+# free-text county name, so this is how farmers and food banks get placed
+COUNTY_CENTROIDS = {
+    'MOMBASA': (-4.04, 39.67), 'KWALE': (-4.18, 39.46), 'KILIFI': (-3.51, 39.91),
+    'TANA RIVER': (-1.65, 39.65), 'LAMU': (-2.27, 40.90), 'TAITA TAVETA': (-3.42, 38.40),
+    'GARISSA': (-0.45, 39.65), 'WAJIR': (1.75, 40.06), 'MANDERA': (3.94, 41.86),
+    'MARSABIT': (2.33, 37.99), 'ISIOLO': (0.35, 37.58), 'MERU': (0.05, 37.65),
+    'THARAKA NITHI': (-0.30, 37.88), 'EMBU': (-0.53, 37.45), 'KITUI': (-1.37, 38.01),
+    'MACHAKOS': (-1.52, 37.26), 'MAKUENI': (-1.80, 37.62), 'NYANDARUA': (-0.18, 36.52),
+    'NYERI': (-0.42, 36.95), 'KIRINYAGA': (-0.66, 37.31), "MURANG'A": (-0.72, 37.15),
+    'KIAMBU': (-1.17, 36.83), 'TURKANA': (3.12, 35.60), 'WEST POKOT': (1.24, 35.11),
+    'SAMBURU': (1.10, 36.70), 'TRANS NZOIA': (1.02, 35.00), 'UASIN GISHU': (0.52, 35.27),
+    'ELGEYO MARAKWET': (0.80, 35.50), 'NANDI': (0.18, 35.13), 'BARINGO': (0.47, 35.97),
+    'LAIKIPIA': (0.36, 36.78), 'NAKURU': (-0.30, 36.07), 'NAROK': (-1.08, 35.87),
+    'KAJIADO': (-1.85, 36.78), 'KERICHO': (-0.37, 35.28), 'BOMET': (-0.78, 35.34),
+    'KAKAMEGA': (0.28, 34.75), 'VIHIGA': (0.07, 34.72), 'BUNGOMA': (0.56, 34.56),
+    'BUSIA': (0.46, 34.11), 'SIAYA': (0.06, 34.29), 'KISUMU': (-0.09, 34.77),
+    'HOMA BAY': (-0.53, 34.46), 'MIGORI': (-1.06, 34.47), 'KISII': (-0.68, 34.77),
+    'NYAMIRA': (-0.57, 34.94), 'NAIROBI': (-1.29, 36.82),
+}
+
+def _normalize(name):
+    return ' '.join(name.upper().replace('-', ' ').replace('COUNTY', '').split())
+
+def county_for(location):
+    """Return the county a free-text location names, or None if unknown."""
+    if not location:
+        return None
+    name = _normalize(location)
+    if name in COUNTY_CENTROIDS:
+        return name
+    # "Kilifi, Kenya", "Nairobi CBD" and the like
+    for county in COUNTY_CENTROIDS:
+        if county in name:
+            return county
+    return None
+
+def locate(location):
+    """Return (lat, lon) for a free-text county name, or None if unknown."""
+    county = county_for(location)
+    return COUNTY_CENTROIDS[county] if county else None
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = (math.sin((lat2 - lat1) / 2) ** 2
+         + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+def haversine_km_many(lat, lon, lats, lons):
+    # Distance from one point to arrays of points (numpy, degrees in and km out)
+    import numpy as np
+    lat, lon = math.radians(lat), math.radians(lon)
+    lats, lons = np.radians(lats), np.radians(lons)
+    a = np.sin((lats - lat) / 2) ** 2 + math.cos(lat) * np.cos(lats) * np.sin((lons - lon) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+
+def distance_matrix(points):
+    # Pairwise haversine distances (km) for a list of (lat, lon)
+    import numpy as np
+    coords = np.radians(np.asarray(points, dtype=float).reshape(-1, 2))
+    lat, lon = coords[:, :1], coords[:, 1:]
+    a = np.sin((lat.T - lat) / 2) ** 2 + np.cos(lat) * np.cos(lat.T) * np.sin((lon.T - lon) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
@@ -0,0 +1,79 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+from image_prep import make_thumbnail
+
+THUMBNAIL_EDGE = 300  # listings render at 150px; 2x keeps them sharp on HiDPI screens
+MAX_CACHE_BYTES = 64 * 1024 * 1024
+
+def image_key(data):
+    if isinstance(data, str):
+        data = data.encode('ascii', 'ignore')
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+class ThumbnailCache:
+    """Size-bounded LRU of encoded thumbnails, safe to share between sessions."""
+
+    def __init__(self, max_bytes=MAX_CACHE_BYTES, max_edge=THUMBNAIL_EDGE):
+        self.max_bytes = max_bytes
+        self.max_edge = max_edge
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            thumbnail = self._entries.get(key)
+            if thumbnail is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return thumbnail
+
+    def put(self, key, thumbnail):
+        size = len(thumbnail)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.current_bytes -= len(old)
+            self._entries[key] = thumbnail
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.current_bytes -= len(evicted)
+                self.evictions += 1
+
+    def thumbnail(self, data):
+        # Decoding happens outside the lock; two sessions may occasionally
+        # decode the same image at once, which is harmless
+        key = image_key(data)
+        thumbnail = self.get(key)
+        if thumbnail is None:
+            thumbnail = make_thumbnail(data, self.max_edge)
+            self.put(key, thumbnail)
+        return thumbnail
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self.current_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
@@ -0,0 +1,135 @@
+import base64
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+# Defaults for listing photos; profile pictures pass a smaller max_edge
+MAX_EDGE = 1280
+TARGET_BYTES = 200 * 1024
+MIN_QUALITY = 40
+MAX_QUALITY = 90
+
+PreparedImage = namedtuple('PreparedImage', [
+    'name', 'data', 'format', 'quality', 'size', 'original_bytes'
+])
+
+def webp_supported():
+    from PIL import features
+    return features.check('webp')
+
+def _read_bytes(source):
+    # Accepts raw bytes or any file-like object (Streamlit UploadedFile, Werkzeug FileStorage)
+    if isinstance(source, (bytes, bytearray)):
+        return bytes(source)
+    if hasattr(source, 'getvalue'):
+        return source.getvalue()
+    source.seek(0)
+    return source.read()
+
+def _encode(img, fmt, quality):
+    buffered = BytesIO()
+    if fmt == 'WEBP':
+        img.save(buffered, format='WEBP', quality=quality, method=4)
+    else:
+        img.save(buffered, format='JPEG', quality=quality, optimize=True, progressive=True)
+    return buffered.getvalue()
+
+def _encode_to_target(img, fmt, target_bytes):
+    # Binary search for the highest quality that still fits the byte budget
+    low, high = MIN_QUALITY, MAX_QUALITY
+    best = None
+    while low <= high:
+        quality = (low + high) // 2
+        data = _encode(img, fmt, quality)
+        if len(data) <= target_bytes:
+            best = (data, quality)
+            low = quality + 1
+        else:
+            high = quality - 1
+    if best is None:
+        # Even the lowest quality is over budget; send the smallest we can make
+        best = (_encode(img, fmt, MIN_QUALITY), MIN_QUALITY)
+    return best
+
+def _decode(raw, max_edge):
+    """Decode to an upright RGB image at least max_edge on each side where the source allows."""
+    from PIL import Image, ImageOps
+    img = Image.open(BytesIO(raw))
+    # For JPEGs let the decoder do the bulk of the downscaling (DCT scaling)
+    img.draft('RGB', (max_edge, max_edge))
+    # load() decodes the pixels once and raises on truncated/invalid files,
+    # which replaces the separate verify() + reopen pass
+    img.load()
+
+    # Apply the camera orientation before the EXIF block is dropped
+    img = ImageOps.exif_transpose(img)
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+    return img
+
+def prepare_image(source, max_edge=MAX_EDGE, target_bytes=TARGET_BYTES, fmt='JPEG', name=None):
+    from PIL import Image
+    raw = _read_bytes(source)
+    fmt = fmt.upper()
+    if fmt == 'WEBP' and not webp_supported():
+        fmt = 'JPEG'
+
+    img = _decode(raw, max_edge)
+    img.thumbnail((max_edge, max_edge), Image.LANCZOS)
+
+    # EXIF/ICC metadata is not passed to save(), so it is stripped from the output
+    data, quality = _encode_to_target(img, fmt, target_bytes)
+    return PreparedImage(
+        name=name or getattr(source, 'name', None),
+        data=data,
+        format=fmt,
+        quality=quality,
+        size=img.size,
+        original_bytes=len(raw)
+    )
+
+def make_thumbnail(source, max_edge, quality=80, square=False):
+    """JPEG thumbnail bytes for the listing cache and the avatar store.
+
+    source may also be a base64 string, as images are stored; square crops
+    to the centre instead of keeping the aspect ratio.
+    """
+    from PIL import Image, ImageOps
+    raw = base64.b64decode(source) if isinstance(source, str) else _read_bytes(source)
+    img = _decode(raw, max_edge)
+    if square:
+        img = ImageOps.fit(img, (max_edge, max_edge), Image.LANCZOS)
+    else:
+        img.thumbnail((max_edge, max_edge), Image.LANCZOS)
+    return _encode(img, 'JPEG', quality)
+
+def prepare_uploads(files, max_workers=4, **kwargs):
+    files = [f for f in files if f is not None]
+    results = []
+    errors = []
+    if not files:
+        return results, errors, 0
+
+    # Pillow releases the GIL while decoding/encoding, so threads scale here
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(files))) as executor:
+        futures = [(f, executor.submit(prepare_image, f, **kwargs)) for f in files]
+        for f, future in futures:
+            try:
+                results.append(future.result())
+            except Exception as e:
+                errors.append((getattr(f, 'name', None), str(e)))
+
+    return results, errors, bytes_saved(results)
+
+def bytes_saved(results):
+    return sum(max(r.original_bytes - len(r.data), 0) for r in results)
+
+def to_base64(prepared):
+    return base64.b64encode(prepared.data).decode('utf-8')
+
+def format_bytes(num):
+    for unit in ('B', 'KB', 'MB'):
+        if num < 1024:
+            return f"{num:.0f} {unit}" if unit == 'B' else f"{num:.1f} {unit}"
+        num /= 1024
+    return f"{num:.1f} GB"
@@ -0,0 +1,75 @@
+import argparse
+import os
+import subprocess
+import sys
+from collections import defaultdict
+
+# Cold-start check for the Streamlit frontend: imports a module in a fresh
+# interpreter under `python -X importtime`, prints where the time goes and
+# exits non-zero if one of our modules eagerly imports something that should
+# load lazily, or the total is over budget. Run it in CI next to the other checks.
+
+DEFAULT_FORBIDDEN = ['app', 'flask', 'flask_cors', 'sklearn', 'joblib', 'PIL', 'plotly']
+
+def is_project_module(name):
+    root = name.split('.')[0]
+    return os.path.exists(f'{root}.py') or os.path.isdir(root)
+
+def profile_imports(module):
+    """Return (name, parent, self_us, cumulative_us) for every module imported."""
+    # The child imports the module as a library (not __main__), the way
+    # Streamlit's script runner would before main() runs
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                            capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr[-2000:]}")
+
+    # importtime prints a module after everything it imported, indented two
+    # spaces per level, so children are collected until their parent shows up
+    entries = []
+    pending = defaultdict(list)
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line.split(':', 1)[1].split('|')
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        name = name.strip()
+        for child in pending.pop(depth + 1, []):
+            entries[child][1] = name
+        pending[depth].append(len(entries))
+        entries.append([name, None, int(self_us), int(cumulative_us)])
+    return [tuple(entry) for entry in entries]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Report and check import time of the frontend")
+    parser.add_argument('module', nargs='?', default='streamlit_app')
+    parser.add_argument('--top', type=int, default=15)
+    parser.add_argument('--budget-ms', type=float, help="Fail if importing the module takes longer")
+    parser.add_argument('--forbid', nargs='*', default=DEFAULT_FORBIDDEN,
+                        help="Packages our own modules must not import at import time")
+    args = parser.parse_args(argv)
+
+    entries = profile_imports(args.module)
+    total_ms = next(cumulative for name, _, _, cumulative in entries if name == args.module) / 1000
+    by_package = defaultdict(int)
+    for name, parent, _, cumulative in entries:
+        if parent == args.module:
+            by_package[name.split('.')[0]] += cumulative
+    print(f"import {args.module}: {total_ms:.0f} ms, {len(entries)} modules")
+    for package, us in sorted(by_package.items(), key=lambda item: item[1], reverse=True)[:args.top]:
+        print(f"  {us / 1000:8.1f} ms  {package}")
+
+    # Only direct imports from our code count; streamlit pulling in PIL is not ours to fix
+    eager = sorted({f"{name.split('.')[0]} (from {parent})" for name, parent, _, _ in entries
+                    if parent and is_project_module(parent) and name.split('.')[0] in args.forbid})
+    failed = False
+    if eager:
+        print(f"FAIL: imported eagerly: {', '.join(eager)}")
+        failed = True
+    if args.budget_ms is not None and total_ms > args.budget_ms:
+        print(f"FAIL: {total_ms:.0f} ms is over the {args.budget_ms:.0f} ms budget")
+        failed = True
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,328 @@
+import argparse
+import importlib
+import json
+import logging
+import multiprocessing
+import os
+import random
+import signal
+import sqlite3
+import threading
+import time
+import traceback
+
+logger = logging.getLogger(__name__)
+
+# Durable background jobs in their own SQLite file, so enqueueing never waits
+# on the marketplace database's write lock. Handlers enqueue and return; a
+# worker claims the most urgent due job, hides it from other workers for
+# VISIBILITY_TIMEOUT seconds, and either marks it done (kept a day for the
+# latency report) or schedules a retry with exponential backoff. Jobs that fail MAX_ATTEMPTS
+# times (or whose worker died that often) move to dead_jobs.
+#
+# Workers run as threads inside the API (JOB_WORKER_THREADS, default 1) or as
+# separate processes with `python jobs.py work`; claims are atomic either way.
+
+JOBS_DB = os.environ.get('JOBS_DB', 'jobs.db')
+WORKER_THREADS = int(os.environ.get('JOB_WORKER_THREADS', 1))
+HANDLER_MODULES = ['tasks']  # imported by workers so their @job handlers register
+MAX_ATTEMPTS = 5
+VISIBILITY_TIMEOUT = 60.0  # seconds a claimed job stays hidden from other workers
+BACKOFF_BASE = 2.0  # seconds before the first retry, doubling after that
+BACKOFF_MAX = 600.0
+POLL_INTERVAL = 0.5  # seconds an idle worker sleeps between claims
+DONE_RETENTION = 24 * 60 * 60  # seconds of finished jobs kept for the latency report
+
+_handlers = {}
+
+def job(kind):
+    """Register the decorated function(payload) as the handler for jobs of this kind."""
+    def decorator(fn):
+        _handlers[kind] = fn
+        return fn
+    return decorator
+
+def connect(path=None):
+    conn = sqlite3.connect(path or JOBS_DB, timeout=10.0, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+def init_jobs(conn):
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('''CREATE TABLE IF NOT EXISTS jobs
+                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                 kind TEXT NOT NULL,
+                 payload TEXT NOT NULL,
+                 priority INTEGER NOT NULL DEFAULT 0,
+                 status TEXT NOT NULL DEFAULT 'queued',
+                 attempts INTEGER NOT NULL DEFAULT 0,
+                 max_attempts INTEGER NOT NULL,
+                 run_at REAL NOT NULL,
+                 locked_until REAL,
+                 dedupe_key TEXT,
+                 created_at REAL NOT NULL,
+                 started_at REAL,
+                 finished_at REAL,
+                 last_error TEXT)''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS dead_jobs
+                 (id INTEGER PRIMARY KEY,
+                 kind TEXT NOT NULL,
+                 payload TEXT NOT NULL,
+                 attempts INTEGER NOT NULL,
+                 created_at REAL NOT NULL,
+                 failed_at REAL NOT NULL,
+                 last_error TEXT)''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_due ON jobs (status, priority DESC, run_at)")
+    # At most one waiting job per dedupe key, e.g. one read receipt per chat
+    conn.execute('''CREATE UNIQUE INDEX IF NOT EXISTS idx_jobs_dedupe ON jobs (dedupe_key)
+                    WHERE status = 'queued' AND dedupe_key IS NOT NULL''')
+
+_ready = set()
+_ready_lock = threading.Lock()
+
+def open_queue(path=None):
+    """Connection to the queue file, creating its tables on first use."""
+    path = path or JOBS_DB
+    conn = connect(path)
+    with _ready_lock:
+        if path not in _ready:
+            init_jobs(conn)
+            _ready.add(path)
+    return conn
+
+def enqueue(kind, payload, priority=0, delay=0, dedupe_key=None, max_attempts=MAX_ATTEMPTS, path=None):
+    """Queue a job; returns its id, or None if an identical one is already waiting."""
+    now = time.time()
+    conn = open_queue(path)
+    try:
+        cursor = conn.execute('''INSERT OR IGNORE INTO jobs
+                                 (kind, payload, priority, max_attempts, run_at, dedupe_key, created_at)
+                                 VALUES (?, ?, ?, ?, ?, ?, ?)''',
+                              (kind, json.dumps(payload), priority, max_attempts, now + delay, dedupe_key, now))
+        job_id = cursor.lastrowid if cursor.rowcount else None
+    finally:
+        conn.close()
+    if path is None:
+        start_workers()
+    return job_id
+
+def backoff(attempts):
+    delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (attempts - 1))
+    return delay * random.uniform(0.5, 1.0)  # jitter so retries don't arrive together
+
+def _bury(conn, row, error, now):
+    conn.execute('''INSERT OR REPLACE INTO dead_jobs (id, kind, payload, attempts, created_at, failed_at, last_error)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)''',
+                 (row['id'], row['kind'], row['payload'], row['attempts'], row['created_at'], now, error))
+    conn.execute('DELETE FROM jobs WHERE id = ?', (row['id'],))
+    logger.error(f"Job {row['id']} ({row['kind']}) moved to dead_jobs: {error}")
+
+def claim(conn, visibility_timeout=VISIBILITY_TIMEOUT):
+    """Take the most urgent due job, or one whose worker stopped responding."""
+    now = time.time()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        while True:
+            row = conn.execute('''SELECT * FROM jobs
+                                  WHERE (status = 'queued' AND run_at <= ?)
+                                     OR (status = 'running' AND locked_until < ?)
+                                  ORDER BY priority DESC, run_at LIMIT 1''', (now, now)).fetchone()
+            if row is None or row['status'] == 'queued' or row['attempts'] < row['max_attempts']:
+                break
+            # Its worker died (or hung) on every attempt
+            _bury(conn, row, row['last_error'] or "Visibility timeout expired", now)
+        if row is not None:
+            conn.execute('''UPDATE jobs SET status = 'running', attempts = attempts + 1,
+                            locked_until = ?, started_at = ? WHERE id = ?''',
+                         (now + visibility_timeout, now, row['id']))
+            row = dict(row, attempts=row['attempts'] + 1, started_at=now)
+        conn.execute('COMMIT')
+        return row
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+
+def complete(conn, row):
+    conn.execute('''UPDATE jobs SET status = 'done', finished_at = ?, locked_until = NULL, last_error = NULL
+                    WHERE id = ?''', (time.time(), row['id']))
+
+def fail(conn, row, error):
+    now = time.time()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        if row['attempts'] >= row['max_attempts']:
+            _bury(conn, row, error, now)
+        else:
+            conn.execute('''UPDATE jobs SET status = 'queued', run_at = ?, locked_until = NULL, last_error = ?
+                            WHERE id = ?''', (now + backoff(row['attempts']), error, row['id']))
+        conn.execute('COMMIT')
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+
+def run_one(conn):
+    """Claim and run one job; returns False when nothing was due."""
+    row = claim(conn)
+    if row is None:
+        return False
+    handler = _handlers.get(row['kind'])
+    try:
+        if handler is None:
+            raise LookupError(f"No handler for job kind {row['kind']!r}")
+        handler(json.loads(row['payload']))
+    except Exception as e:
+        logger.warning(f"Job {row['id']} ({row['kind']}) failed on attempt {row['attempts']}: {e}")
+        fail(conn, row, f"{e}\n{traceback.format_exc(limit=5)}")
+    else:
+        complete(conn, row)
+    return True
+
+def prune(conn, retention=DONE_RETENTION):
+    return conn.execute("DELETE FROM jobs WHERE status = 'done' AND finished_at < ?",
+                        (time.time() - retention,)).rowcount
+
+def work(path=None, stop=None):
+    """Worker loop; runs until stop (a threading/multiprocessing Event) is set."""
+    for module in HANDLER_MODULES:
+        importlib.import_module(module)
+    conn = open_queue(path)
+    last_prune = 0.0
+    try:
+        while not (stop and stop.is_set()):
+            try:
+                if time.monotonic() - last_prune > 3600:
+                    prune(conn)
+                    last_prune = time.monotonic()
+                if not run_one(conn):
+                    time.sleep(POLL_INTERVAL)
+            except sqlite3.OperationalError as e:
+                # Busy queue file; try again shortly rather than dying
+                logger.warning(f"Job worker: {e}")
+                time.sleep(POLL_INTERVAL)
+    finally:
+        conn.close()
+
+_workers_started = False
+_workers_lock = threading.Lock()
+
+def start_workers(threads=None):
+    """Start the in-process worker threads once (JOB_WORKER_THREADS=0 disables them)."""
+    global _workers_started
+    threads = WORKER_THREADS if threads is None else threads
+    with _workers_lock:
+        if _workers_started or threads <= 0:
+            return
+        _workers_started = True
+    for number in range(threads):
+        threading.Thread(target=work, name=f'job-worker-{number}', daemon=True).start()
+
+# ----- Reporting -----
+def _percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(fraction * len(values)))], 3)
+
+def queue_stats(conn, window=3600):
+    """Backlog per kind and wait/run latency over jobs finished in the last window seconds."""
+    now = time.time()
+    depth = {}
+    for row in conn.execute('''SELECT kind, status, COUNT(*) as jobs, MIN(created_at) as oldest
+                               FROM jobs WHERE status != 'done' GROUP BY kind, status'''):
+        entry = depth.setdefault(row['kind'], {'queued': 0, 'running': 0, 'oldest_seconds': 0})
+        entry[row['status']] = row['jobs']
+        entry['oldest_seconds'] = max(entry['oldest_seconds'], round(now - row['oldest'], 1))
+    latency = {}
+    for row in conn.execute('''SELECT kind, started_at - created_at as wait, finished_at - started_at as run
+                               FROM jobs WHERE status = 'done' AND finished_at >= ?''', (now - window,)):
+        entry = latency.setdefault(row['kind'], {'wait': [], 'run': []})
+        entry['wait'].append(row['wait'])
+        entry['run'].append(row['run'])
+    dead = {row['kind']: row['jobs'] for row in
+            conn.execute('SELECT kind, COUNT(*) as jobs FROM dead_jobs GROUP BY kind')}
+    return {
+        'depth': depth,
+        'latency': {kind: {'done': len(times['run']),
+                           'wait_p50': _percentile(times['wait'], 0.5), 'wait_p95': _percentile(times['wait'], 0.95),
+                           'run_p50': _percentile(times['run'], 0.5), 'run_p95': _percentile(times['run'], 0.95)}
+                    for kind, times in latency.items()},
+        'dead': dead,
+    }
+
+def print_report(stats):
+    kinds = sorted(set(stats['depth']) | set(stats['latency']) | set(stats['dead']))
+    if not kinds:
+        print("No jobs")
+        return
+    print(f"{'kind':<26}{'queued':>8}{'running':>9}{'oldest s':>10}{'done 1h':>9}"
+          f"{'wait p50':>10}{'wait p95':>10}{'run p95':>9}{'dead':>6}")
+    for kind in kinds:
+        depth = stats['depth'].get(kind, {})
+        latency = stats['latency'].get(kind, {})
+        wait_p50, wait_p95, run_p95 = (latency.get(key, '-') for key in ('wait_p50', 'wait_p95', 'run_p95'))
+        print(f"{kind:<26}{depth.get('queued', 0):>8}{depth.get('running', 0):>9}"
+              f"{depth.get('oldest_seconds', 0):>10}{latency.get('done', 0):>9}"
+              f"{wait_p50:>10}{wait_p95:>10}{run_p95:>9}{stats['dead'].get(kind, 0):>6}")
+
+def requeue_dead(conn, kind=None):
+    """Put dead-lettered jobs back in the queue with a fresh set of attempts."""
+    filters, params = ('WHERE kind = ?', (kind,)) if kind else ('', ())
+    rows = conn.execute(f'SELECT * FROM dead_jobs {filters}', params).fetchall()
+    now = time.time()
+    conn.execute('BEGIN IMMEDIATE')
+    for row in rows:
+        conn.execute('''INSERT INTO jobs (kind, payload, max_attempts, run_at, created_at)
+                        VALUES (?, ?, ?, ?, ?)''', (row['kind'], row['payload'], MAX_ATTEMPTS, now, now))
+        conn.execute('DELETE FROM dead_jobs WHERE id = ?', (row['id'],))
+    conn.execute('COMMIT')
+    return len(rows)
+
+def _work_process(path, stop):
+    global _workers_started
+    _workers_started = True  # jobs enqueued by handlers here are for these processes
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # the parent handles Ctrl-C
+    logging.basicConfig(level=logging.INFO)
+    work(path, stop)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Background job queue")
+    sub = parser.add_subparsers(dest='command', required=True)
+    worker = sub.add_parser('work', help="Run worker processes until interrupted")
+    worker.add_argument('--processes', type=int, default=os.cpu_count() or 1)
+    sub.add_parser('report', help="Queue depth, latency and dead letters per job kind")
+    retry = sub.add_parser('retry-dead', help="Requeue dead-lettered jobs")
+    retry.add_argument('--kind')
+    parser.add_argument('--db', default=JOBS_DB, help="Queue file (default: JOBS_DB)")
+    args = parser.parse_args(argv)
+
+    if args.command == 'work':
+        stop = multiprocessing.Event()
+        processes = [multiprocessing.Process(target=_work_process, args=(args.db, stop))
+                     for _ in range(args.processes)]
+        for process in processes:
+            process.start()
+        signal.signal(signal.SIGTERM, lambda *_: stop.set())
+        try:
+            for process in processes:
+                process.join()
+        except KeyboardInterrupt:
+            stop.set()
+            for process in processes:
+                process.join()
+        return
+
+    conn = open_queue(args.db)
+    try:
+        if args.command == 'report':
+            print_report(queue_stats(conn))
+        else:
+            print(f"Requeued {requeue_dead(conn, args.kind)} jobs")
+    finally:
+        conn.close()
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    # Go through the importable module: handler modules register with
+    # `jobs`, which as a script would be a second copy named __main__
+    import jobs
+    jobs.main()
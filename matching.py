@@ -0,0 +1,267 @@
+import argparse
+import random
+import time
+from datetime import date, timedelta
+
+import numpy as np
+
+from core.db import get_db
+from events import record
+from geo import COUNTY_CENTROIDS, haversine_km_many, locate
+from rollups import apply_request_change
+
+# Matches free listings (price = 0) to food banks' declared demand. Listings
+# are taken in best_before order and each goes to the nearest food banks that
+# still need that produce and can collect it before it expires, so the most
+# perishable surplus gets first pick. Allocations become pending requests the
+# farmer approves as usual.
+
+ANY_PRODUCE = '*'
+KM_PER_DAY = 250  # how far a food bank can collect from per day left before expiry
+MIN_ALLOCATION_KG = 1.0  # don't create requests for crumbs
+MATCH_PURPOSE = 'Matched donation'
+
+def init_matching(conn):
+    # One row per food bank and produce type; produce_type '*' is "anything".
+    # latitude/longitude override the centroid of the food bank's county.
+    conn.execute('''CREATE TABLE IF NOT EXISTS foodbank_demand
+                 (foodbank_id INTEGER NOT NULL,
+                 produce_type TEXT NOT NULL,
+                 demand_kg REAL NOT NULL,
+                 latitude REAL,
+                 longitude REAL,
+                 updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                 PRIMARY KEY (foodbank_id, produce_type),
+                 FOREIGN KEY (foodbank_id) REFERENCES users(id))''')
+
+def normalize_produce(produce_type):
+    return ' '.join(str(produce_type or '').lower().split()) or ANY_PRODUCE
+
+def get_demand(conn, foodbank_id):
+    rows = conn.execute('''SELECT produce_type, demand_kg, latitude, longitude, updated_at
+                           FROM foodbank_demand WHERE foodbank_id = ?
+                           ORDER BY produce_type''', (foodbank_id,)).fetchall()
+    return [dict(row) for row in rows]
+
+def set_demand(conn, foodbank_id, demand):
+    """Replace a food bank's declared demand; raises ValueError on bad rows."""
+    if not isinstance(demand, list):
+        raise ValueError("demand must be a list of rows")
+    rows = []
+    seen = set()
+    for item in demand:
+        if not isinstance(item, dict):
+            raise ValueError("Each demand row must be an object with produce_type and demand_kg")
+        produce_type = normalize_produce(item.get('produce_type'))
+        if produce_type in seen:
+            raise ValueError(f"{produce_type} is listed more than once")
+        seen.add(produce_type)
+        try:
+            demand_kg = float(item.get('demand_kg') or 0)
+        except (TypeError, ValueError):
+            raise ValueError(f"demand_kg for {produce_type} must be a number")
+        if demand_kg < 0:
+            raise ValueError("demand_kg can't be negative")
+        latitude, longitude = item.get('latitude'), item.get('longitude')
+        if (latitude is None) != (longitude is None):
+            raise ValueError("Give both latitude and longitude or neither")
+        if latitude is not None:
+            try:
+                latitude, longitude = float(latitude), float(longitude)
+            except (TypeError, ValueError):
+                raise ValueError("latitude and longitude must be numbers")
+        rows.append((foodbank_id, produce_type, demand_kg, latitude, longitude))
+    conn.execute('DELETE FROM foodbank_demand WHERE foodbank_id = ?', (foodbank_id,))
+    conn.executemany('''INSERT INTO foodbank_demand
+                        (foodbank_id, produce_type, demand_kg, latitude, longitude)
+                        VALUES (?, ?, ?, ?, ?)''', rows)
+
+# ----- Loading -----
+def load_listings(conn, today):
+    # Free stock still on offer: quantity left minus what's already asked for
+    rows = conn.execute('''
+        SELECT l.id, l.produce_type, l.best_before, u.location,
+               l.quantity - COALESCE((SELECT SUM(r.quantity) FROM requests r
+                                      WHERE r.listing_id = l.id AND r.status = 'pending'), 0) as available_kg
+        FROM listings l
+        JOIN users u ON l.farmer_id = u.id
+        WHERE l.status = 'active' AND l.price = 0 AND l.best_before >= ?
+    ''', (today.isoformat(),)).fetchall()
+    listings, unlocated = [], 0
+    for row in rows:
+        point = locate(row['location'])
+        if point is None:
+            unlocated += 1
+        elif row['available_kg'] >= MIN_ALLOCATION_KG:
+            listings.append({'id': row['id'], 'produce_type': normalize_produce(row['produce_type']),
+                             'available_kg': row['available_kg'], 'best_before': row['best_before'],
+                             'lat': point[0], 'lon': point[1]})
+    return listings, unlocated
+
+def load_demand_slots(conn, foodbank_id=None):
+    # Open demand is what was declared minus pending/approved requests made since
+    filters = 'WHERE d.foodbank_id = ?' if foodbank_id else ''
+    rows = conn.execute(f'''
+        SELECT d.foodbank_id, d.produce_type, d.demand_kg, d.latitude, d.longitude,
+               d.updated_at, u.location
+        FROM foodbank_demand d
+        JOIN users u ON d.foodbank_id = u.id
+        {filters}
+    ''', (foodbank_id,) if foodbank_id else ()).fetchall()
+    slots = {}
+    for row in rows:
+        point = (row['latitude'], row['longitude']) if row['latitude'] is not None else locate(row['location'])
+        if point is None or row['demand_kg'] <= 0:
+            continue
+        slots[(row['foodbank_id'], row['produce_type'])] = {
+            'foodbank_id': row['foodbank_id'], 'produce_type': row['produce_type'],
+            'open_kg': row['demand_kg'], 'lat': point[0], 'lon': point[1], 'since': row['updated_at']}
+
+    open_requests = conn.execute('''
+        SELECT r.foodbank_id, l.produce_type, r.quantity, r.created_at
+        FROM requests r
+        JOIN listings l ON r.listing_id = l.id
+        WHERE r.foodbank_id IS NOT NULL AND r.status IN ('pending', 'approved')
+    ''').fetchall()
+    for foodbank, produce_type, quantity, created_at in open_requests:
+        slot = (slots.get((foodbank, normalize_produce(produce_type)))
+                or slots.get((foodbank, ANY_PRODUCE)))
+        if slot and created_at >= slot['since']:
+            slot['open_kg'] -= quantity
+    return [slot for slot in slots.values() if slot['open_kg'] >= MIN_ALLOCATION_KG]
+
+# ----- Solver -----
+def match(listings, slots, today=None, km_per_day=KM_PER_DAY, min_kg=MIN_ALLOCATION_KG):
+    """Greedy allocation of listings to demand slots.
+
+    Returns a list of (listing_id, foodbank_id, kg, distance_km).
+    """
+    today = today or date.today()
+    if not listings or not slots:
+        return []
+    lats = np.array([s['lat'] for s in slots], dtype=float)
+    lons = np.array([s['lon'] for s in slots], dtype=float)
+    remaining = np.array([s['open_kg'] for s in slots], dtype=float)
+    by_produce = {}
+    for index, slot in enumerate(slots):
+        by_produce.setdefault(slot['produce_type'], []).append(index)
+    wildcard = by_produce.get(ANY_PRODUCE, [])
+
+    # Farmers share county centroids, so candidate lists sorted by distance
+    # are computed once per (place, produce) and reused
+    candidates = {}
+    allocations = {}
+    for listing in sorted(listings, key=lambda l: l['best_before']):
+        key = (listing['lat'], listing['lon'], listing['produce_type'])
+        if key not in candidates:
+            index = np.array(by_produce.get(listing['produce_type'], []) + wildcard, dtype=int)
+            distances = haversine_km_many(listing['lat'], listing['lon'], lats[index], lons[index])
+            order = np.argsort(distances, kind='stable')
+            candidates[key] = (index[order], distances[order])
+        index, distances = candidates[key]
+
+        days_left = (date.fromisoformat(listing['best_before'][:10]) - today).days
+        reach = np.searchsorted(distances, (days_left + 1) * km_per_day, side='right')
+        left = listing['available_kg']
+        for position in np.flatnonzero(remaining[index[:reach]] >= min_kg):
+            slot = index[position]
+            kg = min(left, remaining[slot])
+            remaining[slot] -= kg
+            left -= kg
+            pair = (listing['id'], slots[slot]['foodbank_id'])
+            kg_so_far, _ = allocations.get(pair, (0.0, 0.0))
+            allocations[pair] = (kg_so_far + kg, float(distances[position]))
+            if left < min_kg:
+                break
+    return [(listing_id, foodbank_id, round(kg, 2), round(distance, 1))
+            for (listing_id, foodbank_id), (kg, distance) in allocations.items()]
+
+def create_match_requests(conn, allocations, actor_id=None):
+    request_ids = conn.insert_many('''INSERT INTO requests (listing_id, foodbank_id, quantity, purpose, status)
+                                      VALUES (?, ?, ?, ?, 'pending')''',
+                                   [(listing_id, foodbank_id, kg, MATCH_PURPOSE)
+                                    for listing_id, foodbank_id, kg, _ in allocations])
+    for request_id, (listing_id, foodbank_id, kg, _) in zip(request_ids, allocations):
+        apply_request_change(conn, request_id, None, 'pending')
+        record(conn, 'request_created', actor_id, request_id=request_id, listing_id=listing_id,
+               foodbank_id=foodbank_id, quantity=kg, status='pending', matched=True)
+
+def run_matching(conn, foodbank_id=None, dry_run=False, today=None, actor_id=None):
+    today = today or date.today()
+    start = time.monotonic()
+    listings, unlocated = load_listings(conn, today)
+    slots = load_demand_slots(conn, foodbank_id)
+    allocations = match(listings, slots, today)
+    if allocations and not dry_run:
+        create_match_requests(conn, allocations, actor_id)
+    return {
+        'listings': len(listings),
+        'unlocated_listings': unlocated,
+        'demand_slots': len(slots),
+        'offered_kg': round(sum(l['available_kg'] for l in listings), 2),
+        'matched_kg': round(sum(a[2] for a in allocations), 2),
+        'allocations': [dict(zip(('listing_id', 'foodbank_id', 'quantity', 'distance_km'), a))
+                        for a in allocations],
+        'dry_run': dry_run,
+        'seconds': round(time.monotonic() - start, 3),
+    }
+
+# ----- Benchmark -----
+def synthetic_problem(n_listings, n_foodbanks, seed=0):
+    rng = random.Random(seed)
+    produce = ['maize', 'beans', 'kales', 'cassava', 'potatoes', 'tomatoes', 'cabbage', 'bananas']
+    places = list(COUNTY_CENTROIDS.values())
+    today = date.today()
+
+    def jitter(point):
+        return point[0] + rng.uniform(-0.3, 0.3), point[1] + rng.uniform(-0.3, 0.3)
+
+    listings = []
+    for i in range(n_listings):
+        lat, lon = rng.choice(places)  # farmers are placed by county centroid
+        listings.append({'id': i, 'produce_type': rng.choice(produce), 'available_kg': rng.uniform(5, 500),
+                         'best_before': (today + timedelta(days=rng.randint(0, 14))).isoformat(),
+                         'lat': lat, 'lon': lon})
+    slots = []
+    for i in range(n_foodbanks):
+        lat, lon = jitter(rng.choice(places))
+        for produce_type in rng.sample(produce + [ANY_PRODUCE], 3):
+            slots.append({'foodbank_id': i, 'produce_type': produce_type,
+                          'open_kg': rng.uniform(50, 2000), 'lat': lat, 'lon': lon})
+    return listings, slots
+
+def benchmark(n_listings=10000, n_foodbanks=1000, seed=0):
+    listings, slots = synthetic_problem(n_listings, n_foodbanks, seed)
+    start = time.monotonic()
+    allocations = match(listings, slots)
+    elapsed = time.monotonic() - start
+    offered = sum(l['available_kg'] for l in listings)
+    matched = sum(a[2] for a in allocations)
+    print(f"{n_listings} listings x {n_foodbanks} food banks ({len(slots)} demand slots): "
+          f"{len(allocations)} allocations, {matched:,.0f} of {offered:,.0f} kg matched in {elapsed:.2f}s")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Match free listings to food bank demand")
+    parser.add_argument('command', choices=['run', 'benchmark'])
+    parser.add_argument('--db', help="SQLite file (default: DATABASE_URL or FOOD_DONATION_DB)")
+    parser.add_argument('--dry-run', action='store_true', help="Report allocations without creating requests")
+    parser.add_argument('--listings', type=int, default=10000)
+    parser.add_argument('--foodbanks', type=int, default=1000)
+    args = parser.parse_args(argv)
+
+    if args.command == 'benchmark':
+        benchmark(args.listings, args.foodbanks)
+        return
+
+    conn = get_db(args.db)
+    try:
+        init_matching(conn)
+        summary = run_matching(conn, dry_run=args.dry_run)
+        conn.commit()
+        print(f"Matched {summary['matched_kg']} of {summary['offered_kg']} kg "
+              f"in {len(summary['allocations'])} requests ({summary['seconds']}s)")
+    finally:
+        conn.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,257 @@
+import argparse
+import os
+import shutil
+import sqlite3
+from collections import Counter
+from datetime import date
+
+from core.db import get_db
+from events import catch_up, projection, record
+
+# Message storage is split by month. The messages table holds the hot
+# months (the last HOT_MONTHS, plus anything still unread); older read
+# messages are moved into one compacted SQLite file per month under
+# ARCHIVE_DIR, which can sit on cheaper storage. message_archive_pairs says
+# which months hold a given conversation, so reading archived history opens
+# only those files, and only when asked for.
+#
+# The conversation list is a projection of the event log: one row per
+# (user, partner) with the latest message time, the user's unread count and
+# how many of their messages are archived, so listing conversations doesn't
+# scan the messages table. Writers of message events call
+# catch_up(conn, 'conversations') in the same transaction, which keeps it
+# exact; `python events.py replay conversations` rebuilds it.
+
+ARCHIVE_DIR = os.environ.get('MESSAGE_ARCHIVE_DIR', 'message_archive')
+HOT_MONTHS = int(os.environ.get('MESSAGES_HOT_MONTHS', 3))  # including the current one
+DELETE_BATCH = 500
+PARTITION_COLUMNS = 'id, sender_id, receiver_id, content, read, created_at'
+
+def init_messaging(conn):
+    # Hot-table lookups by conversation and by month
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_messages_pair ON messages (sender_id, receiver_id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_messages_created ON messages (created_at)')
+    conn.execute('''CREATE TABLE IF NOT EXISTS conversations
+                 (user_id INTEGER NOT NULL,
+                 partner_id INTEGER NOT NULL,
+                 last_message_time TIMESTAMP,
+                 unread_count INTEGER NOT NULL DEFAULT 0,
+                 archived_messages INTEGER NOT NULL DEFAULT 0,
+                 PRIMARY KEY (user_id, partner_id))''')
+    columns = [col[0] for col in conn.execute('SELECT * FROM conversations LIMIT 0').description]
+    if 'archived_messages' not in columns:
+        conn.execute('ALTER TABLE conversations ADD COLUMN archived_messages INTEGER NOT NULL DEFAULT 0')
+    conn.execute('''CREATE TABLE IF NOT EXISTS message_archives
+                 (month TEXT PRIMARY KEY,
+                 messages INTEGER NOT NULL,
+                 archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
+    # user_a < user_b, so each conversation has one key
+    conn.execute('''CREATE TABLE IF NOT EXISTS message_archive_pairs
+                 (user_a INTEGER NOT NULL,
+                 user_b INTEGER NOT NULL,
+                 month TEXT NOT NULL,
+                 messages INTEGER NOT NULL,
+                 PRIMARY KEY (user_a, user_b, month))''')
+
+# ----- Conversations projection -----
+@projection('conversations', kinds=('message_sent', 'messages_read', 'messages_archived'),
+            tables=('conversations',))
+def project_conversations(conn, event):
+    data = event['data']
+    if event['kind'] == 'message_sent':
+        # The sender's side stays read; the receiver's gains an unread message
+        for user_id, partner_id, unread in ((data['sender_id'], data['receiver_id'], 0),
+                                            (data['receiver_id'], data['sender_id'], 1)):
+            conn.execute('''INSERT INTO conversations (user_id, partner_id, last_message_time, unread_count)
+                            VALUES (?, ?, ?, ?)
+                            ON CONFLICT (user_id, partner_id) DO UPDATE SET
+                                last_message_time = CASE
+                                    WHEN excluded.last_message_time > conversations.last_message_time
+                                    THEN excluded.last_message_time ELSE conversations.last_message_time END,
+                                unread_count = conversations.unread_count + excluded.unread_count''',
+                         (user_id, partner_id, data['created_at'], unread))
+    elif event['kind'] == 'messages_read':
+        conn.execute('''UPDATE conversations
+                        SET unread_count = CASE WHEN unread_count > ? THEN unread_count - ? ELSE 0 END
+                        WHERE user_id = ? AND partner_id = ?''',
+                     (data['count'], data['count'], data['receiver_id'], data['sender_id']))
+    else:
+        conn.execute('''UPDATE conversations SET archived_messages = archived_messages + ?
+                        WHERE (user_id = ? AND partner_id = ?) OR (user_id = ? AND partner_id = ?)''',
+                     (data['count'], data['user_a'], data['user_b'], data['user_b'], data['user_a']))
+
+def query_conversations(conn, user_id):
+    rows = conn.execute('''
+        SELECT c.partner_id, u.name as partner_name, c.last_message_time, c.unread_count, c.archived_messages
+        FROM conversations c
+        JOIN users u ON c.partner_id = u.id
+        WHERE c.user_id = ?
+        ORDER BY c.last_message_time DESC
+    ''', (user_id,)).fetchall()
+    return [dict(row) for row in rows]
+
+# ----- Month partitions -----
+def partition_path(month):
+    return os.path.join(ARCHIVE_DIR, f'messages-{month}.db')
+
+def _next_month(month):
+    year, number = map(int, month.split('-'))
+    return f'{year + number // 12:04d}-{number % 12 + 1:02d}'
+
+def hot_cutoff(today=None, hot_months=HOT_MONTHS):
+    """First day of the oldest hot month; read messages from before it get archived."""
+    today = today or date.today()
+    index = today.year * 12 + today.month - 1 - (max(hot_months, 1) - 1)
+    return f'{index // 12:04d}-{index % 12 + 1:02d}-01'
+
+def write_partition(month, rows):
+    # Built in a side file and swapped in, so readers see the old file or the
+    # new one. Ids are kept, which makes a repeated archive run harmless.
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    path = partition_path(month)
+    tmp_path = path + '.tmp'
+    if os.path.exists(path):
+        shutil.copyfile(path, tmp_path)
+    elif os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    part = sqlite3.connect(tmp_path)
+    try:
+        part.execute('''CREATE TABLE IF NOT EXISTS messages
+                     (id INTEGER PRIMARY KEY,
+                     sender_id INTEGER NOT NULL,
+                     receiver_id INTEGER NOT NULL,
+                     content TEXT NOT NULL,
+                     read BOOLEAN,
+                     created_at TIMESTAMP)''')
+        part.execute('CREATE INDEX IF NOT EXISTS idx_messages_pair ON messages (sender_id, receiver_id)')
+        part.executemany(f'INSERT OR IGNORE INTO messages ({PARTITION_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?)',
+                         [tuple(row) for row in rows])
+        part.commit()
+        # Only ever read from now on, so pack it tight
+        part.execute('VACUUM')
+    finally:
+        part.close()
+    os.replace(tmp_path, path)
+
+def read_partition(month, user1_id, user2_id):
+    path = partition_path(month)
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"Message archive for {month} is missing from {ARCHIVE_DIR}")
+    part = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+    part.row_factory = sqlite3.Row
+    try:
+        rows = part.execute(f'''SELECT {PARTITION_COLUMNS} FROM messages
+                                WHERE (sender_id = ? AND receiver_id = ?)
+                                   OR (sender_id = ? AND receiver_id = ?)''',
+                            (user1_id, user2_id, user2_id, user1_id)).fetchall()
+        return [dict(row) for row in rows]
+    finally:
+        part.close()
+
+def archive_month(conn, month, actor_id=None):
+    """Move the read messages of one month (YYYY-MM) to its partition file; returns how many. Commits."""
+    rows = conn.execute(f'''SELECT {PARTITION_COLUMNS} FROM messages
+                            WHERE created_at >= ? AND created_at < ? AND read ORDER BY id''',
+                        (f'{month}-01', f'{_next_month(month)}-01')).fetchall()
+    if not rows:
+        return 0
+    # The file first: if we stop before the commit below, the messages are
+    # still hot and the next run copies them again over the same ids
+    write_partition(month, rows)
+
+    # Read messages never change, so only another archiver can have moved them meanwhile
+    conn.begin_write('messages')
+    moved = []
+    for start in range(0, len(rows), DELETE_BATCH):
+        batch = [row['id'] for row in rows[start:start + DELETE_BATCH]]
+        placeholders = ', '.join('?' for _ in batch)
+        moved += [row['id'] for row in conn.execute(f'SELECT id FROM messages WHERE id IN ({placeholders})',
+                                                    batch).fetchall()]
+        conn.execute(f'DELETE FROM messages WHERE id IN ({placeholders})', batch)
+    moved = set(moved)
+    pairs = Counter((min(row['sender_id'], row['receiver_id']), max(row['sender_id'], row['receiver_id']))
+                    for row in rows if row['id'] in moved)
+    for (user_a, user_b), count in sorted(pairs.items()):
+        conn.execute('''INSERT INTO message_archive_pairs (user_a, user_b, month, messages) VALUES (?, ?, ?, ?)
+                        ON CONFLICT (user_a, user_b, month) DO UPDATE SET
+                            messages = message_archive_pairs.messages + excluded.messages''',
+                     (user_a, user_b, month, count))
+        record(conn, 'messages_archived', actor_id, user_a=user_a, user_b=user_b, month=month, count=count)
+    conn.execute('''INSERT INTO message_archives (month, messages) VALUES (?, ?)
+                    ON CONFLICT (month) DO UPDATE SET
+                        messages = message_archives.messages + excluded.messages,
+                        archived_at = CURRENT_TIMESTAMP''', (month, len(moved)))
+    catch_up(conn, 'conversations')
+    conn.commit()
+    return len(moved)
+
+def cold_months(conn, today=None, hot_months=HOT_MONTHS):
+    rows = conn.execute('''SELECT DISTINCT SUBSTR(created_at, 1, 7) as month FROM messages
+                           WHERE created_at < ? AND read ORDER BY month''',
+                        (hot_cutoff(today, hot_months),)).fetchall()
+    return [row['month'] for row in rows]
+
+def archive_old_messages(conn, today=None, hot_months=HOT_MONTHS):
+    """Archive every month older than the hot window; returns {month: messages moved}."""
+    return {month: archive_month(conn, month) for month in cold_months(conn, today, hot_months)}
+
+def archived_messages(conn, user1_id, user2_id):
+    """A conversation's archived messages, oldest first, shaped like the hot query's rows."""
+    months = [row['month'] for row in conn.execute(
+        '''SELECT month FROM message_archive_pairs WHERE user_a = ? AND user_b = ? ORDER BY month''',
+        (min(user1_id, user2_id), max(user1_id, user2_id))).fetchall()]
+    if not months:
+        return []
+    names = {row['id']: row['name'] for row in conn.execute('SELECT id, name FROM users WHERE id IN (?, ?)',
+                                                               (user1_id, user2_id)).fetchall()}
+    messages = [msg for month in months for msg in read_partition(month, user1_id, user2_id)]
+    for msg in messages:
+        msg['sender_name'] = names.get(msg['sender_id'])
+    return sorted(messages, key=lambda msg: (msg['created_at'], msg['id']))
+
+def storage_report(conn):
+    hot = conn.execute('''SELECT SUBSTR(created_at, 1, 7) as month, COUNT(*) as messages,
+                                 SUM(CASE WHEN read THEN 0 ELSE 1 END) as unread
+                          FROM messages GROUP BY SUBSTR(created_at, 1, 7) ORDER BY month''').fetchall()
+    archived = conn.execute('SELECT month, messages, archived_at FROM message_archives ORDER BY month').fetchall()
+    return [dict(row) for row in hot], [dict(row) for row in archived]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Archive old message months and reclaim space")
+    sub = parser.add_subparsers(dest='command', required=True)
+    sub.add_parser('status', help="Messages per hot month and per archived month")
+    archive = sub.add_parser('archive', help="Move read messages older than the hot months to partition files")
+    archive.add_argument('--hot-months', type=int, default=HOT_MONTHS)
+    vacuum = sub.add_parser('vacuum', help="Give the space of deleted rows back to the filesystem")
+    vacuum.add_argument('--full', action='store_true',
+                        help="SQLite: rewrite the file once so later vacuums can run online")
+    parser.add_argument('--db', help="SQLite file (default: DATABASE_URL or FOOD_DONATION_DB)")
+    args = parser.parse_args(argv)
+
+    conn = get_db(args.db)
+    try:
+        if args.command == 'status':
+            hot, archived = storage_report(conn)
+            for row in hot:
+                print(f"hot      {row['month']}  {row['messages']:>8} messages  {row['unread']} unread")
+            for row in archived:
+                print(f"archived {row['month']}  {row['messages']:>8} messages  {partition_path(row['month'])}")
+        elif args.command == 'archive':
+            for month, moved in archive_old_messages(conn, hot_months=args.hot_months).items():
+                print(f"{month}: archived {moved} messages to {partition_path(month)}")
+        elif args.full and conn.dialect == 'sqlite':
+            # Blocks writers while the file is rewritten; needed once per existing file
+            conn.commit()
+            conn.execute('PRAGMA auto_vacuum=INCREMENTAL')
+            conn.execute('VACUUM')
+            print(f"Rewrote {args.db or 'the database'} with incremental auto-vacuum")
+        else:
+            freed = conn.vacuum('messages')
+            print(f"Freed {freed} pages" if freed is not None else "Vacuumed messages")
+    finally:
+        conn.close()
+
+if __name__ == '__main__':
+    # The conversations projection registers with the importable `messaging`
+    import messaging
+    messaging.main()
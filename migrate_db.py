@@ -0,0 +1,78 @@
+import argparse
+import sqlite3
+
+from core.db import DB_PATH, get_db, is_postgres
+from core.schema import init_db
+
+# Copies every table from the SQLite file into the PostgreSQL database named
+# by DATABASE_URL, for moving a single-node install onto several API nodes.
+
+BATCH_ROWS = 1000
+
+def _pg_columns(conn, table):
+    rows = conn.execute('''SELECT column_name, data_type FROM information_schema.columns
+                           WHERE table_name = ?''', (table,)).fetchall()
+    return {name: data_type for name, data_type in rows}
+
+def _convert(value, data_type):
+    # SQLite stores flags as 0/1 and blobs as bytes of any column type
+    if value is None:
+        return None
+    if data_type == 'boolean':
+        return bool(value)
+    return value
+
+def copy_table(source, target, table):
+    target_columns = _pg_columns(target, table)
+    columns = [row[1] for row in source.execute(f'PRAGMA table_info({table})')
+               if row[1] in target_columns]
+    types = [target_columns[col] for col in columns]
+    insert = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' for _ in columns)})"
+    cursor = source.execute(f"SELECT {', '.join(columns)} FROM {table}")
+    copied = 0
+    while True:
+        rows = cursor.fetchmany(BATCH_ROWS)
+        if not rows:
+            break
+        target.executemany(insert, [[_convert(value, data_type) for value, data_type in zip(row, types)]
+                                    for row in rows])
+        copied += len(rows)
+    if 'id' in columns and target_columns.get('id') == 'integer':
+        # Carry on numbering after the copied ids
+        target.execute(f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+                       f"COALESCE((SELECT MAX(id) FROM {table}), 0) + 1, false)")
+    return copied
+
+def migrate(sqlite_path=DB_PATH, replace=False):
+    if not is_postgres():
+        raise SystemExit("Set DATABASE_URL to the PostgreSQL database to copy into")
+    init_db()
+    source = sqlite3.connect(sqlite_path)
+    target = get_db()
+    try:
+        tables = [row[0] for row in source.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'")]
+        tables = [table for table in tables if _pg_columns(target, table)]
+        if target.execute('SELECT 1 FROM users LIMIT 1').fetchone() and not replace:
+            raise SystemExit("The PostgreSQL database already has users; pass --replace to overwrite it")
+        target.execute(f"TRUNCATE {', '.join(tables)} CASCADE")
+        # Parents first so foreign keys hold as rows arrive
+        order = {'users': 0, 'listings': 1, 'requests': 2}
+        counts = {table: copy_table(source, target, table)
+                  for table in sorted(tables, key=lambda table: order.get(table, 3))}
+        target.commit()
+        return counts
+    finally:
+        target.close()
+        source.close()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Copy the SQLite database into PostgreSQL (DATABASE_URL)")
+    parser.add_argument('--sqlite', default=DB_PATH, help="SQLite file to copy from")
+    parser.add_argument('--replace', action='store_true', help="Overwrite data already in PostgreSQL")
+    args = parser.parse_args(argv)
+    for table, rows in migrate(args.sqlite, args.replace).items():
+        print(f"{table}: {rows} rows")
+
+if __name__ == '__main__':
+    main()
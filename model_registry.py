@@ -0,0 +1,92 @@
+import logging
+import os
+import threading
+import time
+
+from yield_model import FUSED_FILE, build_fused_model
+
+logger = logging.getLogger(__name__)
+
+MODELS_DIR = 'models'
+CURRENT_POINTER = os.path.join(MODELS_DIR, 'CURRENT')
+DEFAULT_MODEL = 'corn_yield_predictor.pkl'
+DEFAULT_ENCODERS = 'label_encoders.pkl'
+
+def set_current_version(version_dir):
+    # os.replace is atomic, so readers see either the old or the new pointer
+    os.makedirs(MODELS_DIR, exist_ok=True)
+    tmp_path = CURRENT_POINTER + '.tmp'
+    with open(tmp_path, 'w') as f:
+        f.write(os.path.abspath(version_dir))
+    os.replace(tmp_path, CURRENT_POINTER)
+
+def current_version_dir():
+    try:
+        with open(CURRENT_POINTER) as f:
+            version_dir = f.read().strip()
+    except OSError:
+        return None
+    return version_dir if os.path.isdir(version_dir) else None
+
+class ModelRegistry:
+    """Serves the current yield model and hot-swaps it when a new version is promoted."""
+
+    def __init__(self, check_interval=5.0):
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._loaded = None  # (key, FusedYieldModel, version)
+        self._last_check = 0.0
+
+    def _source(self):
+        version_dir = current_version_dir()
+        if version_dir:
+            model_path = os.path.join(version_dir, DEFAULT_MODEL)
+            encoders_path = os.path.join(version_dir, DEFAULT_ENCODERS)
+            fused_path = os.path.join(version_dir, FUSED_FILE)
+            version = os.path.basename(version_dir)
+        else:
+            model_path, encoders_path, fused_path, version = DEFAULT_MODEL, DEFAULT_ENCODERS, FUSED_FILE, 'bundled'
+        key = (model_path, os.path.getmtime(model_path), os.path.getmtime(encoders_path))
+        return key, model_path, encoders_path, fused_path, version
+
+    def _refresh(self):
+        key, model_path, encoders_path, fused_path, version = self._source()
+        if self._loaded and self._loaded[0] == key:
+            return
+        # Load outside the lock so predictions keep using the old model meanwhile
+        if os.path.exists(fused_path):
+            import joblib
+            model = joblib.load(fused_path)
+        else:
+            model = build_fused_model(model_path, encoders_path, version)
+        with self._lock:
+            self._loaded = (key, model, version)
+        logger.info(f"Loaded yield model version {version}")
+
+    def get(self):
+        now = time.monotonic()
+        if self._loaded is None or now - self._last_check >= self.check_interval:
+            self._last_check = now
+            try:
+                self._refresh()
+            except Exception:
+                # Keep serving the previous model if a new one can't be loaded
+                if self._loaded is None:
+                    raise
+                logger.exception("Failed to reload yield model")
+        with self._lock:
+            return self._loaded[1]
+
+    @property
+    def version(self):
+        return self._loaded[2] if self._loaded else None
+
+_registry = None
+_registry_lock = threading.Lock()
+
+def get_registry():
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = ModelRegistry()
+        return _registry
@@ -0,0 +1,174 @@
+import argparse
+import logging
+import math
+from datetime import date, datetime, timedelta
+
+import pandas as pd
+
+from core.db import get_db
+from geo import county_for
+from yield_model import NUMERIC_FEATURES
+
+logger = logging.getLogger(__name__)
+
+# Expected corn supply per county and harvest month, scored in batch by the
+# yield model and stored so the marketplace reads a table instead of calling
+# the model. Two sources are kept side by side: the farm profiles farmers
+# save from the prediction tab, and every row of corn_data.csv.
+
+DATA_PATH = 'corn_data.csv'
+MATURITY_DAYS = 120  # planting to harvest for the maize varieties in the dataset
+HARVEST_MONTHS = (2, 8)  # short-rains and long-rains harvests
+
+PROFILE_COLUMNS = {
+    'acreage': 'Acreage', 'fertilizer_amount': 'Fertilizer amount', 'laborers': 'Laborers',
+    'household_size': 'Household size', 'education': 'Education', 'gender': 'Gender',
+    'age_bracket': 'Age bracket', 'water_source': 'Water source',
+    'main_credit_source': 'Main credit source', 'advisory_language': 'Advisory language',
+}
+
+def init_projections(conn):
+    conn.execute(f'''CREATE TABLE IF NOT EXISTS farm_profiles
+                 (farmer_id INTEGER PRIMARY KEY,
+                 {', '.join(f'{col} {"REAL" if PROFILE_COLUMNS[col] in NUMERIC_FEATURES else "TEXT"}'
+                            for col in PROFILE_COLUMNS)},
+                 planting_date TEXT,
+                 updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                 FOREIGN KEY (farmer_id) REFERENCES users(id))''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS supply_projections
+                 (source TEXT NOT NULL,
+                 county TEXT NOT NULL,
+                 harvest_window TEXT NOT NULL,
+                 farms INTEGER NOT NULL,
+                 expected_kg REAL NOT NULL,
+                 mean_kg REAL NOT NULL,
+                 model_version TEXT,
+                 computed_at TIMESTAMP,
+                 PRIMARY KEY (source, county, harvest_window))''')
+
+def _profile_value(feature, value):
+    # Missing inputs are kept as NULL; the model imputes them when scoring
+    if value is None or value == '':
+        return None
+    if feature in NUMERIC_FEATURES:
+        try:
+            number = float(value)
+        except (TypeError, ValueError):
+            raise ValueError(f"{feature} must be a number")
+        if isinstance(value, bool) or not math.isfinite(number) or number < 0:
+            raise ValueError(f"{feature} must be a non-negative number")
+        return number
+    if not isinstance(value, (str, int, float)) or isinstance(value, bool):
+        raise ValueError(f"{feature} must be text")
+    return str(value)
+
+def save_farm_profile(conn, farmer_id, profile):
+    """Store a farmer's prediction inputs (keyed by feature name) for batch scoring.
+
+    Raises ValueError naming the first field that can't be stored.
+    """
+    if not isinstance(profile, dict):
+        raise ValueError("A farm profile is an object keyed by feature name")
+    values = [_profile_value(feature, profile.get(feature)) for feature in PROFILE_COLUMNS.values()]
+    planting_date = profile.get('planting_date')
+    if planting_date:
+        try:
+            planting_date = date.fromisoformat(planting_date).isoformat()
+        except (TypeError, ValueError):
+            raise ValueError("planting_date must be a YYYY-MM-DD date")
+    conn.execute(f'''
+        INSERT INTO farm_profiles (farmer_id, {', '.join(PROFILE_COLUMNS)}, planting_date, updated_at)
+        VALUES (?, {', '.join('?' for _ in PROFILE_COLUMNS)}, ?, CURRENT_TIMESTAMP)
+        ON CONFLICT (farmer_id) DO UPDATE SET
+            {', '.join(f'{col} = excluded.{col}' for col in PROFILE_COLUMNS)},
+            planting_date = excluded.planting_date, updated_at = CURRENT_TIMESTAMP
+    ''', (farmer_id, *values, planting_date))
+
+def next_harvest_window(today=None):
+    # Rows without a planting date are assumed to come in at the next main harvest
+    today = today or date.today()
+    for year in (today.year, today.year + 1):
+        for month in HARVEST_MONTHS:
+            if (year, month) >= (today.year, today.month):
+                return f'{year}-{month:02d}'
+
+def harvest_windows(planting_dates, today=None):
+    default = next_harvest_window(today)
+    planted = pd.to_datetime(planting_dates, errors='coerce')
+    windows = (planted + timedelta(days=MATURITY_DAYS)).dt.strftime('%Y-%m')
+    return windows.fillna(default)
+
+def _aggregate(frame, source, model_version):
+    grouped = frame.groupby(['county', 'harvest_window'])['expected_kg'].agg(['count', 'sum', 'mean'])
+    computed_at = datetime.now().isoformat(timespec='seconds')
+    return [(source, county, window, int(row['count']), float(row['sum']), float(row['mean']),
+             model_version, computed_at)
+            for (county, window), row in grouped.iterrows()]
+
+def project_dataset(model, path=DATA_PATH, today=None):
+    frame = pd.read_csv(path)
+    frame['expected_kg'] = model.predict(frame)
+    frame['county'] = frame['County'].str.strip().str.upper()
+    frame['harvest_window'] = next_harvest_window(today)
+    return _aggregate(frame, 'dataset', model.version)
+
+def project_farmers(conn, model, today=None):
+    rows = conn.execute(f'''
+        SELECT p.{', p.'.join(PROFILE_COLUMNS)}, p.planting_date, u.location
+        FROM farm_profiles p
+        JOIN users u ON p.farmer_id = u.id
+    ''').fetchall()
+    frame = pd.DataFrame([tuple(row) for row in rows],
+                         columns=[*PROFILE_COLUMNS, 'planting_date', 'location'])
+    frame['county'] = [county_for(location) for location in frame['location']]
+    frame = frame.dropna(subset=['county']).rename(columns=PROFILE_COLUMNS)
+    if frame.empty:
+        return []
+    frame['expected_kg'] = model.predict(frame)
+    frame['harvest_window'] = harvest_windows(frame['planting_date'], today)
+    return _aggregate(frame, 'farmers', model.version)
+
+def refresh_projections(conn, model, data_path=DATA_PATH, today=None):
+    rows = project_farmers(conn, model, today)
+    if data_path:
+        rows += project_dataset(model, data_path, today)
+    conn.execute('DELETE FROM supply_projections')
+    conn.executemany('''INSERT INTO supply_projections
+                        (source, county, harvest_window, farms, expected_kg, mean_kg, model_version, computed_at)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?)''', rows)
+    return len(rows)
+
+def supply_projections(conn, county=None, source=None):
+    filters, params = [], []
+    if county:
+        filters.append('county = ?')
+        params.append(county.strip().upper())
+    if source:
+        filters.append('source = ?')
+        params.append(source)
+    where = f"WHERE {' AND '.join(filters)}" if filters else ''
+    rows = conn.execute(f'''SELECT * FROM supply_projections {where}
+                            ORDER BY harvest_window, expected_kg DESC''', params).fetchall()
+    return [dict(row) for row in rows]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Score farm profiles and compute supply projections")
+    parser.add_argument('command', choices=['refresh'])
+    parser.add_argument('--db', help="SQLite file (default: DATABASE_URL or FOOD_DONATION_DB)")
+    parser.add_argument('--data', default=DATA_PATH, help="Dataset to score as well; '' to skip")
+    args = parser.parse_args(argv)
+
+    from model_registry import get_registry
+    model = get_registry().get()
+    conn = get_db(args.db)
+    try:
+        init_projections(conn)
+        rows = refresh_projections(conn, model, args.data or None)
+        conn.commit()
+        logger.info(f"Stored {rows} projection rows (model {model.version or 'bundled'})")
+    finally:
+        conn.close()
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,157 @@
+import argparse
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from flask import g
+
+from auth import token_user_id
+from core.db import DB_PATH, READ_REPLICA, get_db, get_replica_db, is_postgres
+
+logger = logging.getLogger(__name__)
+
+# Read routing. Read-only routes take their connection from read_db(), which
+# uses the replica (see READ_REPLICA in core/db.py) unless:
+#   - the replica is more than MAX_LAG seconds behind, or
+#   - the caller wrote something since the replica's snapshot was taken
+#     (read-your-writes: their next page load must show the change).
+# Last-write times are kept per API process, so with several gunicorn workers
+# a write and the read after it can land on different workers; MAX_LAG bounds
+# how stale that read can be.
+
+MAX_LAG = float(os.environ.get('REPLICA_MAX_LAG', 30))  # seconds
+LAG_CHECK_INTERVAL = 1.0  # seconds between lag measurements
+META_TABLE = 'replica_meta'
+
+# ----- SQLite copy refreshed with the backup API -----
+def refresh_replica(replica_path, primary_path=DB_PATH):
+    """Copy the primary into replica_path atomically; returns the snapshot time."""
+    # Anything committed before this instant is in the copy
+    as_of = time.time()
+    tmp_path = replica_path + '.tmp'
+    source = sqlite3.connect(f'file:{primary_path}?mode=ro', uri=True)
+    target = sqlite3.connect(tmp_path)
+    try:
+        # One step: a reader holding the snapshot doesn't block WAL writers,
+        # and a stepped copy would restart every time someone writes
+        source.backup(target)
+        target.execute(f'CREATE TABLE IF NOT EXISTS {META_TABLE} (as_of REAL NOT NULL)')
+        target.execute(f'DELETE FROM {META_TABLE}')
+        target.execute(f'INSERT INTO {META_TABLE} (as_of) VALUES (?)', (as_of,))
+        target.commit()
+    finally:
+        target.close()
+        source.close()
+    # Open connections keep reading the old file; new ones get the fresh copy
+    os.replace(tmp_path, replica_path)
+    return as_of
+
+def measure_lag(conn, mode=READ_REPLICA):
+    if mode == 'wal':
+        return 0.0  # same file as the primary
+    if is_postgres(mode):
+        row = conn.execute('''SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                              ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+                              END''').fetchone()
+        return float(row[0] or 0)
+    row = conn.execute(f'SELECT as_of FROM {META_TABLE}').fetchone()
+    return time.time() - row[0]
+
+class ReadRouter:
+    def __init__(self, mode=READ_REPLICA, max_lag=MAX_LAG):
+        self.mode = mode
+        self.max_lag = max_lag
+        self._last_write = {}
+        self._lag = None
+        self._as_of = None  # wall-clock time the replica was current to, as of the last measurement
+        self._lag_checked = 0.0
+        self._lock = threading.Lock()
+        self.counters = {'replica': 0, 'read_your_writes': 0, 'lagging': 0}
+
+    def note_write(self, user_id):
+        now = time.time()
+        with self._lock:
+            self._last_write[user_id] = now
+            if len(self._last_write) > 10000:
+                # Past max_lag the replica has caught up or isn't used anyway
+                self._last_write = {uid: at for uid, at in self._last_write.items()
+                                    if now - at <= self.max_lag}
+
+    def lag(self):
+        """Seconds the replica is behind, measured at most once a second; None if unreachable."""
+        now = time.monotonic()
+        if now - self._lag_checked >= LAG_CHECK_INTERVAL:
+            self._lag_checked = now
+            conn = None
+            try:
+                conn = get_replica_db()
+                self._lag = measure_lag(conn, self.mode)
+                self._as_of = time.time() - self._lag
+            except Exception as e:
+                logger.warning(f"Can't measure replica lag: {e}")
+                self._lag = self._as_of = None
+            finally:
+                if conn is not None:
+                    conn.close()
+        return self._lag
+
+    def _count(self, outcome):
+        with self._lock:
+            self.counters[outcome] += 1
+
+    def connect(self, user_id=None):
+        if not self.mode:
+            return get_db()
+        lag = self.lag()
+        if lag is None or lag > self.max_lag:
+            self._count('lagging')
+            return get_db()
+        # Compare with the snapshot time from the measurement, not now - lag:
+        # the lag is up to LAG_CHECK_INTERVAL old, and now - lag would move
+        # past the snapshot and send a just-written caller to the replica
+        last_write = self._last_write.get(user_id) if user_id is not None else None
+        as_of = self._as_of
+        if last_write is not None and (as_of is None or last_write > as_of):
+            self._count('read_your_writes')
+            return get_db()
+        self._count('replica')
+        return get_replica_db()
+
+    def metrics(self):
+        lag = self.lag() if self.mode else None
+        with self._lock:
+            counters = dict(self.counters)
+        return {'mode': ('postgres' if is_postgres(self.mode) else self.mode) or None,
+                'lag_seconds': round(lag, 3) if lag is not None else None,
+                'max_lag_seconds': self.max_lag, 'reads': counters}
+
+read_router = ReadRouter()
+
+def read_db():
+    """Connection for a read-only route: the replica when it's fresh enough for this caller."""
+    user = g.get('user')
+    return read_router.connect(user['id'] if user else token_user_id())
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Maintain the SQLite read replica")
+    parser.add_argument('command', choices=['refresh'])
+    parser.add_argument('--replica', default=READ_REPLICA, help="Replica file (default: READ_REPLICA)")
+    parser.add_argument('--db', default=DB_PATH, help="Primary SQLite file")
+    parser.add_argument('--every', type=float, help="Keep refreshing every N seconds")
+    args = parser.parse_args(argv)
+    if not args.replica or args.replica == 'wal' or is_postgres(args.replica):
+        raise SystemExit("Give --replica (or READ_REPLICA) as the path of the SQLite copy")
+
+    while True:
+        start = time.monotonic()
+        refresh_replica(args.replica, args.db)
+        logger.info(f"Refreshed {args.replica} in {time.monotonic() - start:.2f}s")
+        if not args.every:
+            break
+        time.sleep(max(0.0, args.every - (time.monotonic() - start)))
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    main()
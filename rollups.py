@@ -0,0 +1,156 @@
+import argparse
+
+from core.db import get_db
+
+# Daily marketplace aggregates, kept up to date in the same transaction as
+# create_request/update_request so dashboards never GROUP BY the hot tables.
+# Rows are bucketed by the day the request was made and by the farmer's
+# county at that time, stored on the request, so a full rebuild reproduces
+# the incremental totals exactly even after a farmer moves.
+
+MEASURES = ('request_count', 'requested_kg', 'approved_kg', 'rejected_kg', 'completed_kg')
+
+# Which measures a request counts towards in each status
+STATUS_MEASURES = {
+    'pending': {'request_count', 'requested_kg'},
+    'approved': {'request_count', 'requested_kg', 'approved_kg'},
+    'rejected': {'request_count', 'requested_kg', 'rejected_kg'},
+    'completed': {'request_count', 'requested_kg', 'approved_kg', 'completed_kg'},
+}
+
+# The county a new request counts towards: its farmer's location right now
+REQUEST_COUNTY = '''(SELECT COALESCE(UPPER(TRIM(u.location)), 'UNKNOWN')
+                     FROM listings l JOIN users u ON l.farmer_id = u.id
+                     WHERE l.id = requests.listing_id)'''
+
+def init_rollups(conn):
+    columns = [col[0] for col in conn.execute('SELECT * FROM requests LIMIT 0').description]
+    if 'county' not in columns:
+        conn.execute('ALTER TABLE requests ADD COLUMN county TEXT')
+        conn.execute(f'UPDATE requests SET county = {REQUEST_COUNTY}')
+    # foodbank_id is 0 for buyer requests so it can be part of the key
+    conn.execute('''CREATE TABLE IF NOT EXISTS daily_rollups
+                 (day TEXT NOT NULL,
+                 farmer_id INTEGER NOT NULL,
+                 foodbank_id INTEGER NOT NULL DEFAULT 0,
+                 produce_type TEXT NOT NULL,
+                 county TEXT NOT NULL,
+                 request_count INTEGER DEFAULT 0,
+                 requested_kg REAL DEFAULT 0,
+                 approved_kg REAL DEFAULT 0,
+                 rejected_kg REAL DEFAULT 0,
+                 completed_kg REAL DEFAULT 0,
+                 PRIMARY KEY (day, farmer_id, foodbank_id, produce_type, county))''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_rollups_foodbank ON daily_rollups (foodbank_id, day)')
+
+def _request_key(conn, request_id):
+    return conn.execute('''
+        SELECT SUBSTR(r.created_at, 1, 10) as day, l.farmer_id, COALESCE(r.foodbank_id, 0) as foodbank_id,
+               LOWER(TRIM(l.produce_type)) as produce_type,
+               COALESCE(r.county, 'UNKNOWN') as county, r.quantity
+        FROM requests r
+        JOIN listings l ON r.listing_id = l.id
+        WHERE r.id = ?
+    ''', (request_id,)).fetchone()
+
+def apply_request_change(conn, request_id, old_status, new_status):
+    """Adjust the rollups for a request moving from old_status to new_status.
+
+    Call inside the same transaction as the INSERT/UPDATE on requests;
+    old_status is None for a newly created request, which also records
+    the county it counts towards.
+    """
+    if old_status is None:
+        conn.execute(f'UPDATE requests SET county = {REQUEST_COUNTY} WHERE id = ?', (request_id,))
+    old = STATUS_MEASURES.get(old_status, set())
+    new = STATUS_MEASURES.get(new_status, set())
+    if old == new:
+        return
+    key = _request_key(conn, request_id)
+    if key is None:
+        return
+    day, farmer_id, foodbank_id, produce_type, county, quantity = key
+    quantity = float(quantity or 0)
+    deltas = {}
+    for measure in MEASURES:
+        sign = (measure in new) - (measure in old)
+        if sign:
+            deltas[measure] = sign * (1 if measure == 'request_count' else quantity)
+
+    columns = ', '.join(deltas)
+    placeholders = ', '.join('?' for _ in deltas)
+    updates = ', '.join(f'{m} = daily_rollups.{m} + excluded.{m}' for m in deltas)
+    conn.execute(f'''
+        INSERT INTO daily_rollups (day, farmer_id, foodbank_id, produce_type, county, {columns})
+        VALUES (?, ?, ?, ?, ?, {placeholders})
+        ON CONFLICT (day, farmer_id, foodbank_id, produce_type, county) DO UPDATE SET {updates}
+    ''', (day, farmer_id, foodbank_id, produce_type, county, *deltas.values()))
+
+def rebuild_rollups(conn):
+    # Recompute everything from requests; safe to run while the app is up
+    # because it happens in a single transaction
+    sums = ',\n'.join(
+        f"SUM(CASE WHEN r.status IN ({', '.join(repr(s) for s, m in STATUS_MEASURES.items() if measure in m)}) "
+        f"THEN {'1' if measure == 'request_count' else 'r.quantity'} ELSE 0 END)"
+        for measure in MEASURES
+    )
+    conn.execute('DELETE FROM daily_rollups')
+    conn.execute(f'''
+        INSERT INTO daily_rollups (day, farmer_id, foodbank_id, produce_type, county, {', '.join(MEASURES)})
+        SELECT SUBSTR(r.created_at, 1, 10), l.farmer_id, COALESCE(r.foodbank_id, 0),
+               LOWER(TRIM(l.produce_type)), COALESCE(r.county, 'UNKNOWN'),
+               {sums}
+        FROM requests r
+        JOIN listings l ON r.listing_id = l.id
+        GROUP BY 1, 2, 3, 4, 5
+    ''')
+    return conn.execute('SELECT COUNT(*) FROM daily_rollups').fetchone()[0]
+
+def farmer_summary(conn, farmer_id):
+    rows = conn.execute(f'''
+        SELECT day, produce_type, CASE WHEN foodbank_id = 0 THEN 'buyer' ELSE 'foodbank' END as channel,
+               {', '.join(f'SUM({m}) as {m}' for m in MEASURES)}
+        FROM daily_rollups
+        WHERE farmer_id = ?
+        GROUP BY day, produce_type, channel
+        ORDER BY day
+    ''', (farmer_id,)).fetchall()
+    return [dict(row) for row in rows]
+
+def foodbank_summary(conn, foodbank_id):
+    rows = conn.execute(f'''
+        SELECT day, produce_type, county, {', '.join(f'SUM({m}) as {m}' for m in MEASURES)}
+        FROM daily_rollups
+        WHERE foodbank_id = ?
+        GROUP BY day, produce_type, county
+        ORDER BY day
+    ''', (foodbank_id,)).fetchall()
+    return [dict(row) for row in rows]
+
+def county_donations(conn):
+    rows = conn.execute(f'''
+        SELECT county, {', '.join(f'SUM({m}) as {m}' for m in MEASURES)}
+        FROM daily_rollups
+        WHERE foodbank_id != 0
+        GROUP BY county
+        ORDER BY completed_kg DESC, approved_kg DESC
+    ''').fetchall()
+    return [dict(row) for row in rows]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Maintain the marketplace rollup tables")
+    parser.add_argument('command', choices=['rebuild'])
+    parser.add_argument('--db', help="SQLite file (default: DATABASE_URL or FOOD_DONATION_DB)")
+    args = parser.parse_args(argv)
+
+    conn = get_db(args.db)
+    try:
+        init_rollups(conn)
+        rows = rebuild_rollups(conn)
+        conn.commit()
+        print(f"Rebuilt {rows} rollup rows")
+    finally:
+        conn.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,163 @@
+import argparse
+import random
+import time
+
+import numpy as np
+
+from core.db import get_db
+from geo import distance_matrix, locate
+
+# Pickup tours for a food bank's approved requests. Requests are grouped into
+# one stop per farmer, split into vehicle-sized trips by nearest-neighbour
+# construction, and each trip is then shortened with 2-opt. Distances are
+# straight-line km scaled by ROAD_FACTOR, so totals are estimates.
+
+DEFAULT_CAPACITY_KG = 1000
+ROAD_FACTOR = 1.3  # typical road distance / great-circle distance
+
+def load_stops(conn, foodbank_id):
+    rows = conn.execute('''
+        SELECT r.id, r.quantity, l.produce_type, l.best_before,
+               u.id as farmer_id, u.name as farmer_name, u.phone, u.location
+        FROM requests r
+        JOIN listings l ON r.listing_id = l.id
+        JOIN users u ON l.farmer_id = u.id
+        WHERE r.foodbank_id = ? AND r.status = 'approved'
+        ORDER BY u.id, l.best_before
+    ''', (foodbank_id,)).fetchall()
+    stops, unlocated = {}, []
+    for row in rows:
+        point = locate(row['location'])
+        if point is None:
+            unlocated.append({'request_id': row['id'], 'farmer_name': row['farmer_name'],
+                              'location': row['location']})
+            continue
+        stop = stops.setdefault(row['farmer_id'], {
+            'farmer_id': row['farmer_id'], 'farmer_name': row['farmer_name'], 'phone': row['phone'],
+            'location': row['location'], 'lat': point[0], 'lon': point[1],
+            'kg': 0.0, 'request_ids': [], 'produce': [], 'best_before': row['best_before']})
+        stop['kg'] += row['quantity']
+        stop['request_ids'].append(row['id'])
+        stop['produce'].append(f"{row['produce_type']} ({row['quantity']:g}kg)")
+    return list(stops.values()), unlocated
+
+def depot_for(conn, foodbank_id):
+    # An explicit point from the food bank's declared demand wins over its county
+    row = conn.execute('''SELECT latitude, longitude FROM foodbank_demand
+                          WHERE foodbank_id = ? AND latitude IS NOT NULL LIMIT 1''',
+                       (foodbank_id,)).fetchone()
+    if row:
+        return (row[0], row[1])
+    user = conn.execute('SELECT location FROM users WHERE id = ?', (foodbank_id,)).fetchone()
+    return locate(user[0]) if user else None
+
+def two_opt(tour, dist):
+    """Improve a closed tour (depot first and last) in place until no 2-opt move helps."""
+    tour = np.asarray(tour)
+    improved = True
+    while improved:
+        improved = False
+        for i in range(1, len(tour) - 2):
+            # Gain of reversing tour[i:j+1] for every j at once
+            a, b = tour[i - 1], tour[i]
+            c, d = tour[i + 1:-1], tour[i + 2:]
+            delta = dist[a, c] + dist[b, d] - dist[a, b] - dist[c, d]
+            j = int(np.argmin(delta))
+            if delta[j] < -1e-9:
+                tour[i:i + j + 2] = tour[i:i + j + 2][::-1].copy()
+                improved = True
+    return tour.tolist()
+
+def split_trips(loads, dist, capacity):
+    # Nearest-neighbour from the depot (node 0), returning whenever no
+    # unvisited stop fits what's left in the vehicle
+    unvisited = set(range(1, len(loads)))
+    trips = []
+    while unvisited:
+        trip, position, room = [0], 0, capacity
+        while True:
+            fitting = [n for n in unvisited if loads[n] <= room]
+            if not fitting:
+                if len(trip) == 1:
+                    # A stop bigger than the vehicle gets a trip of its own
+                    fitting = [min(unvisited, key=lambda n: dist[0, n])]
+                else:
+                    break
+            nearest = min(fitting, key=lambda n: dist[position, n])
+            unvisited.discard(nearest)
+            trip.append(nearest)
+            room -= loads[nearest]
+            position = nearest
+            if room <= 0 or not unvisited:
+                break
+        trips.append(trip + [0])
+    return trips
+
+def plan_route(depot, stops, capacity_kg=DEFAULT_CAPACITY_KG):
+    if not stops:
+        return {'trips': [], 'total_km': 0.0, 'capacity_kg': capacity_kg}
+    dist = distance_matrix([depot] + [(s['lat'], s['lon']) for s in stops]) * ROAD_FACTOR
+    loads = [0.0] + [s['kg'] for s in stops]
+    trips = []
+    for tour in split_trips(loads, dist, capacity_kg):
+        tour = two_opt(tour, dist)
+        distance = float(sum(dist[a, b] for a, b in zip(tour, tour[1:])))
+        trips.append({
+            'stops': [stops[n - 1] for n in tour[1:-1]],
+            'load_kg': round(sum(loads[n] for n in tour), 2),
+            'distance_km': round(distance, 1),
+            'over_capacity': sum(loads[n] for n in tour) > capacity_kg,
+        })
+    return {
+        'trips': trips,
+        'total_km': round(sum(t['distance_km'] for t in trips), 1),
+        'capacity_kg': capacity_kg,
+    }
+
+def foodbank_route(conn, foodbank_id, capacity_kg=DEFAULT_CAPACITY_KG, depot=None):
+    depot = depot or depot_for(conn, foodbank_id)
+    if depot is None:
+        raise ValueError("Set your county in your profile so pickups can be planned")
+    stops, unlocated = load_stops(conn, foodbank_id)
+    route = plan_route(depot, stops, capacity_kg)
+    route['depot'] = {'lat': depot[0], 'lon': depot[1]}
+    route['unlocated'] = unlocated
+    return route
+
+def benchmark(n_stops=500, capacity_kg=DEFAULT_CAPACITY_KG, seed=0):
+    rng = random.Random(seed)
+    depot = (-1.29, 36.82)
+    stops = [{'lat': depot[0] + rng.uniform(-1.5, 1.5), 'lon': depot[1] + rng.uniform(-1.5, 1.5),
+              'kg': rng.uniform(10, 300)} for _ in range(n_stops)]
+    start = time.monotonic()
+    route = plan_route(depot, stops, capacity_kg)
+    elapsed = time.monotonic() - start
+    print(f"{n_stops} stops, {capacity_kg}kg vehicle: {len(route['trips'])} trips, "
+          f"{route['total_km']:,.0f} km in {elapsed:.2f}s")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Plan pickup routes for food banks")
+    parser.add_argument('command', choices=['plan', 'benchmark'])
+    parser.add_argument('--db', help="SQLite file (default: DATABASE_URL or FOOD_DONATION_DB)")
+    parser.add_argument('--foodbank-id', type=int)
+    parser.add_argument('--capacity', type=float, default=DEFAULT_CAPACITY_KG)
+    parser.add_argument('--stops', type=int, default=500)
+    args = parser.parse_args(argv)
+
+    if args.command == 'benchmark':
+        benchmark(args.stops, args.capacity)
+        return
+
+    conn = get_db(args.db)
+    try:
+        route = foodbank_route(conn, args.foodbank_id, args.capacity)
+    finally:
+        conn.close()
+    for number, trip in enumerate(route['trips'], 1):
+        names = ' -> '.join(stop['farmer_name'] for stop in trip['stops'])
+        print(f"Trip {number} ({trip['load_kg']}kg, {trip['distance_km']}km): depot -> {names} -> depot")
+    for stop in route['unlocated']:
+        print(f"Couldn't place request {stop['request_id']} ({stop['location'] or 'no location'})")
+
+if __name__ == '__main__':
+    main()
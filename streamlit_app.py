@@ -1,4 +1,5 @@
 import datetime
+import functools
 import streamlit as st
 import pandas as pd
 import requests
@@ -6,12 +7,12 @@ import json
 import time
 import base64
 from io import BytesIO
-from PIL import Image
 
-from app import get_db
-
-import joblib
-from sklearn.pipeline import Pipeline
+from image_prep import prepare_image, prepare_uploads, to_base64, format_bytes
+from model_registry import get_registry
+from image_cache import ThumbnailCache
+from core.api_client import NOT_MODIFIED, fetch_many, http_session
+from core.codec import decode_response
 
 # Add this at the top of your streamlit_app.py
 # st.markdown("""
@@ -75,38 +76,235 @@ if 'role' not in st.session_state:
     st.session_state.role = None
 if 'page' not in st.session_state:
     st.session_state.page = "login"
+if 'token' not in st.session_state:
+    st.session_state.token = None
 
 # ----- Helper Functions -----
+def auth_headers():
+    # The HTTP session is shared by every Streamlit session, so the token goes per request
+    token = st.session_state.get('token')
+    return {'Authorization': f"Bearer {token}"} if token else {}
+
+def end_session(message=None):
+    for key in ('user', 'role', 'token'):
+        st.session_state[key] = None
+    st.session_state.page = "login"
+    st.session_state.pop('api_cache', None)
+    st.session_state.pop('dashboard_docs', None)
+    if message:
+        st.warning(message)
+
+def check_auth(response):
+    if response.status_code == 401 and st.session_state.get('token'):
+        end_session("Your session has expired, please log in again")
+        st.stop()
+
+def throttled(response):
+    # 429: rate limited or the server is shedding load; say so instead of erroring
+    if response.status_code != 429:
+        return False
+    st.warning(f"The server is busy, please try again in {response.headers.get('Retry-After', 'a few')} seconds")
+    return True
+
+def check_fetched(responses):
+    # fetch_many's error responses get the handling call_api gives one call;
+    # returns True if the server is throttling us
+    for response in responses.values():
+        check_auth(response)
+    busy = next((response for response in responses.values() if response.status_code == 429), None)
+    return busy is not None and throttled(busy)
+
 def call_api(endpoint, method="GET", data=None):
     try:
+        session = http_session()
+        headers = auth_headers()
         if method == "GET":
-            response = requests.get(f"{API_BASE_URL}/{endpoint}")
+            response = session.get(f"{API_BASE_URL}/{endpoint}", headers=headers)
         elif method == "POST":
-            response = requests.post(f"{API_BASE_URL}/{endpoint}", json=data)
+            response = session.post(f"{API_BASE_URL}/{endpoint}", json=data, headers=headers)
         elif method == "PUT":
-            response = requests.put(f"{API_BASE_URL}/{endpoint}", json=data)
+            response = session.put(f"{API_BASE_URL}/{endpoint}", json=data, headers=headers)
         elif method == "DELETE":
-            response = requests.delete(f"{API_BASE_URL}/{endpoint}")
+            response = session.delete(f"{API_BASE_URL}/{endpoint}", headers=headers)
         
+        check_auth(response)
+        if throttled(response):
+            return None
         response.raise_for_status()
-        return response.json()
+        return decode_response(response)
     except requests.exceptions.RequestException as e:
         st.error(f"API Error: {str(e)}")
         return None
 
+def call_bulk_api(endpoint, method, data, partial=False):
+    # Bulk endpoints answer 400 with per-row results, so don't raise on it
+    try:
+        url = f"{API_BASE_URL}/{endpoint}" + ("?partial=1" if partial else "")
+        response = http_session().request(method, url, json=data, headers=auth_headers())
+        check_auth(response)
+        if throttled(response):
+            return None
+        if response.status_code not in (200, 400):
+            response.raise_for_status()
+        return decode_response(response)
+    except (requests.exceptions.RequestException, ValueError) as e:
+        st.error(f"API Error: {str(e)}")
+        return None
+
+def show_bulk_results(response, label):
+    if response is None:
+        return
+    failed = [r for r in response.get("results", []) if not r.get("success")]
+    if response.get("success"):
+        st.success(f"{response.get('created', response.get('updated', 0))} {label} saved")
+    else:
+        st.error(response.get("error", "Bulk update failed"))
+    if failed:
+        st.dataframe(pd.DataFrame(failed), hide_index=True)
+
+def avatar_url(ref):
+    return f"{API_BASE_URL.rstrip('/')}/{ref}"
+
 def image_to_base64(image):
     buffered = BytesIO()
     image.save(buffered, format="JPEG")
     return base64.b64encode(buffered.getvalue()).decode()
 
+@st.cache_resource
+def get_thumbnail_cache():
+    # One cache per process, shared by every session
+    return ThumbnailCache()
+
+def cached_thumbnail(image_b64):
+    return get_thumbnail_cache().thumbnail(image_b64)
+
+# ----- Cached Data & Fragments -----
+API_CACHE_TTL = 30  # seconds before a cached GET is fetched again
+
+def cached_api(endpoint, ttl=API_CACHE_TTL):
+    # GET results are kept in session state so fragment and full reruns
+    # don't refetch data that hasn't changed
+    cache = st.session_state.setdefault('api_cache', {})
+    entry = cache.get(endpoint)
+    if entry and time.time() - entry[0] < ttl:
+        return entry[1]
+    # Don't block again on a call that just failed or timed out in prefetch;
+    # the panel renders without it and the next rerun retries
+    failed = st.session_state.get('prefetch_failed', {})
+    if endpoint in failed:
+        st.warning(f"Couldn't load this section: {failed.pop(endpoint)}")
+        return None
+    data = call_api(endpoint)
+    if data is not None:
+        cache[endpoint] = (time.time(), data)
+    return data
+
+def prefetch_api(endpoints, ttl=API_CACHE_TTL):
+    # Fetch everything a page needs concurrently into the cache, so page
+    # latency is the slowest call rather than the sum of all of them
+    cache = st.session_state.setdefault('api_cache', {})
+    now = time.time()
+    stale = [e for e in endpoints if e not in cache or now - cache[e][0] >= ttl]
+    if not stale:
+        return
+    results, errors, _, elapsed, responses = fetch_many(API_BASE_URL, stale, headers=auth_headers())
+    check_fetched(responses)
+    for endpoint, data in results.items():
+        cache[endpoint] = (time.time(), data)
+    st.session_state.prefetch_failed = errors
+    record_timing("Prefetch", elapsed)
+
+def prefetch_dashboard(role_key, sections, ttl=API_CACHE_TTL):
+    # Load the whole role view in one round-trip and fan its sections out to
+    # the per-endpoint cache keys the panels read. sections maps a section of
+    # the /dashboard response to one or more cache keys (with optional filter).
+    cache = st.session_state.setdefault('api_cache', {})
+    now = time.time()
+    if all(key in cache and now - cache[key][0] < ttl for keys in sections.values() for key, _ in keys):
+        return
+    
+    endpoint = f"dashboard/{role_key}/{st.session_state.user['id']}"
+    docs = st.session_state.setdefault('dashboard_docs', {})
+    etag, doc = docs.get(endpoint, (None, None))
+    results, errors, etags, elapsed, responses = fetch_many(API_BASE_URL, [endpoint],
+                                                            etags={endpoint: etag} if doc else None,
+                                                            headers=auth_headers())
+    record_timing("Prefetch", elapsed)
+    if check_fetched(responses):
+        # Throttled: asking for every section separately would only make it worse
+        st.session_state.prefetch_failed = {key: errors[endpoint] for keys in sections.values() for key, _ in keys}
+        return
+    if endpoint in errors:
+        # Fall back to the individual endpoints so the page can still render partially
+        prefetch_api([key for keys in sections.values() for key, _ in keys], ttl)
+        return
+    
+    if results[endpoint] is not NOT_MODIFIED:
+        doc = results[endpoint]
+        docs[endpoint] = (etags.get(endpoint), doc)
+    for section, keys in sections.items():
+        for key, keep in keys:
+            data = doc.get(section, [])
+            cache[key] = (time.time(), [row for row in data if keep(row)] if keep else data)
+
+def invalidate_api(*prefixes):
+    cache = st.session_state.get('api_cache', {})
+    for endpoint in list(cache):
+        if endpoint.startswith(prefixes):
+            del cache[endpoint]
+
+def record_timing(name, seconds):
+    timings = st.session_state.setdefault('fragment_timings', {})
+    last_ms, runs, total_ms = timings.get(name, (0.0, 0, 0.0))
+    timings[name] = (seconds * 1000, runs + 1, total_ms + seconds * 1000)
+
+def timed_fragment(name):
+    # Wraps a panel in st.fragment so its widgets only rerun that panel,
+    # and records how long each run of it takes
+    def decorator(func):
+        @st.fragment
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                record_timing(name, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+def rerun_panel(message=None):
+    # Toasts survive the rerun, so there's no need to sleep before it
+    if message:
+        st.toast(message)
+    st.rerun(scope="fragment")
+
+@st.fragment(run_every=5)
+def rerun_timing_panel():
+    with st.expander("⏱️ Rerun timings"):
+        stats = get_thumbnail_cache().stats()
+        st.caption(
+            f"Image cache: {stats['entries']} thumbnails, "
+            f"{format_bytes(stats['bytes'])} / {format_bytes(stats['max_bytes'])}, "
+            f"hit rate {stats['hit_rate']:.0%} ({stats['evictions']} evicted)"
+        )
+        timings = st.session_state.get('fragment_timings', {})
+        if not timings:
+            st.caption("No runs recorded yet")
+            return
+        st.dataframe(pd.DataFrame([
+            {"Panel": name, "Last (ms)": round(last, 1), "Runs": runs, "Avg (ms)": round(total / runs, 1)}
+            for name, (last, runs, total) in sorted(timings.items())
+        ]), hide_index=True)
+
 # ----- Yield Prediction Tab -----
+@timed_fragment("Yield prediction")
 def yield_prediction_tab():
     st.title("🌽 Corn Yield Prediction")
     
-    # Load the trained model and encoders
+    # Load the fused model (hot-swapped when a retrain is promoted)
     try:
-        model = joblib.load('corn_yield_predictor.pkl')
-        label_encoders = joblib.load('label_encoders.pkl')
+        model = get_registry().get()
     except Exception as e:
         st.error(f"Error loading model: {str(e)}")
         return
@@ -130,26 +328,32 @@ def yield_prediction_tab():
         water_source = st.selectbox("Water Source", ["Rain", "Irrigation", "Other"])
         credit_source = st.selectbox("Main Credit Source", ["Credit groups", "Savings", "Family", "Other"])
         advisory_lang = st.selectbox("Advisory Language", ["Kiswahili", "English", "Vernacular"])
+        planting_date = st.date_input("Planting Date")
+        save_profile = st.checkbox("Save as my farm profile (adds my harvest to the regional supply outlook)")
         
         if st.form_submit_button("Predict Yield"):
-            # Create input DataFrame
-            input_data = pd.DataFrame({
-                'Acreage': [acreage],
-                'Fertilizer amount': [fertilizer],
-                'Laborers': [laborers],
-                'Education': [education],
-                'Gender': [gender],
-                'Age bracket': [age_bracket],
-                'Household size': [household_size],
-                'Water source': [water_source],
-                'Main credit source': [credit_source],
-                'Advisory language': [advisory_lang]
-            })
+            input_data = {
+                'Acreage': acreage,
+                'Fertilizer amount': fertilizer,
+                'Laborers': laborers,
+                'Education': education,
+                'Gender': gender,
+                'Age bracket': age_bracket,
+                'Household size': household_size,
+                'Water source': water_source,
+                'Main credit source': credit_source,
+                'Advisory language': advisory_lang
+            }
+            
+            if save_profile:
+                if call_api(f"farm_profile/{st.session_state.user['id']}", "PUT",
+                            {**input_data, "planting_date": planting_date.isoformat()}):
+                    st.toast("Farm profile saved")
             
-            # Encode categorical variables
-            for col in label_encoders:
-                if col in input_data.columns:
-                    input_data[col] = label_encoders[col].transform(input_data[col])
+            # Unseen categories fall back to the most common training value
+            unknown = model.unknown_categories(input_data)
+            if unknown:
+                st.info("Not in the training data, using the most common value for: " + ", ".join(unknown))
             
             # Make prediction
             try:
@@ -289,11 +493,15 @@ def messages_tab():
     </style>
     """, unsafe_allow_html=True)
     
+    messages_panel()
+
+@timed_fragment("Messages")
+def messages_panel():
     if 'current_chat' not in st.session_state:
         st.session_state.current_chat = None
     
     # Get all conversations
-    conversations = call_api(f"conversations/{st.session_state.user['id']}")
+    conversations = cached_api(f"conversations/{st.session_state.user['id']}", ttl=10)
     
     col1, col2 = st.columns([1, 3])
     
@@ -305,9 +513,12 @@ def messages_tab():
                 if st.button(f"{unread} {conv.get('partner_name', 'Unknown')}", key=f"conv_{conv.get('partner_id', 0)}"):
                     st.session_state.current_chat = {
                         'receiver_id': conv.get('partner_id'),
-                        'receiver_name': conv.get('partner_name', 'Unknown')
+                        'receiver_name': conv.get('partner_name', 'Unknown'),
+                        'archived_messages': conv.get('archived_messages', 0)
                     }
-                    st.rerun()
+                    # Opening a chat marks it read on the server
+                    invalidate_api("conversations/")
+                    rerun_panel()
         else:
             st.info("No conversations yet")
     
@@ -315,8 +526,12 @@ def messages_tab():
         if st.session_state.current_chat:
             st.subheader(f"Chat with {st.session_state.current_chat.get('receiver_name', 'Unknown')}")
             
-            # Get message history
-            messages = call_api(f"messages/{st.session_state.user['id']}/{st.session_state.current_chat['receiver_id']}")
+            # Get message history; archived months are only fetched on request
+            archived = st.session_state.current_chat.get('archived_messages', 0)
+            show_archived = archived and st.checkbox(f"Show {archived} older archived messages",
+                                                     key=f"archived_{st.session_state.current_chat['receiver_id']}")
+            messages = call_api(f"messages/{st.session_state.user['id']}/{st.session_state.current_chat['receiver_id']}"
+                                + ("?archived=1" if show_archived else ""))
             
             # Display messages with proper date grouping
             if messages:
@@ -383,12 +598,12 @@ def messages_tab():
             new_msg = st.chat_input("Type your message...")
             if new_msg:
                 response = call_api("messages", "POST", {
-                    "sender_id": st.session_state.user['id'],
                     "receiver_id": st.session_state.current_chat['receiver_id'],
                     "content": new_msg
                 })
                 if response and response.get('success'):
-                    st.rerun()
+                    invalidate_api("conversations/")
+                    rerun_panel()
         else:
             st.info("Select a conversation or start a new one")
 
@@ -417,8 +632,15 @@ def profile_tab():
             # Display current profile picture
             if user_data.get('profile_pic'):
                 try:
+                    # New accounts carry an avatar URL the browser can cache;
+                    # fall back to decoding legacy inline base64 images
+                    profile_pic = user_data['profile_pic']
+                    if profile_pic.startswith("avatars/"):
+                        image = avatar_url(profile_pic)
+                    else:
+                        image = cached_thumbnail(profile_pic)
                     st.image(
-                        Image.open(BytesIO(base64.b64decode(user_data['profile_pic']))),
+                        image,
                         width=150,
                         caption="Your Profile Picture"
                     )
@@ -445,7 +667,7 @@ def profile_tab():
             
             if uploaded_file:
                 with st.spinner("Updating profile picture..."):
-                    if handle_profile_pic_upload(uploaded_file, user_data['id']):
+                    if handle_profile_pic_upload(uploaded_file):
                         st.rerun()
         
         with col2:
@@ -465,7 +687,6 @@ def profile_tab():
             
             if st.form_submit_button("Update Profile"):
                 update_data = {
-                    "user_id": user_data['id'],
                     "name": new_name,
                     "location": new_location,
                     "phone": new_phone
@@ -514,34 +735,15 @@ def profile_tab():
         elif st.session_state.profile_action == "delete_account":
             delete_account_confirmation()
 
-def handle_profile_pic_upload(uploaded_file, user_id):
+def handle_profile_pic_upload(uploaded_file):
     if uploaded_file is not None:
         try:
-            # Validate image
-            img = Image.open(uploaded_file)
-            img.verify()  # Verify it's a valid image
-            
-            # Process image
-            img = Image.open(uploaded_file)  # Reopen after verify
-            buffered = BytesIO()
-            
-            # Convert to RGB if needed (for PNG transparency)
-            if img.mode in ("RGBA", "P"):
-                img = img.convert("RGB")
-                
-            # Resize to reasonable dimensions
-            max_size = (500, 500)
-            img.thumbnail(max_size)
-            
-            # Save as JPEG with 85% quality
-            img.save(buffered, format="JPEG", quality=85)
-            img_str = base64.b64encode(buffered.getvalue()).decode('utf-8')
+            # Decode once, cap at 500px and compress to a small JPEG
+            prepared = prepare_image(uploaded_file, max_edge=500, target_bytes=60 * 1024)
+            img_str = to_base64(prepared)
             
             # Update profile picture
-            response = call_api("update_profile_pic", "PUT", {
-                "user_id": user_id,
-                "profile_pic": img_str
-            })
+            response = call_api("update_profile_pic", "PUT", {"profile_pic": img_str})
             
             if response and response.get("success"):
                 st.session_state.user = response["user"]
@@ -566,7 +768,6 @@ def change_password_form():
                 st.error("Passwords don't match")
             else:
                 response = call_api("change_password", "POST", {
-                    "user_id": st.session_state.user['id'],
                     "current_password": current_pw,
                     "new_password": new_pw
                 })
@@ -575,7 +776,9 @@ def change_password_form():
                     del st.session_state.profile_action
                     st.rerun()
                 else:
-                    st.error(response.get("message", "Password change failed"))
+                    # A wrong current password is a 403, which call_api turns into None
+                    st.error(response.get("message", "Password change failed") if response
+                             else "Password change failed - check your current password")
 
 def delete_account_confirmation():
     st.warning("⚠️ This action cannot be undone!")
@@ -609,6 +812,7 @@ def login_page():
             
             if response and response.get("success"):
                 st.session_state.user = response["user"]
+                st.session_state.token = response["token"]
                 st.session_state.role = role
                 st.session_state.page = "dashboard"
                 st.rerun()
@@ -658,223 +862,259 @@ def register_page():
 # ----- Role-Specific Pages -----
 def farmer_dashboard():
     st.title(f"👨‍🌾 Farmer Dashboard - Welcome {st.session_state.user['name']}")
+    user_id = st.session_state.user['id']
+    prefetch_dashboard("farmer", {
+        "listings": [(f"listings/farmer/{user_id}", None)],
+        "requests": [(f"requests/farmer/{user_id}", None)],
+        "conversations": [(f"conversations/{user_id}", None)],
+    })
     
-    tabs = st.tabs(["Yield Prediction", "Post Listing", "My Listings", "Requests", "Messages", "Profile"])
+    tabs = st.tabs(["Yield Prediction", "Post Listing", "My Listings", "Requests", "Analytics", "Messages", "Profile"])
 
     with tabs[0]:  # Yield Prediction tab
         yield_prediction_tab()
     
     with tabs[1]:
-        with st.form("post_listing", clear_on_submit=True):
-            st.subheader("Post New Listing")
-            produce_type = st.text_input("Produce Type")
-            quantity = st.number_input("Quantity (kg)", min_value=1)
-            price = st.number_input("Price per kg (optional)", min_value=0)
-            description = st.text_area("Description")
-            harvest_date = st.date_input("Harvest Date")
-            best_before = st.date_input("Best Before Date")
-            organic = st.checkbox("Organic")
-            
-            # Image upload with validation
-            uploaded_files = st.file_uploader(
-                "Upload Images (JPEG/PNG only)", 
-                type=["jpg", "jpeg", "png"], 
-                accept_multiple_files=True,
-                key="image_uploader"
-            )
-            
-            if st.form_submit_button("Post Listing"):
-                image_data = []
-                for uploaded_file in uploaded_files:
-                    if uploaded_file is not None:
-                        try:
-                            # Open and verify the image
-                            image = Image.open(uploaded_file)
-                            image.verify()  # Verify it's a valid image
-                            
-                            # Convert to bytes
-                            image = Image.open(uploaded_file)  # Need to reopen after verify
-                            buffered = BytesIO()
-                            
-                            # Convert to RGB if needed (for PNG transparency)
-                            if image.mode in ("RGBA", "P"):
-                                image = image.convert("RGB")
-                                
-                            image.save(buffered, format="JPEG", quality=85)
-                            image_data.append(base64.b64encode(buffered.getvalue()).decode('utf-8'))
-                        except Exception as e:
-                            st.error(f"Invalid image: {uploaded_file.name}. Error: {str(e)}")
-                            continue
-                
-                response = call_api("listings", "POST", {
-                    "farmer_id": st.session_state.user["id"],
-                    "produce_type": produce_type,
-                    "quantity": quantity,
-                    "price": price,
-                    "description": description,
-                    "harvest_date": harvest_date.isoformat(),
-                    "best_before": best_before.isoformat(),
-                    "organic": organic,
-                    "images": image_data
-                })
-                
-                if response and response.get("success"):
-                    st.success("Listing posted successfully!")
-                else:
-                    st.error("Failed to post listing")
+        post_listing_panel()
 
     with tabs[2]:
-        st.subheader("My Active Listings")
-        listings = call_api(f"listings/farmer/{st.session_state.user['id']}")
-        
-        if listings:
-            for listing in listings:
-                with st.expander(f"{listing['produce_type']} - {listing['quantity']}kg"):
-                    col1, col2 = st.columns([1, 3])
-                    with col1:
-                        if listing.get('images') and len(listing['images']) > 0:
-                            try:
-                                # Handle both string and list formats
-                                img_data = listing['images']
-                                if isinstance(img_data, str):
-                                    img_data = json.loads(img_data)
-                                
-                                if img_data and len(img_data) > 0:
-                                    img_bytes = base64.b64decode(img_data[0].encode('utf-8'))
-                                    
-                                    # Create temporary file to ensure proper handling
-                                    with BytesIO(img_bytes) as img_buffer:
-                                        try:
-                                            img = Image.open(img_buffer)
-                                            st.image(img, width=150)
-                                        except:
-                                            st.warning("Couldn't display image (invalid format)")
-                            except Exception as e:
-                                st.warning(f"Image display error: {str(e)}")
-                    with col2:
-                        st.write(f"**Description:** {listing['description']}")
-                        st.write(f"**Harvest Date:** {listing['harvest_date']}")
-                        st.write(f"**Best Before:** {listing['best_before']}")
-                        st.write(f"**Organic:** {'Yes' if listing['organic'] else 'No'}")
-                        st.write(f"**Status:** {listing['status']}")
-                        
-                        if st.button(f"Delete {listing['produce_type']}", key=f"del_{listing['id']}"):
-                            if call_api(f"listings/{listing['id']}", "DELETE"):
-                                st.rerun()
-        else:
-            st.info("You have no active listings")
+        farmer_listings_panel()
 
     with tabs[3]:  # Requests tab
-        st.subheader("Requests for Your Produce")
-        response = call_api(f"requests/farmer/{st.session_state.user['id']}")
-        
-        # Handle API response
-        if response is None:
-            st.error("Failed to load requests. Please try again later.")
-            return
-            
-        requests = response if isinstance(response, list) else []
-        
-        if requests:
-            for req in requests:
-                # Ensure req has all required fields
-                if not all(k in req for k in ['id', 'produce_type', 'quantity', 'status']):
-                    continue
-                
-                status_color = {
-                    "pending": "blue",
-                    "approved": "green",
-                    "rejected": "red",
-                    "completed": "purple"
-                }.get(req['status'], "gray")
-                
-                with st.expander(f"{req['produce_type']} - {req['quantity']}kg (Status: :{status_color}[{req['status']}])"):
-                    st.write(f"**Requester:** {req.get('requester_name', 'Unknown')}")
-                    st.write(f"**Quantity Requested:** {req['quantity']}kg")
-                    st.write(f"**Date Requested:** {req.get('created_at', 'Unknown')}")
-
-                    # Add message button for each request
-                    requester_id = req.get('buyer_id') or req.get('foodbank_id')
-                    requester_name = req.get('requester_name', 'Unknown')
-                    
-                    if requester_id:  # Only show button if we have a valid ID
-                        if st.button(f"📩 Message {requester_name}", key=f"msg_req_{req['id']}"):
-                            st.session_state.current_chat = {
-                                'receiver_id': requester_id,
-                                'receiver_name': requester_name,
-                                'request_id': req['id']
-                            }
-                            st.session_state.active_tab = "Messages"
-                            st.rerun()
-                    else:
-                        st.warning("Could not identify requester")
+        farmer_requests_panel()
 
-                    
-                    if req['status'] == "pending":
-                        col1, col2 = st.columns(2)
-                        with col1:
-                            if st.button(f"Approve {req['produce_type']}", key=f"app_{req['id']}"):
-                                with st.spinner("Processing approval..."):
-                                    response = call_api(
-                                        f"requests/{req['id']}", 
-                                        "PUT", 
-                                        {
-                                            "status": "approved",
-                                            "quantity": req['quantity'],
-                                            "listing_id": req['listing_id'],
-                                            "farmer_id": st.session_state.user['id']  # Add this line
-                                        }
-                                    )
-
-                                    if response is None:
-                                        st.error("Failed to connect to server")
-                                    elif response.get("success"):
-                                        st.success("Request approved successfully!")
-                                        time.sleep(1)
-                                        st.rerun()
-                                    else:
-                                        error_msg = response.get("error", "Unknown error occurred")
-                                        st.error(f"Approval failed: {error_msg}")
-                        
-                        with col2:
-                            if st.button(f"Reject {req['produce_type']}", key=f"rej_{req['id']}"):
-                                with st.spinner("Processing rejection..."):
-                                    response = call_api(
-                                        f"requests/{req['id']}", 
-                                        "PUT", 
-                                        {
-                                            "status": "rejected",
-                                            "quantity": 0,
-                                            "listing_id": req['listing_id'],
-                                            "farmer_id": st.session_state.user['id']
-                                        }
-                                    )
-                                    if response is None:
-                                        st.error("Failed to connect to server")
-                                    elif response.get("success"):
-                                        st.success("Request rejected successfully!")
-                                        time.sleep(1)
-                                        st.rerun()
-                                    else:
-                                        error_msg = response.get("error", "Unknown error occurred")
-                                        st.error(f"Rejection failed: {error_msg}")
-                    else:
-                        st.write(f"**Resolution:** This request has been {req['status']}")
-        else:
-            st.info("You have no pending requests")
+    with tabs[4]:  # Analytics tab
+        farmer_analytics_panel()
 
-    with tabs[4]:  # Messages tab
+    with tabs[5]:  # Messages tab
         messages_tab()
 
-    with tabs[5]:  # Profile tab
+    with tabs[6]:  # Profile tab
         profile_tab()
 
     # Other tabs would be implemented similarly...
 
+@timed_fragment("Post listing")
+def post_listing_panel():
+    mode = st.radio("Post", ["Single listing", "CSV upload"], horizontal=True, key="post_listing_mode")
+    if mode == "CSV upload":
+        csv_upload_panel()
+        return
+
+    # Set just before the rerun that follows a successful post
+    note = st.session_state.pop("listing_images_note", None)
+    if note:
+        st.caption(note)
+
+    with st.form("post_listing", clear_on_submit=True):
+        st.subheader("Post New Listing")
+        produce_type = st.text_input("Produce Type")
+        quantity = st.number_input("Quantity (kg)", min_value=1)
+        price = st.number_input("Price per kg (optional)", min_value=0)
+        description = st.text_area("Description")
+        harvest_date = st.date_input("Harvest Date")
+        best_before = st.date_input("Best Before Date")
+        organic = st.checkbox("Organic")
+
+        # Image upload with validation
+        uploaded_files = st.file_uploader(
+            "Upload Images (JPEG/PNG only)", 
+            type=["jpg", "jpeg", "png"], 
+            accept_multiple_files=True,
+            key="image_uploader"
+        )
+
+        if st.form_submit_button("Post Listing"):
+            # Downscale and compress all photos in parallel before upload
+            prepared, errors, saved = prepare_uploads(uploaded_files or [])
+            for name, error in errors:
+                st.error(f"Invalid image: {name}. Error: {error}")
+            image_data = [to_base64(p) for p in prepared]
+
+            response = call_api("listings", "POST", {
+                "produce_type": produce_type,
+                "quantity": quantity,
+                "price": price,
+                "description": description,
+                "harvest_date": harvest_date.isoformat(),
+                "best_before": best_before.isoformat(),
+                "organic": organic,
+                "images": image_data
+            })
+
+            if response and response.get("success"):
+                # The new listing belongs to the "My Listings" panel, so rerun the page
+                invalidate_api("listings/")
+                st.toast("Listing posted successfully!")
+                if prepared:
+                    st.session_state.listing_images_note = (
+                        f"Compressed {len(prepared)} image(s), saved {format_bytes(saved)}")
+                st.rerun()
+            else:
+                st.error("Failed to post listing")
+
+def csv_upload_panel():
+    st.subheader("Upload Listings from CSV")
+    st.caption("Columns: produce_type, quantity, price, description, harvest_date, "
+               "best_before (YYYY-MM-DD), organic (yes/no)")
+    uploaded = st.file_uploader("CSV file", type=["csv"], key="listings_csv")
+    if uploaded is None:
+        return
+    try:
+        frame = pd.read_csv(uploaded, dtype=str, keep_default_na=False)
+    except Exception as e:
+        st.error(f"Couldn't read CSV: {str(e)}")
+        return
+    st.dataframe(frame, hide_index=True)
+    skip_invalid = st.checkbox("Skip invalid rows instead of rejecting the whole file")
+
+    if st.button(f"Post {len(frame)} listings"):
+        response = call_bulk_api("listings/bulk", "POST", {
+            "listings": frame.to_dict(orient="records")
+        }, partial=skip_invalid)
+        show_bulk_results(response, "listings")
+        if response and response.get("success"):
+            invalidate_api("listings/")
+
+@timed_fragment("My listings")
+def farmer_listings_panel():
+    st.subheader("My Active Listings")
+    listings = cached_api(f"listings/farmer/{st.session_state.user['id']}")
+
+    if listings:
+        for listing in listings:
+            with st.expander(f"{listing['produce_type']} - {listing['quantity']}kg"):
+                col1, col2 = st.columns([1, 3])
+                with col1:
+                    if listing.get('images') and len(listing['images']) > 0:
+                        try:
+                            # Handle both string and list formats
+                            img_data = listing['images']
+                            if isinstance(img_data, str):
+                                img_data = json.loads(img_data)
+
+                            if img_data and len(img_data) > 0:
+                                try:
+                                    st.image(cached_thumbnail(img_data[0]), width=150)
+                                except:
+                                    st.warning("Couldn't display image (invalid format)")
+                        except Exception as e:
+                            st.warning(f"Image display error: {str(e)}")
+                with col2:
+                    st.write(f"**Description:** {listing['description']}")
+                    st.write(f"**Harvest Date:** {listing['harvest_date']}")
+                    st.write(f"**Best Before:** {listing['best_before']}")
+                    st.write(f"**Organic:** {'Yes' if listing['organic'] else 'No'}")
+                    st.write(f"**Status:** {listing['status']}")
+
+                    if st.button(f"Delete {listing['produce_type']}", key=f"del_{listing['id']}"):
+                        if call_api(f"listings/{listing['id']}", "DELETE"):
+                            invalidate_api("listings/")
+                            rerun_panel("Listing deleted")
+    else:
+        st.info("You have no active listings")
+
+@timed_fragment("Farmer requests")
+def farmer_requests_panel():
+    st.subheader("Requests for Your Produce")
+    response = cached_api(f"requests/farmer/{st.session_state.user['id']}")
+
+    # Handle API response
+    if response is None:
+        st.error("Failed to load requests. Please try again later.")
+        return
+
+    requests = response if isinstance(response, list) else []
+
+    pending = [req for req in requests if req.get('status') == "pending"]
+    if len(pending) > 1 and st.button(f"Approve all {len(pending)} pending requests"):
+        with st.spinner("Processing approvals..."):
+            response = call_bulk_api("requests/bulk", "PUT", {
+                "updates": [{"request_id": req['id'], "status": "approved"} for req in pending]
+            })
+        show_bulk_results(response, "approvals")
+        if response and response.get("success"):
+            invalidate_api("requests/farmer/", "listings/")
+            rerun_panel("Requests approved successfully!")
+
+    if requests:
+        for req in requests:
+            # Ensure req has all required fields
+            if not all(k in req for k in ['id', 'produce_type', 'quantity', 'status']):
+                continue
+
+            status_color = {
+                "pending": "blue",
+                "approved": "green",
+                "rejected": "red",
+                "completed": "purple"
+            }.get(req['status'], "gray")
+
+            with st.expander(f"{req['produce_type']} - {req['quantity']}kg (Status: :{status_color}[{req['status']}])"):
+                st.write(f"**Requester:** {req.get('requester_name', 'Unknown')}")
+                st.write(f"**Quantity Requested:** {req['quantity']}kg")
+                st.write(f"**Date Requested:** {req.get('created_at', 'Unknown')}")
+
+                # Add message button for each request
+                requester_id = req.get('buyer_id') or req.get('foodbank_id')
+                requester_name = req.get('requester_name', 'Unknown')
+
+                if requester_id:  # Only show button if we have a valid ID
+                    if st.button(f"📩 Message {requester_name}", key=f"msg_req_{req['id']}"):
+                        st.session_state.current_chat = {
+                            'receiver_id': requester_id,
+                            'receiver_name': requester_name,
+                            'request_id': req['id']
+                        }
+                        st.session_state.active_tab = "Messages"
+                        st.rerun()
+                else:
+                    st.warning("Could not identify requester")
+
+
+                if req['status'] == "pending":
+                    col1, col2 = st.columns(2)
+                    with col1:
+                        if st.button(f"Approve {req['produce_type']}", key=f"app_{req['id']}"):
+                            with st.spinner("Processing approval..."):
+                                response = call_api(f"requests/{req['id']}", "PUT", {"status": "approved"})
+
+                                if response is None:
+                                    st.error("Failed to connect to server")
+                                elif response.get("success"):
+                                    invalidate_api("requests/farmer/", "listings/")
+                                    rerun_panel("Request approved successfully!")
+                                else:
+                                    error_msg = response.get("error", "Unknown error occurred")
+                                    st.error(f"Approval failed: {error_msg}")
+
+                    with col2:
+                        if st.button(f"Reject {req['produce_type']}", key=f"rej_{req['id']}"):
+                            with st.spinner("Processing rejection..."):
+                                response = call_api(f"requests/{req['id']}", "PUT", {"status": "rejected"})
+                                if response is None:
+                                    st.error("Failed to connect to server")
+                                elif response.get("success"):
+                                    invalidate_api("requests/farmer/")
+                                    rerun_panel("Request rejected successfully!")
+                                else:
+                                    error_msg = response.get("error", "Unknown error occurred")
+                                    st.error(f"Rejection failed: {error_msg}")
+                else:
+                    st.write(f"**Resolution:** This request has been {req['status']}")
+    else:
+        st.info("You have no pending requests")
+
 def buyer_dashboard():
     st.title(f"🛒 Buyer Dashboard - Welcome {st.session_state.user['name']}")
+    user_id = st.session_state.user['id']
+    prefetch_dashboard("buyer", {
+        "listings": [("listings/active", None)],
+        "requests": [(f"requests/buyer/{user_id}", None)],
+        "conversations": [(f"conversations/{user_id}", None)],
+    })
     
-    tabs = st.tabs(["Browse Listings", "My Requests", "Messages", "Profile"])
+    tabs = st.tabs(["Browse Listings", "My Requests", "Supply Outlook", "Messages", "Profile"])
 
     # # Initialize active tab if not set
     # if 'active_tab' not in st.session_state:
@@ -894,329 +1134,487 @@ def buyer_dashboard():
     # st.session_state.active_tab = selected_tab
     
     with tabs[0]:
-        st.subheader("Available Produce")
-        
-        # Filters
-        col1, col2, col3 = st.columns(3)
-        with col1:
-            produce_filter = st.text_input("Filter by produce type")
-        with col2:
-            organic_filter = st.selectbox("Organic", ["All", "Yes", "No"])
-        with col3:
-            distance_filter = st.slider("Max distance (km)", 0, 100, 50)
-        
-        listings = call_api("listings/active")
-        
-        if listings:
-            for listing in listings:
-                if produce_filter and produce_filter.lower() not in listing['produce_type'].lower():
-                    continue
-                if organic_filter == "Yes" and not listing['organic']:
-                    continue
-                if organic_filter == "No" and listing['organic']:
-                    continue
-                
-                with st.expander(f"{listing['produce_type']} - {float(listing['quantity'])}kg"):
-                    col1, col2 = st.columns([1, 3])
-                    with col1:
-                        if listing.get('images') and listing['images']:
-                            try:
-                                img_data = listing['images']
-                                if isinstance(img_data, str):
-                                    img_data = json.loads(img_data)
-                                
-                                if img_data and len(img_data) > 0:
-                                    img_bytes = base64.b64decode(img_data[0])
-                                    img = Image.open(BytesIO(img_bytes))
-                                    st.image(img, width=150)
-                            except Exception as e:
-                                st.warning(f"Couldn't load image: {str(e)}")
-                    
-                    with col2:
-                        st.write(f"**Farmer:** {listing['farmer_name']}")
-                        st.write(f"**Location:** {listing['location']}")
-                        price = float(listing['price'])
-                        st.write(f"**Price:** {'Free' if price == 0 else f'Ksh. {price:.2f}/kg'}")
-                        st.write(f"**Organic:** {'Yes' if listing['organic'] else 'No'}")
-
-                        if float(listing['quantity']) > 0:
-                            max_qty = float(listing['quantity'])
-                            if max_qty > 0:
-                                quantity = st.number_input(
-                                    "Quantity (kg)",
-                                    min_value=0.1,
-                                    max_value=max_qty,
-                                    value=min(1.0, max_qty),  # Now safe because max_qty > 0
-                                    step=0.1,
-                                    key=f"qty_{listing['id']}"
-                                )
-                            
-                            # # Ensure quantity is float type
-                            # max_qty = float(listing['quantity'])
-                            # quantity = st.number_input(
-                            #     "Quantity (kg)",
-                            #     min_value=1.0,  # Changed to float
-                            #     max_value=max_qty,
-                            #     value=min(1.0, max_qty),  # Default value
-                            #     step=0.1,
-                            #     key=f"qty_{listing['id']}"
-                            # )
-                            
-                            if st.button("Request", key=f"req_{listing['id']}"):
-                                response = call_api("requests", "POST", {
-                                    "listing_id": listing['id'],
-                                    "buyer_id": st.session_state.user['id'],
-                                    "quantity": float(quantity),  # Ensure float
-                                    "status": "pending"
-                                })
-                                if response and response.get("success"):
-                                    st.success("Request sent successfully!")
-                                    st.rerun()
-                                else:
-                                    st.error("Failed to send request")
-
-                            # Add message button next to request button
-                            if st.button(f"📩 Message Farmer", key=f"msg_{listing['id']}"):
-                                st.session_state.current_chat = {
-                                    'receiver_id': listing['farmer_id'],
-                                    'receiver_name': listing['farmer_name'],
-                                    'listing_id': listing['id']
-                                }
-                                st.session_state.page = "messages"
-                                st.rerun()
-                        else:
-                            # Show out of stock message and disabled button
-                            st.error("❌ Out of Stock")
-                            st.button("Request", disabled=True, help="This item is no longer available")
-                            
-                            # Optional: Update listing status to inactive in backend
-                            if listing['status'] != 'inactive':
-                                call_api(f"listings/{listing['id']}/status", "PUT", {"status": "inactive"})
-
-        else:
-            st.info("No listings available")
+        buyer_browse_panel()
 
     with tabs[1]:  # My Requests tab
-        st.subheader("My Requests")
-        requests = call_api(f"requests/buyer/{st.session_state.user['id']}")
-        
-        if requests:
-            for req in requests:
-                status_color = {
-                    "pending": "blue",
-                    "approved": "green",
-                    "rejected": "red",
-                    "completed": "purple"
-                }.get(req['status'], "gray")
-                
-                with st.expander(f"{req['produce_type']} - {req['quantity']}kg (Status: :{status_color}[{req['status']}])"):
-                    st.write(f"**Farmer:** {req['farmer_name']}")
-                    st.write(f"**Quantity:** {req['quantity']}kg")
-                    st.write(f"**Date Requested:** {req['created_at']}")
-                    st.write(f"**Status:** :{status_color}[{req['status'].title()}]")
-                    
-                    if req['status'] == "approved":
-                        if st.button("Mark as Completed", key=f"comp_{req['id']}"):
-                            if call_api(f"requests/{req['id']}", "PUT", {"status": "completed"}):
-                                st.rerun()
-
-                    # Add message button for each request
-                    if st.button(f"📩 Message Farmer", key=f"msg_req_{req['id']}"):
-                        if req.get('farmer_id'):  # Check if farmer_id exists
-                            st.session_state.current_chat = {
-                                'receiver_id': req['farmer_id'],  # Use farmer_id from request
-                                'receiver_name': req['farmer_name']
-                            }
-                            st.session_state.active_tab = "Messages"
-                            st.rerun()
-                        else:
-                            st.error("Could not identify farmer for this request")
+        buyer_requests_panel()
 
-        else:
-            st.info("You haven't made any requests yet")
+    with tabs[2]:  # Supply Outlook tab
+        supply_outlook_panel()
 
-    with tabs[2]:  # Messages tab
+    with tabs[3]:  # Messages tab
         messages_tab()
 
-    with tabs[3]:  # Profile tab
+    with tabs[4]:  # Profile tab
         profile_tab()
 
     # Other tabs would be implemented similarly...
 
-def foodbank_dashboard():
-    st.title(f"🏥 Food Bank Dashboard - Welcome {st.session_state.user['name']}")
-    
-    tabs = st.tabs(["Browse Listings", "My Requests", "Distribution Log", "Messages", "Profile"])
-    
-    with tabs[0]:
-        st.subheader("Available Donations")
-        
-        listings = call_api("listings/donations")
-        
-        if listings:
-            for listing in listings:
-                with st.expander(f"{listing['produce_type']} - {listing['quantity']}kg"):
-                    col1, col2 = st.columns([1, 3])
-                    with col1:
-                        if listing.get('images'):
-                            try:
-                                # Handle both string and list formats
-                                img_data = listing['images']
-                                if isinstance(img_data, str):
-                                    img_data = json.loads(img_data)  # If stored as JSON string
-                                
-                                if img_data and len(img_data) > 0:
-                                    img_bytes = base64.b64decode(img_data[0].encode('utf-8'))
-                                    img = Image.open(BytesIO(img_bytes))
-                                    st.image(img, width=150)
-                            except Exception as e:
-                                st.warning(f"Couldn't display image: {str(e)}")
-                        else:
-                            st.image("placeholder.jpg", width=150)
+@timed_fragment("Browse listings")
+def buyer_browse_panel():
+    st.subheader("Available Produce")
 
-                    with col2:
-                        st.write(f"**Farmer:** {listing['farmer_name']}")
-                        st.write(f"**Location:** {listing['location']}")
-                        st.write(f"**Available Quantity:** {listing['quantity']}kg")
-                        st.write(f"**Harvest Date:** {listing['harvest_date']}")
-                        st.write(f"**Best Before:** {listing['best_before']}")
-                        
+    # Filters
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        produce_filter = st.text_input("Filter by produce type")
+    with col2:
+        organic_filter = st.selectbox("Organic", ["All", "Yes", "No"])
+    with col3:
+        distance_filter = st.slider("Max distance (km)", 0, 100, 50)
+
+    listings = cached_api("listings/active")
+
+    if listings:
+        for listing in listings:
+            if produce_filter and produce_filter.lower() not in listing['produce_type'].lower():
+                continue
+            if organic_filter == "Yes" and not listing['organic']:
+                continue
+            if organic_filter == "No" and listing['organic']:
+                continue
+
+            with st.expander(f"{listing['produce_type']} - {float(listing['quantity'])}kg"):
+                col1, col2 = st.columns([1, 3])
+                with col1:
+                    if listing.get('images') and listing['images']:
                         try:
-                            max_qty = float(listing['quantity'])
-                        except:
-                            max_qty = 0.0
-
-                        quantity = st.number_input(
-                            "Quantity (kg)", 
-                            min_value=0.1,  # float instead of int
-                            max_value=max_qty,  # Explicit conversion
-                            value=min(1.0, max_qty),  # Default value as float
-                            step=0.1,  # Allows decimal inputs
-                            key=f"qty_{listing['id']}"
-                        )
+                            img_data = listing['images']
+                            if isinstance(img_data, str):
+                                img_data = json.loads(img_data)
 
-                        if f"confirm_{listing['id']}" not in st.session_state:
-                            st.session_state[f"confirm_{listing['id']}"] = False
+                            if img_data and len(img_data) > 0:
+                                st.image(cached_thumbnail(img_data[0]), width=150)
+                        except Exception as e:
+                            st.warning(f"Couldn't load image: {str(e)}")
 
-                        # First button (Request Donation)
-                        if st.button("Request Donation", key=f"req_{listing['id']}"):
-                            st.session_state[f"confirm_{listing['id']}"] = True
+                with col2:
+                    st.write(f"**Farmer:** {listing['farmer_name']}")
+                    st.write(f"**Location:** {listing['location']}")
+                    price = float(listing['price'])
+                    st.write(f"**Price:** {'Free' if price == 0 else f'Ksh. {price:.2f}/kg'}")
+                    st.write(f"**Organic:** {'Yes' if listing['organic'] else 'No'}")
 
-                        # Second step (only shows after first button click)
-                        if st.session_state[f"confirm_{listing['id']}"]:
-                            purpose = st.text_area("Purpose of donation", key=f"purp_{listing['id']}")
-                            
-                            if st.button("Confirm Request", key=f"conf_{listing['id']}"):
-                                response = call_api("requests", "POST", {
-                                    "listing_id": listing['id'],
-                                    "foodbank_id": st.session_state.user['id'],
-                                    "quantity": quantity,
-                                    "purpose": purpose,
-                                    "status": "pending"
-                                })
-                                
-                                if response and response.get("success"):
-                                    st.success("Donation request sent successfully!")
-                                    st.session_state[f"confirm_{listing['id']}"] = False  # Reset
-                                    st.rerun()
-                                else:
-                                    st.error("Failed to send request")
+                    if float(listing['quantity']) > 0:
+                        max_qty = float(listing['quantity'])
+                        if max_qty > 0:
+                            quantity = st.number_input(
+                                "Quantity (kg)",
+                                min_value=0.1,
+                                max_value=max_qty,
+                                value=min(1.0, max_qty),  # Now safe because max_qty > 0
+                                step=0.1,
+                                key=f"qty_{listing['id']}"
+                            )
 
+                        # # Ensure quantity is float type
+                        # max_qty = float(listing['quantity'])
                         # quantity = st.number_input(
-                        #     "Quantity (kg)", 
-                        #     min_value=0.1,  # float instead of int
-                        #     max_value=max_qty,  # Explicit conversion
-                        #     value=min(1.0, max_qty),  # Default value as float
-                        #     step=0.1,  # Allows decimal inputs
+                        #     "Quantity (kg)",
+                        #     min_value=1.0,  # Changed to float
+                        #     max_value=max_qty,
+                        #     value=min(1.0, max_qty),  # Default value
+                        #     step=0.1,
                         #     key=f"qty_{listing['id']}"
                         # )
-        
-                        # if st.button("Request Donation", key=f"req_{listing['id']}"):
-                        #     if quantity > max_qty:
-                        #         st.error("Requested quantity exceeds available stock")
-                        #     else:
-                        #         purpose = st.text_area("Purpose of donation", key=f"purp_{listing['id']}")
-                        #         if st.button("Confirm Request", key=f"conf_{listing['id']}"):
-                        #             response = call_api("requests", "POST", {
-                        #                 "listing_id": listing['id'],
-                        #                 "foodbank_id": st.session_state.user['id'],
-                        #                 "quantity": quantity,
-                        #                 "purpose": purpose,
-                        #                 "status": "pending"
-                        #             })
-                        #             if response and response.get("success"):
-                        #                 st.success("Donation request sent successfully!")
-                        #             else:
-                        #                 st.error("Failed to send request")
-        else:
-            st.info("No donation listings available")
+
+                        if st.button("Request", key=f"req_{listing['id']}"):
+                            response = call_api("requests", "POST", {
+                                "listing_id": listing['id'],
+                                "quantity": float(quantity)  # Ensure float
+                            })
+                            if response and response.get("success"):
+                                invalidate_api("requests/buyer/")
+                                rerun_panel("Request sent successfully!")
+                            else:
+                                st.error("Failed to send request")
+
+                        # Add message button next to request button
+                        if st.button(f"📩 Message Farmer", key=f"msg_{listing['id']}"):
+                            st.session_state.current_chat = {
+                                'receiver_id': listing['farmer_id'],
+                                'receiver_name': listing['farmer_name'],
+                                'listing_id': listing['id']
+                            }
+                            st.session_state.page = "messages"
+                            st.rerun()
+                    else:
+                        # Show out of stock message and disabled button
+                        st.error("❌ Out of Stock")
+                        st.button("Request", disabled=True, help="This item is no longer available")
+
+    else:
+        st.info("No listings available")
+
+@timed_fragment("Buyer requests")
+def buyer_requests_panel():
+    st.subheader("My Requests")
+    requests = cached_api(f"requests/buyer/{st.session_state.user['id']}")
+
+    if requests:
+        for req in requests:
+            status_color = {
+                "pending": "blue",
+                "approved": "green",
+                "rejected": "red",
+                "completed": "purple"
+            }.get(req['status'], "gray")
+
+            with st.expander(f"{req['produce_type']} - {req['quantity']}kg (Status: :{status_color}[{req['status']}])"):
+                st.write(f"**Farmer:** {req['farmer_name']}")
+                st.write(f"**Quantity:** {req['quantity']}kg")
+                st.write(f"**Date Requested:** {req['created_at']}")
+                st.write(f"**Status:** :{status_color}[{req['status'].title()}]")
+
+                if req['status'] == "approved":
+                    if st.button("Mark as Completed", key=f"comp_{req['id']}"):
+                        if call_api(f"requests/{req['id']}", "PUT", {"status": "completed"}):
+                            invalidate_api("requests/")
+                            rerun_panel()
+
+                # Add message button for each request
+                if st.button(f"📩 Message Farmer", key=f"msg_req_{req['id']}"):
+                    if req.get('farmer_id'):  # Check if farmer_id exists
+                        st.session_state.current_chat = {
+                            'receiver_id': req['farmer_id'],  # Use farmer_id from request
+                            'receiver_name': req['farmer_name']
+                        }
+                        st.session_state.active_tab = "Messages"
+                        st.rerun()
+                    else:
+                        st.error("Could not identify farmer for this request")
+
+    else:
+        st.info("You haven't made any requests yet")
+
+def foodbank_dashboard():
+    st.title(f"🏥 Food Bank Dashboard - Welcome {st.session_state.user['name']}")
+    user_id = st.session_state.user['id']
+    prefetch_dashboard("foodbank", {
+        "listings": [("listings/donations", None)],
+        "requests": [
+            (f"requests/foodbank/{user_id}", None),
+            (f"requests/foodbank/{user_id}?status=completed", lambda req: req['status'] == "completed"),
+        ],
+        "conversations": [(f"conversations/{user_id}", None)],
+    })
+    
+    tabs = st.tabs(["Browse Listings", "My Requests", "Distribution Log", "Analytics", "Messages", "Profile"])
+    
+    with tabs[0]:
+        demand_panel()
+        donations_panel()
 
     with tabs[1]:  # My Requests tab
-        st.subheader("My Donation Requests")
-        requests = call_api(f"requests/foodbank/{st.session_state.user['id']}")
-        
-        if requests:
-            for req in requests:
-                status_color = {
-                    "pending": "blue",
-                    "approved": "green",
-                    "rejected": "red",
-                    "completed": "purple"
-                }.get(req['status'], "gray")
-                
-                with st.expander(f"{req['produce_type']} - {req['quantity']}kg (Status: :{status_color}[{req['status']}])"):
-                    st.write(f"**Farmer:** {req['farmer_name']}")
-                    st.write(f"**Quantity:** {req['quantity']}kg")
-                    if req.get('purpose'):
-                        st.write(f"**Purpose:** {req['purpose']}")
-                    st.write(f"**Date Requested:** {req['created_at']}")
-                    st.write(f"**Status:** :{status_color}[{req['status'].title()}]")
-                    
-                    if req['status'] == "approved":
-                        if st.button("Mark as Received", key=f"recv_{req['id']}"):
-                            if call_api(f"requests/{req['id']}", "PUT", {"status": "completed"}):
-                                st.rerun()
-        else:
-            st.info("You haven't made any donation requests yet")
+        foodbank_requests_panel()
+        pickup_route_panel()
     
     with tabs[2]:  # Distribution Log tab
-        st.subheader("Distribution Log")
-        completed_requests = call_api(f"requests/foodbank/{st.session_state.user['id']}?status=completed")
-        
-        if completed_requests:
-            distribution_data = []
-            for req in completed_requests:
-                distribution_data.append({
-                    "Date": req['created_at'].split('T')[0],
-                    "Produce": req['produce_type'],
-                    "Quantity (kg)": req['quantity'],
-                    "From": req['farmer_name'],
-                    "Purpose": req.get('purpose', '')
-                })
-            
-            df = pd.DataFrame(distribution_data)
-            st.dataframe(df)
-            
-            # Export button
-            csv = df.to_csv(index=False).encode('utf-8')
-            st.download_button(
-                "Export as CSV",
-                csv,
-                "food_distribution_log.csv",
-                "text/csv",
-                key='download-csv'
-            )
-        else:
-            st.info("No distribution records yet")
+        distribution_log_panel()
 
-    with tabs[3]:  # Messages tab
+    with tabs[3]:  # Analytics tab
+        foodbank_analytics_panel()
+        supply_outlook_panel()
+
+    with tabs[4]:  # Messages tab
         messages_tab()
 
-    with tabs[4]:  # Profile tab
+    with tabs[5]:  # Profile tab
         profile_tab()
 
     # Other tabs would be implemented similarly...
 
+@timed_fragment("Demand and matching")
+def demand_panel():
+    user_id = st.session_state.user['id']
+    with st.expander("📋 What do you need? (automatic donation matching)"):
+        st.caption("Declare how many kg of each produce you can take. Use * for any produce. "
+                   "Matching requests the free listings nearest to you that you can collect before they expire.")
+        response = cached_api(f"foodbank/{user_id}/demand")
+        demand = pd.DataFrame((response or {}).get("demand") or [],
+                              columns=["produce_type", "demand_kg"])
+        edited = st.data_editor(demand[["produce_type", "demand_kg"]], num_rows="dynamic",
+                                hide_index=True, key="demand_editor")
+
+        col1, col2 = st.columns(2)
+        with col1:
+            if st.button("Save needs"):
+                rows = edited.dropna(subset=["demand_kg"]).to_dict(orient="records")
+                if call_api(f"foodbank/{user_id}/demand", "PUT", {"demand": rows}):
+                    invalidate_api(f"foodbank/{user_id}/demand")
+                    rerun_panel("Needs saved")
+        with col2:
+            if st.button("Match me with donations"):
+                result = call_api("matching/run", "POST", {})
+                if result and result.get("success"):
+                    invalidate_api("requests/", "listings/")
+                    st.success(f"Requested {result['matched_kg']}kg across "
+                               f"{len(result['allocations'])} listings")
+                    if result.get("allocations"):
+                        st.dataframe(pd.DataFrame(result["allocations"]), hide_index=True)
+
+@timed_fragment("Available donations")
+def donations_panel():
+    st.subheader("Available Donations")
+
+    listings = cached_api("listings/donations")
+
+    if listings:
+        for listing in listings:
+            with st.expander(f"{listing['produce_type']} - {listing['quantity']}kg"):
+                col1, col2 = st.columns([1, 3])
+                with col1:
+                    if listing.get('images'):
+                        try:
+                            # Handle both string and list formats
+                            img_data = listing['images']
+                            if isinstance(img_data, str):
+                                img_data = json.loads(img_data)  # If stored as JSON string
+
+                            if img_data and len(img_data) > 0:
+                                st.image(cached_thumbnail(img_data[0]), width=150)
+                        except Exception as e:
+                            st.warning(f"Couldn't display image: {str(e)}")
+                    else:
+                        st.image("placeholder.jpg", width=150)
+
+                with col2:
+                    st.write(f"**Farmer:** {listing['farmer_name']}")
+                    st.write(f"**Location:** {listing['location']}")
+                    st.write(f"**Available Quantity:** {listing['quantity']}kg")
+                    st.write(f"**Harvest Date:** {listing['harvest_date']}")
+                    st.write(f"**Best Before:** {listing['best_before']}")
+
+                    try:
+                        max_qty = float(listing['quantity'])
+                    except:
+                        max_qty = 0.0
+
+                    quantity = st.number_input(
+                        "Quantity (kg)", 
+                        min_value=0.1,  # float instead of int
+                        max_value=max_qty,  # Explicit conversion
+                        value=min(1.0, max_qty),  # Default value as float
+                        step=0.1,  # Allows decimal inputs
+                        key=f"qty_{listing['id']}"
+                    )
+
+                    if f"confirm_{listing['id']}" not in st.session_state:
+                        st.session_state[f"confirm_{listing['id']}"] = False
+
+                    # First button (Request Donation)
+                    if st.button("Request Donation", key=f"req_{listing['id']}"):
+                        st.session_state[f"confirm_{listing['id']}"] = True
+
+                    # Second step (only shows after first button click)
+                    if st.session_state[f"confirm_{listing['id']}"]:
+                        purpose = st.text_area("Purpose of donation", key=f"purp_{listing['id']}")
+
+                        if st.button("Confirm Request", key=f"conf_{listing['id']}"):
+                            response = call_api("requests", "POST", {
+                                "listing_id": listing['id'],
+                                "quantity": quantity,
+                                "purpose": purpose
+                            })
+
+                            if response and response.get("success"):
+                                st.session_state[f"confirm_{listing['id']}"] = False  # Reset
+                                invalidate_api("requests/foodbank/")
+                                rerun_panel("Donation request sent successfully!")
+                            else:
+                                st.error("Failed to send request")
+
+                    # quantity = st.number_input(
+                    #     "Quantity (kg)", 
+                    #     min_value=0.1,  # float instead of int
+                    #     max_value=max_qty,  # Explicit conversion
+                    #     value=min(1.0, max_qty),  # Default value as float
+                    #     step=0.1,  # Allows decimal inputs
+                    #     key=f"qty_{listing['id']}"
+                    # )
+
+                    # if st.button("Request Donation", key=f"req_{listing['id']}"):
+                    #     if quantity > max_qty:
+                    #         st.error("Requested quantity exceeds available stock")
+                    #     else:
+                    #         purpose = st.text_area("Purpose of donation", key=f"purp_{listing['id']}")
+                    #         if st.button("Confirm Request", key=f"conf_{listing['id']}"):
+                    #             response = call_api("requests", "POST", {
+                    #                 "listing_id": listing['id'],
+                    #                 "foodbank_id": st.session_state.user['id'],
+                    #                 "quantity": quantity,
+                    #                 "purpose": purpose,
+                    #                 "status": "pending"
+                    #             })
+                    #             if response and response.get("success"):
+                    #                 st.success("Donation request sent successfully!")
+                    #             else:
+                    #                 st.error("Failed to send request")
+    else:
+        st.info("No donation listings available")
+
+@timed_fragment("Food bank requests")
+def foodbank_requests_panel():
+    st.subheader("My Donation Requests")
+    requests = cached_api(f"requests/foodbank/{st.session_state.user['id']}")
+
+    if requests:
+        for req in requests:
+            status_color = {
+                "pending": "blue",
+                "approved": "green",
+                "rejected": "red",
+                "completed": "purple"
+            }.get(req['status'], "gray")
+
+            with st.expander(f"{req['produce_type']} - {req['quantity']}kg (Status: :{status_color}[{req['status']}])"):
+                st.write(f"**Farmer:** {req['farmer_name']}")
+                st.write(f"**Quantity:** {req['quantity']}kg")
+                if req.get('purpose'):
+                    st.write(f"**Purpose:** {req['purpose']}")
+                st.write(f"**Date Requested:** {req['created_at']}")
+                st.write(f"**Status:** :{status_color}[{req['status'].title()}]")
+
+                if req['status'] == "approved":
+                    if st.button("Mark as Received", key=f"recv_{req['id']}"):
+                        if call_api(f"requests/{req['id']}", "PUT", {"status": "completed"}):
+                            invalidate_api("requests/")
+                            rerun_panel()
+    else:
+        st.info("You haven't made any donation requests yet")
+
+@timed_fragment("Pickup route")
+def pickup_route_panel():
+    st.subheader("🚚 Pickup Route")
+    capacity = st.number_input("Vehicle capacity (kg)", min_value=50, value=1000, step=50,
+                               key="route_capacity")
+    route = cached_api(f"foodbank/{st.session_state.user['id']}/route?capacity_kg={capacity}")
+    if not route or not route.get("success"):
+        st.info("Couldn't plan a route. Make sure your county is set in your profile.")
+        return
+    if not route["trips"]:
+        st.info("No approved requests to collect")
+    else:
+        st.write(f"**{len(route['trips'])} trip(s), about {route['total_km']}km in total**")
+        points = [{"lat": route["depot"]["lat"], "lon": route["depot"]["lon"]}]
+        for number, trip in enumerate(route["trips"], 1):
+            title = f"Trip {number}: {trip['load_kg']}kg, ~{trip['distance_km']}km"
+            with st.expander(title + (" ⚠️ over capacity" if trip["over_capacity"] else "")):
+                for order, stop in enumerate(trip["stops"], 1):
+                    st.write(f"{order}. **{stop['farmer_name']}** ({stop['location']}) - "
+                             f"{', '.join(stop['produce'])}" + (f" - 📞 {stop['phone']}" if stop.get('phone') else ""))
+            points.extend({"lat": stop["lat"], "lon": stop["lon"]} for stop in trip["stops"])
+        st.map(pd.DataFrame(points))
+    for stop in route.get("unlocated", []):
+        st.warning(f"Couldn't place {stop['farmer_name']} ({stop['location'] or 'no location'}); "
+                   f"arrange request {stop['request_id']} directly")
+
+@timed_fragment("Distribution log")
+def distribution_log_panel():
+    st.subheader("Distribution Log")
+    completed_requests = cached_api(f"requests/foodbank/{st.session_state.user['id']}?status=completed")
+
+    if completed_requests:
+        distribution_data = []
+        for req in completed_requests:
+            distribution_data.append({
+                "Date": req['created_at'].split('T')[0],
+                "Produce": req['produce_type'],
+                "Quantity (kg)": req['quantity'],
+                "From": req['farmer_name'],
+                "Purpose": req.get('purpose', '')
+            })
+
+        df = pd.DataFrame(distribution_data)
+        st.dataframe(df)
+
+        # Export button
+        csv = df.to_csv(index=False).encode('utf-8')
+        st.download_button(
+            "Export as CSV",
+            csv,
+            "food_distribution_log.csv",
+            "text/csv",
+            key='download-csv'
+        )
+    else:
+        st.info("No distribution records yet")
+
+# ----- Analytics -----
+# Charts read only the precomputed daily rollups served by /analytics
+KG_COLUMNS = {"requested_kg": "Requested", "approved_kg": "Approved", "completed_kg": "Completed"}
+
+def kg_by_day_chart(df, title):
+    import plotly.express as px
+    daily = df.groupby("day", as_index=False)[list(KG_COLUMNS)].sum().rename(columns=KG_COLUMNS)
+    fig = px.bar(daily.melt(id_vars="day", var_name="Stage", value_name="kg"),
+                 x="day", y="kg", color="Stage", barmode="group", title=title)
+    st.plotly_chart(fig, use_container_width=True)
+
+@timed_fragment("Farmer analytics")
+def farmer_analytics_panel():
+    import plotly.express as px
+    st.subheader("Marketplace Analytics")
+    rows = cached_api(f"analytics/farmer/{st.session_state.user['id']}", ttl=300)
+    if not rows:
+        st.info("No requests for your produce yet")
+        return
+    
+    df = pd.DataFrame(rows)
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Requested", f"{df['requested_kg'].sum():.0f} kg")
+    col2.metric("Approved", f"{df['approved_kg'].sum():.0f} kg")
+    col3.metric("Completed", f"{df['completed_kg'].sum():.0f} kg")
+    
+    kg_by_day_chart(df, "Requests per day")
+    by_produce = df.groupby(["produce_type", "channel"], as_index=False)["approved_kg"].sum()
+    st.plotly_chart(px.bar(by_produce, x="produce_type", y="approved_kg", color="channel",
+                           title="Approved kg by produce type"), use_container_width=True)
+
+@timed_fragment("Food bank analytics")
+def foodbank_analytics_panel():
+    import plotly.express as px
+    st.subheader("Donation Analytics")
+    rows = cached_api(f"analytics/foodbank/{st.session_state.user['id']}", ttl=300)
+    if rows:
+        df = pd.DataFrame(rows)
+        col1, col2 = st.columns(2)
+        col1.metric("Approved", f"{df['approved_kg'].sum():.0f} kg")
+        col2.metric("Received", f"{df['completed_kg'].sum():.0f} kg")
+        kg_by_day_chart(df, "My donation requests per day")
+    else:
+        st.info("You haven't made any donation requests yet")
+    
+    counties = cached_api("analytics/counties", ttl=300)
+    if counties:
+        st.plotly_chart(px.bar(pd.DataFrame(counties), x="county", y=["approved_kg", "completed_kg"],
+                               barmode="group", title="Donation volume by county"),
+                        use_container_width=True)
+
+@timed_fragment("Supply outlook")
+def supply_outlook_panel():
+    import plotly.express as px
+    st.subheader("🌽 Projected Corn Supply")
+    rows = cached_api("projections/supply", ttl=600)
+    if not rows:
+        st.info("No supply projections yet")
+        return
+    
+    df = pd.DataFrame(rows)
+    source = st.radio("Based on", ["farmers", "dataset"], horizontal=True,
+                      format_func={"farmers": "Registered farmers", "dataset": "Survey data"}.get,
+                      key=f"outlook_source_{st.session_state.role}")
+    df = df[df["source"] == source]
+    if df.empty:
+        st.info("No projections from this source yet")
+        return
+    st.caption(f"Model {df['model_version'].iloc[0]}, computed {df['computed_at'].max()}")
+    st.plotly_chart(px.bar(df, x="harvest_window", y="expected_kg", color="county",
+                           title="Expected harvest (kg) by county and month"),
+                    use_container_width=True)
+    st.dataframe(df[["county", "harvest_window", "farms", "expected_kg", "mean_kg"]],
+                 hide_index=True)
+
 # ----- Main App Flow -----
 def main():
     st.sidebar.title("Food Donation Network")
@@ -1226,17 +1624,20 @@ def main():
         st.sidebar.write(f"Role: {st.session_state.role}")
         
         if st.sidebar.button("Logout"):
-            st.session_state.user = None
-            st.session_state.role = None
-            st.session_state.page = "login"
+            end_session()
             st.rerun()
         
+        start = time.perf_counter()
         if st.session_state.role == "Farmer":
             farmer_dashboard()
         elif st.session_state.role == "Buyer":
             buyer_dashboard()
         elif st.session_state.role == "Food Bank":
             foodbank_dashboard()
+        record_timing("Full page", time.perf_counter() - start)
+        
+        with st.sidebar:
+            rerun_timing_panel()
     else:
         if st.session_state.page == "login":
             login_page()
@@ -0,0 +1,92 @@
+import base64
+import binascii
+import json
+import logging
+from io import BytesIO
+
+from core.db import get_db
+from events import catch_up, record
+from jobs import enqueue, job
+from messaging import archive_old_messages
+
+logger = logging.getLogger(__name__)
+
+# Side effects the API defers to the job queue. Each handler is idempotent:
+# a job can run twice if its worker stalls past the visibility timeout.
+
+# Higher runs first
+PRIORITY_READ_RECEIPTS = 10  # the sender is waiting to see them
+PRIORITY_IMAGES = 0
+PRIORITY_MAINTENANCE = -10
+MAINTENANCE_INTERVAL = 24 * 60 * 60  # seconds between storage maintenance runs
+
+def _is_image(data):
+    from PIL import Image
+    try:
+        img = Image.open(BytesIO(base64.b64decode(data, validate=True)))
+        img.verify()
+        return True
+    except (binascii.Error, OSError, SyntaxError, ValueError):
+        return False
+
+@job('validate_listing_images')
+def validate_listing_images(payload):
+    # Drop anything in listings.images that isn't a decodable image
+    conn = get_db()
+    try:
+        row = conn.execute('SELECT images FROM listings WHERE id = ?', (payload['listing_id'],)).fetchone()
+        if not row or not row['images']:
+            return
+        images = json.loads(row['images'])
+        valid = [image for image in images if isinstance(image, str) and _is_image(image)]
+        if len(valid) < len(images):
+            logger.info(f"Dropping {len(images) - len(valid)} invalid images from listing {payload['listing_id']}")
+            conn.execute('UPDATE listings SET images = ? WHERE id = ?', (json.dumps(valid), payload['listing_id']))
+            record(conn, 'listing_images_pruned', listing_id=payload['listing_id'], dropped=len(images) - len(valid))
+            conn.commit()
+    finally:
+        conn.close()
+
+def queue_listing_images(listing_id):
+    enqueue('validate_listing_images', {'listing_id': listing_id}, priority=PRIORITY_IMAGES)
+
+@job('mark_messages_read')
+def mark_messages_read(payload):
+    conn = get_db()
+    try:
+        count = conn.execute('''UPDATE messages SET read = TRUE
+                                WHERE receiver_id = ? AND sender_id = ? AND NOT read AND id <= ?''',
+                             (payload['receiver_id'], payload['sender_id'], payload['up_to_id'])).rowcount
+        if count:
+            record(conn, 'messages_read', payload['receiver_id'], receiver_id=payload['receiver_id'],
+                   sender_id=payload['sender_id'], count=count)
+            catch_up(conn, 'conversations')
+        conn.commit()
+    finally:
+        conn.close()
+
+def queue_read_receipt(receiver_id, sender_id, up_to_id):
+    # Messages up to the newest one the reader was shown; later ones stay unread
+    enqueue('mark_messages_read', {'receiver_id': receiver_id, 'sender_id': sender_id, 'up_to_id': up_to_id},
+            priority=PRIORITY_READ_RECEIPTS, dedupe_key=f'read:{receiver_id}:{sender_id}:{up_to_id}')
+
+@job('storage_maintenance')
+def storage_maintenance(payload):
+    # Move cold message months to their partition files, then hand the
+    # freed pages back to the filesystem in small online steps
+    conn = get_db()
+    try:
+        archived = archive_old_messages(conn)
+        if archived:
+            logger.info(f"Archived messages: {archived}")
+        freed = conn.vacuum('messages')
+        if freed:
+            logger.info(f"Reclaimed {freed} pages")
+    finally:
+        conn.close()
+    schedule_maintenance(MAINTENANCE_INTERVAL)
+
+def schedule_maintenance(delay=0):
+    # The dedupe key keeps one run waiting however many API processes start
+    enqueue('storage_maintenance', {}, priority=PRIORITY_MAINTENANCE, delay=delay,
+            dedupe_key='storage_maintenance')
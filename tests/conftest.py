@@ -0,0 +1,86 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# Point every file the app touches at a scratch directory before anything
+# imports app.py (which builds the schema at import time), and keep the
+# password KDF cheap and in-process
+_scratch = tempfile.mkdtemp(prefix='agrilink-tests-')
+os.environ['FOOD_DONATION_DB'] = os.path.join(_scratch, 'food_donation.db')
+os.environ['JOBS_DB'] = os.path.join(_scratch, 'jobs.db')
+os.environ['MESSAGE_ARCHIVE_DIR'] = os.path.join(_scratch, 'message_archive')
+os.environ['JOB_WORKER_THREADS'] = '0'
+os.environ['PASSWORD_HASH_WORKERS'] = '0'
+os.environ['PASSWORD_SCRYPT_N'] = '1024'
+os.environ.setdefault('SECRET_KEY', 'test-secret')
+for name in ('DATABASE_URL', 'READ_REPLICA', 'RATE_LIMIT_DB'):
+    os.environ.pop(name, None)
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import core.db  # noqa: E402
+from core.schema import init_db  # noqa: E402
+
+# A throwaway PostgreSQL database; its public schema is dropped before each test
+PG_URL = os.environ.get('TEST_DATABASE_URL', '')
+
+def _reset_postgres():
+    conn = core.db.get_db()
+    try:
+        conn.execute('DROP SCHEMA public CASCADE')
+        conn.execute('CREATE SCHEMA public')
+        conn.commit()
+    finally:
+        conn.close()
+
+@pytest.fixture(params=['sqlite', 'postgres'])
+def backend(request, tmp_path, monkeypatch):
+    """Run the test once per storage backend, each on an empty schema."""
+    if request.param == 'postgres':
+        if not PG_URL:
+            pytest.skip("TEST_DATABASE_URL is not set")
+        monkeypatch.setattr(core.db, 'DATABASE_URL', PG_URL)
+        _reset_postgres()
+    else:
+        monkeypatch.setattr(core.db, 'DATABASE_URL', '')
+        monkeypatch.setattr(core.db, 'DB_PATH', str(tmp_path / 'food_donation.db'))
+    init_db()
+    return request.param
+
+@pytest.fixture
+def db(backend):
+    conn = core.db.get_db()
+    yield conn
+    conn.close()
+
+@pytest.fixture
+def client(backend, monkeypatch):
+    import app
+    from admission import MemoryBuckets
+    from auth import user_cache
+    monkeypatch.setattr(app.admission, 'buckets', MemoryBuckets())
+    with user_cache._lock:
+        user_cache._entries.clear()
+    return app.app.test_client()
+
+@pytest.fixture
+def make_user(client):
+    """Create a user straight in the database; returns (user, auth headers)."""
+    from auth import issue_token
+    from credentials import hash_password
+
+    def make(role, name=None, email=None, password='secret123', location='Nairobi'):
+        conn = core.db.get_db()
+        try:
+            user_id = conn.insert('''INSERT INTO users (name, email, password, role, location)
+                                     VALUES (?, ?, ?, ?, ?)''',
+                                  (name or role, email or f'{role.lower().replace(" ", "")}@example.com',
+                                   hash_password(password), role, location))
+            conn.commit()
+        finally:
+            conn.close()
+        user = {'id': user_id, 'role': role}
+        return user, {'Authorization': f'Bearer {issue_token(user)}'}
+    return make
@@ -0,0 +1,18 @@
+def _login(client, address, email='victim@example.com', forwarded=None):
+    headers = {'X-Forwarded-For': forwarded} if forwarded else {}
+    return client.post('/login', json={'email': email, 'password': 'wrong', 'role': 'Buyer'},
+                       headers=headers, environ_base={'REMOTE_ADDR': address})
+
+def test_failed_logins_dont_lock_out_other_addresses(client):
+    statuses = [_login(client, '10.0.0.1').status_code for _ in range(8)]
+    assert statuses[-1] == 429
+    assert _login(client, '10.0.0.2').status_code != 429
+
+def test_forwarded_for_is_ignored_without_trusted_proxies(client):
+    for i in range(8):
+        response = _login(client, '10.0.0.1', forwarded=f'192.0.2.{i}')
+    assert response.status_code == 429
+
+def test_one_address_is_throttled_across_accounts(client):
+    statuses = [_login(client, '10.0.0.3', email=f'user{i}@example.com').status_code for i in range(60)]
+    assert 429 in statuses
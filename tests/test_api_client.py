@@ -0,0 +1,35 @@
+import threading
+
+import pytest
+from flask import Flask, jsonify
+from werkzeug.serving import make_server
+
+from core.api_client import fetch_many
+
+@pytest.fixture(scope='module')
+def server():
+    app = Flask('fetch-test')
+
+    @app.route('/ok')
+    def ok():
+        return jsonify([1, 2])
+
+    @app.route('/expired')
+    def expired():
+        return jsonify({"success": False}), 401
+
+    @app.route('/busy')
+    def busy():
+        return jsonify({"success": False}), 429, {'Retry-After': '3'}
+
+    httpd = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    yield f'http://127.0.0.1:{httpd.server_port}'
+    httpd.shutdown()
+
+def test_fetch_many_returns_error_responses(server):
+    results, errors, _, _, responses = fetch_many(server, ['ok', 'expired', 'busy'])
+    assert results == {'ok': [1, 2]}
+    assert set(errors) == {'expired', 'busy'}
+    assert responses['expired'].status_code == 401
+    assert responses['busy'].status_code == 429 and responses['busy'].headers['Retry-After'] == '3'
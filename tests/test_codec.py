@@ -0,0 +1,22 @@
+import pytest
+
+from core.codec import choose_encoding, wants_msgpack
+
+@pytest.mark.parametrize('header, expected', [
+    ('gzip', 'gzip'),
+    ('gzip;q=0', None),
+    ('gzip; q=0.5, deflate', 'gzip'),
+    ('gzip;q=x', 'gzip'),  # unparseable weights count as q=1
+    ('gzip;level=1;q=0', None),
+    ('identity', None),
+    (None, None),
+])
+def test_choose_encoding(header, expected):
+    assert choose_encoding(header) == expected
+
+def test_malformed_quality_does_not_fail_the_request(client):
+    response = client.get('/listings/active', headers={'Accept-Encoding': 'gzip;q=x', 'Accept': 'application/msgpack;q=?'})
+    assert response.status_code == 200
+
+def test_msgpack_opt_out():
+    assert not wants_msgpack('application/msgpack;q=0')
@@ -0,0 +1,39 @@
+import core.db
+import credentials
+from credentials import CredentialsBusy
+
+def _login(client, email, password):
+    return client.post('/login', json={'email': email, 'password': password, 'role': 'Buyer'})
+
+def test_unknown_email_costs_a_hash(client, monkeypatch):
+    runs = []
+    real_run = credentials._run
+    monkeypatch.setattr(credentials, '_run', lambda *args: runs.append(args) or real_run(*args))
+    assert not _login(client, 'nobody@example.com', 'whatever').get_json()['success']
+    assert len(runs) == 1 and runs[0][2] == credentials.SCRYPT_N
+
+def test_busy_rehash_still_logs_in(client, monkeypatch):
+    import app
+    conn = core.db.get_db()
+    try:
+        conn.insert('''INSERT INTO users (name, email, password, role) VALUES (?, ?, ?, ?)''',
+                    ('Old', 'old@example.com', 'plaintext1', 'Buyer'))
+        conn.commit()
+    finally:
+        conn.close()
+
+    def busy(password):
+        raise CredentialsBusy("busy")
+    monkeypatch.setattr(app, 'hash_password', busy)
+    response = _login(client, 'old@example.com', 'plaintext1')
+    assert response.status_code == 200 and response.get_json()['success']
+    assert 'password' not in response.get_json()['user']
+
+    monkeypatch.setattr(app, 'hash_password', credentials.hash_password)
+    assert _login(client, 'old@example.com', 'plaintext1').get_json()['success']
+    conn = core.db.get_db()
+    try:
+        stored = conn.execute("SELECT password FROM users WHERE email = 'old@example.com'").fetchone()[0]
+    finally:
+        conn.close()
+    assert credentials.is_hashed(stored)
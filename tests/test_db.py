@@ -0,0 +1,77 @@
+import sqlite3
+
+import pytest
+
+from core.db import IntegrityError, get_db
+
+def _add_user(conn, email):
+    return conn.insert('''INSERT INTO users (name, email, password, role) VALUES (?, ?, ?, ?)''',
+                       ('Test', email, 'x', 'Buyer'))
+
+def _short_lock_wait(conn):
+    if conn.dialect == 'postgres':
+        conn.execute("SET lock_timeout = '200ms'")
+    else:
+        conn.execute('PRAGMA busy_timeout = 200')
+
+def test_insert_returns_new_id(db):
+    first = _add_user(db, 'a@example.com')
+    second = _add_user(db, 'b@example.com')
+    db.commit()
+    assert second > first
+    assert db.execute('SELECT email FROM users WHERE id = ?', (second,)).fetchone()['email'] == 'b@example.com'
+
+def test_insert_many_returns_ids_in_order(db):
+    ids = db.insert_many('INSERT INTO users (name, email, password, role) VALUES (?, ?, ?, ?)',
+                         [(f'U{i}', f'u{i}@example.com', 'x', 'Buyer') for i in range(5)])
+    db.commit()
+    assert len(ids) == 5
+    for i, user_id in enumerate(ids):
+        assert db.execute('SELECT name FROM users WHERE id = ?', (user_id,)).fetchone()[0] == f'U{i}'
+    assert db.insert_many('INSERT INTO users (name, email, password, role) VALUES (?, ?, ?, ?)', []) == []
+
+def test_duplicate_key_raises_integrity_error(db):
+    _add_user(db, 'same@example.com')
+    db.commit()
+    with pytest.raises(IntegrityError):
+        _add_user(db, 'same@example.com')
+    db.rollback()
+
+def test_other_errors_are_sqlite_errors(db):
+    with pytest.raises(sqlite3.Error):
+        db.execute('SELECT * FROM no_such_table')
+    db.rollback()
+
+def test_upsert_with_excluded(db):
+    sql = '''INSERT INTO projection_offsets (name, last_event_id) VALUES (?, ?)
+             ON CONFLICT (name) DO UPDATE SET last_event_id = projection_offsets.last_event_id + excluded.last_event_id'''
+    db.execute(sql, ('counter', 2))
+    db.execute(sql, ('counter', 3))
+    db.commit()
+    assert db.execute("SELECT last_event_id FROM projection_offsets WHERE name = 'counter'").fetchone()[0] == 5
+
+def test_begin_write_blocks_other_writers(db):
+    db.begin_write('listings', 'requests')
+    other = get_db()
+    try:
+        _short_lock_wait(other)
+        if other.dialect == 'sqlite':
+            with pytest.raises(sqlite3.OperationalError):
+                other.execute('BEGIN IMMEDIATE')
+        else:
+            with pytest.raises(sqlite3.OperationalError):
+                other.execute('LOCK TABLE listings IN SHARE ROW EXCLUSIVE MODE')
+        other.rollback()
+    finally:
+        other.close()
+    db.rollback()
+
+def test_literals_survive_placeholder_rewrite(db):
+    row = db.execute("SELECT '100%' as pct, 'it''s?' as quoted, ? as param", (7,)).fetchone()
+    assert (row['pct'], row['quoted'], row['param']) == ('100%', "it's?", 7)
+
+def test_current_timestamp_format_matches(db):
+    user_id = _add_user(db, 'ts@example.com')
+    db.commit()
+    created_at = db.execute('SELECT created_at FROM users WHERE id = ?', (user_id,)).fetchone()[0]
+    assert len(created_at) == 19 and created_at[10] == ' '
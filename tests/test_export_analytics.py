@@ -0,0 +1,60 @@
+import os
+
+import pytest
+
+import core.db
+import export_analytics
+import messaging
+
+pq = pytest.importorskip('pyarrow.parquet')
+
+def _message_ids(export_dir):
+    table = pq.read_table(os.path.join(export_dir, 'messages'))
+    state = pq.read_table(os.path.join(export_dir, 'messages_state', 'current.parquet'))
+    return sorted(table.column('id').to_pylist()), state.column('id').to_pylist()
+
+def test_full_export_includes_archived_months(db, tmp_path, monkeypatch):
+    if db.dialect != 'sqlite':
+        pytest.skip("the export reads the SQLite file")
+    monkeypatch.setattr(messaging, 'ARCHIVE_DIR', str(tmp_path / 'archive'))
+    ids = db.insert_many('''INSERT INTO users (name, email, password, role) VALUES (?, ?, ?, ?)''',
+                         [('A', 'a@example.com', 'x', 'Farmer'), ('B', 'b@example.com', 'x', 'Buyer')])
+    old = db.insert('''INSERT INTO messages (sender_id, receiver_id, content, read, created_at)
+                       VALUES (?, ?, ?, ?, ?)''', (ids[0], ids[1], 'old', True, '2025-01-05 10:00:00'))
+    new = db.insert('''INSERT INTO messages (sender_id, receiver_id, content) VALUES (?, ?, ?)''',
+                    (ids[1], ids[0], 'new'))
+    db.commit()
+    assert messaging.archive_month(db, '2025-01') == 1
+
+    export_dir = str(tmp_path / 'exports')
+    export_analytics.export(core.db.DB_PATH, export_dir, full=True)
+    assert _message_ids(export_dir) == ([old, new], [old, new])
+    export_analytics.export(core.db.DB_PATH, export_dir, full=True)
+    assert _message_ids(export_dir) == ([old, new], [old, new])
+
+    # Without the archive a full export would drop the old month, so it stops first
+    os.remove(messaging.partition_path('2025-01'))
+    with pytest.raises(FileNotFoundError):
+        export_analytics.export(core.db.DB_PATH, export_dir, full=True)
+    assert _message_ids(export_dir) == ([old, new], [old, new])
+
+def test_every_part_has_the_declared_schema(db, tmp_path):
+    if db.dialect != 'sqlite':
+        pytest.skip("the export reads the SQLite file")
+    farmer = db.insert('''INSERT INTO users (name, email, password, role) VALUES (?, ?, ?, ?)''',
+                       ('A', 'a@example.com', 'x', 'Farmer'))
+    # SQLite keeps 100 as an integer and 2.5 as a real in the same REAL column
+    db.insert_many('''INSERT INTO listings (farmer_id, produce_type, quantity, organic, created_at)
+                      VALUES (?, ?, ?, ?, ?)''',
+                   [(farmer, 'Maize', 100, 0, '2025-01-05 10:00:00'), (farmer, 'Beans', 2.5, 1, '2025-02-05 10:00:00')])
+    db.commit()
+
+    export_dir = str(tmp_path / 'exports')
+    export_analytics.export(core.db.DB_PATH, export_dir)
+    schemas = {str(pq.read_schema(os.path.join(root, name)))
+               for root, _, names in os.walk(os.path.join(export_dir, 'listings')) for name in names}
+    assert len(schemas) == 1
+    table = pq.read_table(os.path.join(export_dir, 'listings'))
+    assert str(table.schema.field('quantity').type) == 'double'
+    assert str(table.schema.field('organic').type) == 'bool'
+    assert sorted(table.column('quantity').to_pylist()) == [2.5, 100.0]
@@ -0,0 +1,32 @@
+import base64
+from io import BytesIO
+
+import pytest
+
+Image = pytest.importorskip('PIL.Image')
+
+from avatar_store import AVATAR_SIZE, save_avatar  # noqa: E402
+from image_cache import ThumbnailCache  # noqa: E402
+from image_prep import make_thumbnail  # noqa: E402
+
+def _photo(size=(800, 600)):
+    buffered = BytesIO()
+    Image.new('RGB', size, (200, 120, 40)).save(buffered, format='JPEG')
+    return buffered.getvalue()
+
+def _size(data):
+    return Image.open(BytesIO(data)).size
+
+def test_thumbnail_keeps_aspect_or_crops_square():
+    photo = _photo()
+    assert _size(make_thumbnail(photo, 300)) == (300, 225)
+    assert _size(make_thumbnail(base64.b64encode(photo).decode('ascii'), 128, square=True)) == (128, 128)
+
+def test_caches_share_the_thumbnail_helper(db):
+    photo = base64.b64encode(_photo()).decode('ascii')
+    assert _size(ThumbnailCache(max_edge=150).thumbnail(photo)) == (150, 113)
+    user_id = db.insert('''INSERT INTO users (name, email, password, role) VALUES (?, ?, ?, ?)''',
+                        ('A', 'a@example.com', 'x', 'Buyer'))
+    save_avatar(db, user_id, photo)
+    thumbnail = db.execute('SELECT thumbnail FROM avatars WHERE user_id = ?', (user_id,)).fetchone()[0]
+    assert _size(bytes(thumbnail)) == (AVATAR_SIZE, AVATAR_SIZE)
@@ -0,0 +1,18 @@
+import os
+
+import pytest
+
+from importtime_report import is_project_module, profile_imports
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LAZY = {'sklearn', 'joblib', 'PIL', 'flask', 'app'}
+
+def test_frontend_imports_heavy_packages_lazily(monkeypatch):
+    pytest.importorskip('streamlit')
+    monkeypatch.chdir(ROOT)
+    entries = profile_imports('streamlit_app')
+    # Streamlit itself may load PIL; only imports made by our modules count
+    eager = sorted({f"{name} (from {parent})" for name, parent, _, _ in entries
+                    if parent and is_project_module(parent) and name.split('.')[0] in LAZY})
+    assert eager == []
+    assert not any(name.split('.')[0] in {'sklearn', 'joblib'} for name, _, _, _ in entries)
@@ -0,0 +1,53 @@
+import pytest
+
+import core.db
+import replicas
+
+class Clock:
+    def __init__(self, now):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+    def monotonic(self):
+        return self.now
+
+@pytest.fixture
+def router(db, tmp_path, monkeypatch):
+    if db.dialect != 'sqlite':
+        pytest.skip("the SQLite copy replica")
+    replica_path = str(tmp_path / 'replica.db')
+    monkeypatch.setattr(core.db, 'READ_REPLICA', replica_path)
+    clock = Clock(1000.0)
+    monkeypatch.setattr(replicas, 'time', clock)
+    replicas.refresh_replica(replica_path, core.db.DB_PATH)
+    return replicas.ReadRouter(mode=replica_path), clock
+
+def _route(router, user_id):
+    before = dict(router.counters)
+    router.connect(user_id).close()
+    return next(outcome for outcome, count in router.counters.items() if count > before[outcome])
+
+def test_read_your_writes_uses_the_snapshot_time(router):
+    router, clock = router
+    clock.now = 1000.1
+    router.note_write(7)  # lands just after the snapshot
+    clock.now = 1000.9
+    assert _route(router, 8) == 'replica'  # measures a 0.9s lag
+    clock.now = 1001.5  # the measurement is cached, so the lag is stale
+    assert _route(router, 7) == 'read_your_writes'
+    assert _route(router, 8) == 'replica'
+
+def test_writes_before_the_snapshot_read_from_the_replica(router):
+    router, clock = router
+    router.note_write(7)
+    clock.now = 1000.5
+    replicas.refresh_replica(core.db.READ_REPLICA, core.db.DB_PATH)
+    clock.now = 1002.0
+    assert _route(router, 7) == 'replica'
+
+def test_lagging_replica_falls_back_to_primary(router):
+    router, clock = router
+    clock.now = 1000 + router.max_lag + 1
+    assert _route(router, None) == 'lagging'
@@ -0,0 +1,173 @@
+LISTING = {'produce_type': 'Maize', 'quantity': 100, 'price': 0,
+           'harvest_date': '2026-10-01', 'best_before': '2026-12-30'}
+
+def _listing(client, headers, **fields):
+    response = client.post('/listings', json={**LISTING, **fields}, headers=headers)
+    assert response.status_code == 200, response.get_json()
+    return response.get_json()['listing']
+
+def _request(client, headers, listing_id, quantity, **fields):
+    response = client.post('/requests', json={'listing_id': listing_id, 'quantity': quantity, **fields},
+                           headers=headers)
+    assert response.status_code == 200, response.get_json()
+    return response.get_json()['request']
+
+def _stock(client, listing):
+    rows = client.get(f"/listings/farmer/{listing['farmer_id']}").get_json()
+    return next(row['quantity'] for row in rows if row['id'] == listing['id'])
+
+def test_health(client):
+    assert client.get('/health').get_json()['status'] == 'healthy'
+
+def test_register_and_login(client):
+    response = client.post('/register', json={'name': 'Ann', 'email': 'ann@example.com', 'password': 'pw123456',
+                                              'role': 'Buyer', 'location': 'Nakuru'})
+    assert response.get_json()['success']
+    again = client.post('/register', json={'name': 'Ann', 'email': 'ann@example.com', 'password': 'x',
+                                           'role': 'Buyer'})
+    assert again.get_json() == {"success": False, "message": "Email already exists"}
+
+    login = client.post('/login', json={'email': 'ann@example.com', 'password': 'pw123456', 'role': 'Buyer'})
+    assert login.get_json()['success'] and login.get_json()['token']
+    wrong = client.post('/login', json={'email': 'ann@example.com', 'password': 'nope', 'role': 'Buyer'})
+    assert not wrong.get_json()['success']
+
+def test_listing_feed_and_etag(client, make_user):
+    farmer, farmer_auth = make_user('Farmer')
+    listing = _listing(client, farmer_auth)
+    response = client.get('/listings/active')
+    assert [row['id'] for row in response.get_json()] == [listing['id']]
+
+    etag = response.headers['ETag']
+    assert client.get('/listings/active', headers={'If-None-Match': etag}).status_code == 304
+    _listing(client, farmer_auth, produce_type='Beans')
+    assert client.get('/listings/active', headers={'If-None-Match': etag}).status_code == 200
+
+def test_request_is_created_pending(client, make_user):
+    _, farmer_auth = make_user('Farmer')
+    _, buyer_auth = make_user('Buyer')
+    listing = _listing(client, farmer_auth)
+    request = _request(client, buyer_auth, listing['id'], 10, status='approved')
+    assert request['status'] == 'pending'
+    assert _stock(client, listing) == 100
+
+def test_approval_takes_stock_once(client, make_user):
+    _, farmer_auth = make_user('Farmer')
+    _, buyer_auth = make_user('Buyer')
+    listing = _listing(client, farmer_auth)
+    request = _request(client, buyer_auth, listing['id'], 30)
+
+    assert client.put(f"/requests/{request['id']}", json={'status': 'approved'}, headers=farmer_auth).status_code == 200
+    assert client.put(f"/requests/{request['id']}", json={'status': 'approved'}, headers=farmer_auth).status_code == 400
+    assert _stock(client, listing) == 70
+
+    # Only the farmer decides
+    assert client.put(f"/requests/{request['id']}", json={'status': 'rejected'}, headers=buyer_auth).status_code == 403
+
+def test_bulk_update_rejects_duplicates(client, make_user):
+    _, farmer_auth = make_user('Farmer')
+    _, buyer_auth = make_user('Buyer')
+    listing = _listing(client, farmer_auth)
+    request = _request(client, buyer_auth, listing['id'], 30)
+    updates = [{'request_id': request['id'], 'status': 'approved'}] * 2
+
+    response = client.put('/requests/bulk', json={'updates': updates}, headers=farmer_auth)
+    assert response.status_code == 400
+    assert _stock(client, listing) == 100
+
+    response = client.put('/requests/bulk?partial=1', json={'updates': updates}, headers=farmer_auth)
+    body = response.get_json()
+    assert body['updated'] == 1
+    assert body['results'][1]['error'] == "Request is listed more than once"
+    assert _stock(client, listing) == 70
+
+def test_bulk_listings(client, make_user):
+    farmer, farmer_auth = make_user('Farmer')
+    rows = [{**LISTING, 'produce_type': 'Beans'}, {**LISTING, 'quantity': -1}]
+    assert client.post('/listings/bulk', json=rows, headers=farmer_auth).status_code == 400
+    response = client.post('/listings/bulk?partial=1', json=rows, headers=farmer_auth)
+    assert response.get_json()['created'] == 1
+    assert len(client.get(f"/listings/farmer/{farmer['id']}").get_json()) == 1
+
+def test_messages_and_conversations(client, make_user):
+    farmer, farmer_auth = make_user('Farmer', name='Fay')
+    buyer, buyer_auth = make_user('Buyer', name='Bo')
+    for text in ('hello', 'is the maize still there?'):
+        assert client.post('/messages', json={'receiver_id': farmer['id'], 'content': text},
+                           headers=buyer_auth).get_json()['success']
+
+    conversations = client.get(f"/conversations/{farmer['id']}", headers=farmer_auth).get_json()
+    assert [(c['partner_id'], c['partner_name'], c['unread_count']) for c in conversations] == [(buyer['id'], 'Bo', 2)]
+    messages = client.get(f"/messages/{farmer['id']}/{buyer['id']}", headers=farmer_auth).get_json()
+    assert [m['content'] for m in messages] == ['hello', 'is the maize still there?']
+    assert client.get(f"/conversations/{buyer['id']}", headers=farmer_auth).status_code == 403
+
+def test_dashboard_etag(client, make_user):
+    farmer, farmer_auth = make_user('Farmer')
+    _listing(client, farmer_auth)
+    response = client.get(f"/dashboard/farmer/{farmer['id']}", headers=farmer_auth)
+    assert len(response.get_json()['listings']) == 1
+    headers = {**farmer_auth, 'If-None-Match': response.headers['ETag']}
+    assert client.get(f"/dashboard/farmer/{farmer['id']}", headers=headers).status_code == 304
+
+def test_delete_listing(client, make_user):
+    farmer, farmer_auth = make_user('Farmer')
+    listing = _listing(client, farmer_auth)
+    assert client.delete(f"/listings/{listing['id']}", headers=farmer_auth).get_json()['success']
+    assert client.delete(f"/listings/{listing['id']}", headers=farmer_auth).status_code == 404
+
+def test_foodbank_demand_validation(client, make_user):
+    foodbank, foodbank_auth = make_user('Food Bank')
+    url = f"/foodbank/{foodbank['id']}/demand"
+    for demand in ([{'produce_type': 'Maize', 'demand_kg': 10}, {'produce_type': 'maize ', 'demand_kg': 5}],
+                   ['maize'], [{'produce_type': 'Beans', 'demand_kg': 'lots'}], 'maize'):
+        assert client.put(url, json={'demand': demand}, headers=foodbank_auth).status_code == 400
+    response = client.put(url, json={'demand': [{'produce_type': 'Maize', 'demand_kg': 10}]}, headers=foodbank_auth)
+    assert [row['produce_type'] for row in response.get_json()['demand']] == ['maize']
+
+def test_rollups_keep_county_after_farmer_moves(client, make_user):
+    import core.db
+    from rollups import rebuild_rollups
+    _, farmer_auth = make_user('Farmer', location='Nakuru')
+    _, foodbank_auth = make_user('Food Bank')
+    listing = _listing(client, farmer_auth)
+    request = _request(client, foodbank_auth, listing['id'], 30)
+    client.put('/update_profile', json={'name': 'Farmer', 'location': 'Kisumu', 'phone': None}, headers=farmer_auth)
+    assert client.put(f"/requests/{request['id']}", json={'status': 'approved'}, headers=farmer_auth).status_code == 200
+
+    conn = core.db.get_db()
+    try:
+        query = 'SELECT county, request_count, approved_kg FROM daily_rollups ORDER BY county'
+        incremental = [tuple(row) for row in conn.execute(query).fetchall()]
+        rebuild_rollups(conn)
+        conn.commit()
+        assert [tuple(row) for row in conn.execute(query).fetchall()] == incremental == [('NAKURU', 1, 30)]
+    finally:
+        conn.close()
+
+def test_farm_profile_validation(client, make_user):
+    farmer, farmer_auth = make_user('Farmer')
+    url = f"/farm_profile/{farmer['id']}"
+    response = client.put(url, json={'Acreage': 'two'}, headers=farmer_auth)
+    assert response.status_code == 400 and 'Acreage' in response.get_json()['error']
+    assert client.put(url, json={'Laborers': -3}, headers=farmer_auth).status_code == 400
+    assert client.put(url, json={'planting_date': 20260301}, headers=farmer_auth).status_code == 400
+    assert client.put(url, json=['Acreage'], headers=farmer_auth).status_code == 400
+    assert client.put(url, json={'Acreage': '2.5', 'Gender': 'Female', 'planting_date': '2026-03-01'},
+                      headers=farmer_auth).get_json()['success']
+
+def test_approving_the_last_stock_deactivates_listing(client, make_user):
+    farmer, farmer_auth = make_user('Farmer')
+    _, buyer_auth = make_user('Buyer')
+    single = _listing(client, farmer_auth, quantity=30)
+    bulk = _listing(client, farmer_auth, quantity=40, produce_type='Beans')
+    request = _request(client, buyer_auth, single['id'], 30)
+    first, second = (_request(client, buyer_auth, bulk['id'], 20) for _ in range(2))
+
+    assert client.put(f"/requests/{request['id']}", json={'status': 'approved'}, headers=farmer_auth).status_code == 200
+    updates = [{'request_id': first['id'], 'status': 'approved'}, {'request_id': second['id'], 'status': 'approved'}]
+    assert client.put('/requests/bulk', json={'updates': updates}, headers=farmer_auth).get_json()['success']
+
+    rows = client.get(f"/listings/farmer/{farmer['id']}").get_json()
+    assert {row['id']: row['status'] for row in rows} == {single['id']: 'inactive', bulk['id']: 'inactive'}
+    assert client.get('/listings/active').get_json() == []
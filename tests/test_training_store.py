@@ -0,0 +1,17 @@
+import pytest
+
+training_store = pytest.importorskip('training_store')
+
+def test_marketplace_drift_alerts_without_retraining(monkeypatch):
+    assert 'Acreage' in training_store.FEATURES
+    retrainer = training_store.Retrainer(threshold=0.2)
+    monkeypatch.setattr(training_store, 'check_drift', lambda: {training_store.MARKETPLACE_DRIFT: 0.9, 'Acreage': 0.1})
+    monkeypatch.setattr(retrainer, '_retrain', lambda: pytest.fail("retrained on marketplace drift"))
+    assert not retrainer.maybe_retrain()
+
+    started = []
+    monkeypatch.setattr(training_store, 'check_drift', lambda: {training_store.MARKETPLACE_DRIFT: 0.9, 'Acreage': 0.5})
+    monkeypatch.setattr(retrainer, '_retrain', lambda: started.append(True))
+    assert retrainer.maybe_retrain()
+    retrainer._thread.join()
+    assert started == [True]
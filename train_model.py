@@ -0,0 +1,209 @@
+import argparse
+import hashlib
+import json
+import logging
+import os
+import shutil
+from datetime import datetime
+
+import joblib
+import numpy as np
+import pandas as pd
+import sklearn
+from sklearn.compose import ColumnTransformer
+from sklearn.ensemble import RandomForestRegressor
+from sklearn.impute import SimpleImputer
+from sklearn.model_selection import GridSearchCV, KFold, RandomizedSearchCV
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import LabelEncoder, StandardScaler
+
+from yield_model import CATEGORICAL_FEATURES, FUSED_FILE, NUMERIC_FEATURES, FusedYieldModel
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Same features as crop_prediction_training_model.ipynb
+FEATURES = [
+    'Acreage', 'Fertilizer amount', 'Laborers', 'Education',
+    'Gender', 'Age bracket', 'Household size', 'Water source',
+    'Main credit source', 'Advisory language'
+]
+TARGET = 'Yield'
+
+MODEL_FILE = 'corn_yield_predictor.pkl'
+ENCODERS_FILE = 'label_encoders.pkl'
+MANIFEST_FILE = 'manifest.json'
+
+PARAM_GRID = {
+    'regressor__n_estimators': [100, 200, 400],
+    'regressor__max_depth': [None, 8, 16],
+    'regressor__min_samples_leaf': [1, 2, 4],
+    'regressor__max_features': [1.0, 'sqrt'],
+}
+
+def load_dataset(path):
+    df = pd.read_csv(path)
+    df['Acreage'] = df['Acreage'].fillna(df['Acreage'].median())
+    df = df.dropna(subset=[TARGET])
+    return df
+
+def fit_label_encoders(df):
+    df = df.copy()
+    label_encoders = {}
+    for col in CATEGORICAL_FEATURES:
+        le = LabelEncoder()
+        df[col] = le.fit_transform(df[col].fillna('nan').astype(str))
+        label_encoders[col] = le
+    return df, label_encoders
+
+def build_pipeline(random_state=42, memory=None):
+    numeric_transformer = Pipeline(steps=[
+        ('imputer', SimpleImputer(strategy='median')),
+        ('scaler', StandardScaler())
+    ])
+    categorical_transformer = Pipeline(steps=[
+        ('imputer', SimpleImputer(strategy='most_frequent')),
+    ])
+    preprocessor = ColumnTransformer(
+        transformers=[
+            ('num', numeric_transformer, NUMERIC_FEATURES),
+            ('cat', categorical_transformer, CATEGORICAL_FEATURES)
+        ]
+    )
+    # memory caches the fitted preprocessor per CV fold, so the search only
+    # refits it when the fold changes, not for every hyperparameter candidate
+    return Pipeline(steps=[
+        ('preprocessor', preprocessor),
+        ('regressor', RandomForestRegressor(n_estimators=100, random_state=random_state, n_jobs=1))
+    ], memory=memory)
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def frame_sha256(df):
+    return hashlib.sha256(pd.util.hash_pandas_object(df, index=False).values.tobytes()).hexdigest()
+
+def make_search(pipeline, folds, seed, n_jobs, n_iter=None):
+    cv = KFold(n_splits=folds, shuffle=True, random_state=seed)
+    scoring = {'r2': 'r2', 'mae': 'neg_mean_absolute_error'}
+    # n_jobs fans the (candidate, fold) fits out over a process pool
+    if n_iter:
+        return RandomizedSearchCV(pipeline, PARAM_GRID, n_iter=n_iter, cv=cv, scoring=scoring,
+                                  refit='r2', n_jobs=n_jobs, random_state=seed)
+    return GridSearchCV(pipeline, PARAM_GRID, cv=cv, scoring=scoring, refit='r2', n_jobs=n_jobs)
+
+def cv_metrics(search):
+    results = search.cv_results_
+    best = search.best_index_
+    return {
+        'r2_mean': float(results['mean_test_r2'][best]),
+        'r2_std': float(results['std_test_r2'][best]),
+        'mae_mean': float(-results['mean_test_mae'][best]),
+        'mae_std': float(results['std_test_mae'][best]),
+        'candidates': int(len(results['params'])),
+    }
+
+def train(data_path='corn_data.csv', output_dir='models', folds=5, n_jobs=-1,
+          n_iter=None, seed=42, cache_dir='.train_cache', promote=False, df=None):
+    # df lets callers (e.g. the incremental retrainer) pass an already merged dataset
+    if df is None:
+        df = load_dataset(data_path)
+        data_hash = file_sha256(data_path)
+    else:
+        data_hash = frame_sha256(df)
+    encoded, label_encoders = fit_label_encoders(df)
+    X = encoded[FEATURES]
+    y = encoded[TARGET]
+
+    memory = joblib.Memory(cache_dir, verbose=0) if cache_dir else None
+    search = make_search(build_pipeline(seed, memory), folds, seed, n_jobs, n_iter)
+    started = datetime.now()
+    logger.info(f"Searching {len(X)} rows with {folds}-fold CV (n_jobs={n_jobs})")
+    search.fit(X, y)
+    elapsed = (datetime.now() - started).total_seconds()
+
+    # Ship the refit model without the on-disk cache reference
+    model = search.best_estimator_
+    model.set_params(memory=None)
+
+    version = f"{started.strftime('%Y%m%d%H%M%S')}-{data_hash[:8]}"
+    version_dir = os.path.join(output_dir, version)
+    os.makedirs(version_dir, exist_ok=True)
+    joblib.dump(model, os.path.join(version_dir, MODEL_FILE))
+    joblib.dump(label_encoders, os.path.join(version_dir, ENCODERS_FILE))
+    joblib.dump(FusedYieldModel.from_pipeline(model, label_encoders, version),
+                os.path.join(version_dir, FUSED_FILE))
+
+    manifest = {
+        'version': version,
+        'created_at': started.isoformat(),
+        'data': {'path': data_path, 'sha256': data_hash, 'rows': int(len(X))},
+        'features': FEATURES,
+        'feature_profile': feature_profile(df),
+        'seed': seed,
+        'folds': folds,
+        'best_params': search.best_params_,
+        'metrics': cv_metrics(search),
+        'train_seconds': round(elapsed, 2),
+        'sklearn_version': sklearn.__version__,
+    }
+    with open(os.path.join(version_dir, MANIFEST_FILE), 'w') as f:
+        json.dump(manifest, f, indent=2, default=str)
+
+    logger.info(f"Wrote {version_dir}: {manifest['metrics']}")
+    if promote:
+        promote_version(version_dir)
+    return version_dir, manifest
+
+def feature_profile(df, bins=10):
+    # Snapshot of the training distribution, used later for drift detection
+    profile = {}
+    for col in NUMERIC_FEATURES + [TARGET]:
+        values = df[col].dropna().astype(float)
+        edges = np.unique(np.quantile(values, np.linspace(0, 1, bins + 1)))
+        counts, _ = np.histogram(values, bins=edges)
+        profile[col] = {'type': 'numeric', 'edges': edges.tolist(),
+                        'proportions': (counts / max(counts.sum(), 1)).tolist()}
+    for col in CATEGORICAL_FEATURES:
+        shares = df[col].fillna('nan').astype(str).value_counts(normalize=True)
+        profile[col] = {'type': 'categorical', 'proportions': shares.to_dict()}
+    return profile
+
+def promote_version(version_dir, target_dir='.'):
+    # Copy then rename so the app never sees a half-written pickle
+    for name in (MODEL_FILE, ENCODERS_FILE):
+        tmp_path = os.path.join(target_dir, name + '.tmp')
+        shutil.copyfile(os.path.join(version_dir, name), tmp_path)
+        os.replace(tmp_path, os.path.join(target_dir, name))
+    # Point running processes at the new version (see model_registry)
+    from model_registry import set_current_version
+    set_current_version(version_dir)
+    logger.info(f"Promoted {version_dir}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Train the corn yield model with k-fold CV and hyperparameter search")
+    parser.add_argument('--data', default='corn_data.csv')
+    parser.add_argument('--output-dir', default='models')
+    parser.add_argument('--folds', type=int, default=5)
+    parser.add_argument('--n-jobs', type=int, default=-1, help="Parallel workers, -1 for all cores")
+    parser.add_argument('--n-iter', type=int, default=None, help="Use randomized search with this many candidates")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--cache-dir', default='.train_cache', help="Fold preprocessing cache ('' to disable)")
+    parser.add_argument('--promote', action='store_true', help="Copy the new artifacts over the served pickles")
+    parser.add_argument('--with-store', action='store_true', help="Include rows appended to the training store")
+    args = parser.parse_args(argv)
+
+    np.random.seed(args.seed)
+    df = None
+    if args.with_store:
+        from training_store import load_training_frame
+        df = load_training_frame()
+    train(args.data, args.output_dir, args.folds, args.n_jobs, args.n_iter,
+          args.seed, args.cache_dir or None, args.promote, df=df)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,213 @@
+import argparse
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from core.db import get_db
+from model_registry import current_version_dir
+from train_model import CATEGORICAL_FEATURES, FEATURES, MANIFEST_FILE, TARGET, load_dataset, train
+
+logger = logging.getLogger(__name__)
+
+BASE_DATA = 'corn_data.csv'
+STORE_DIR = 'training_store'
+ROWS_DIR = os.path.join(STORE_DIR, 'rows')
+OBSERVATIONS_DIR = os.path.join(STORE_DIR, 'observations')
+STATE_FILE = os.path.join(STORE_DIR, 'state.json')
+DRIFT_THRESHOLD = 0.2  # PSI above 0.2 is conventionally a significant shift
+CORN_NAMES = ('corn', 'maize')
+# Drift on listing quantities is reported but can't be trained away: the
+# observations have no farm features, so they never enter the training frame
+MARKETPLACE_DRIFT = f'{TARGET} (marketplace)'
+
+def _load_state():
+    try:
+        with open(STATE_FILE) as f:
+            return json.load(f)
+    except OSError:
+        return {}
+
+def _save_state(state):
+    os.makedirs(STORE_DIR, exist_ok=True)
+    tmp_path = STATE_FILE + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f)
+    os.replace(tmp_path, STATE_FILE)
+
+def _write_part(df, directory, source):
+    os.makedirs(directory, exist_ok=True)
+    # Each batch is its own immutable file, so appends never rewrite old data
+    name = f"part-{datetime.now().strftime('%Y%m%d%H%M%S%f')}-{source}.parquet"
+    df.to_parquet(os.path.join(directory, name), index=False)
+    return name
+
+def _read_parts(directory, columns=None):
+    if not os.path.isdir(directory) or not os.listdir(directory):
+        return pd.DataFrame(columns=columns)
+    return pd.read_parquet(directory, columns=columns)
+
+def append_rows(df, source='manual'):
+    """Append farm records in the corn_data.csv schema to the training store."""
+    missing = [col for col in FEATURES + [TARGET] if col not in df.columns]
+    if missing:
+        raise ValueError(f"Missing columns: {', '.join(missing)}")
+    batch = df[FEATURES + [TARGET]].copy()
+    for col in CATEGORICAL_FEATURES:
+        batch[col] = batch[col].fillna('nan').astype(str)
+    batch['source'] = source
+    batch['ingested_at'] = pd.Timestamp.now()
+    return _write_part(batch.dropna(subset=[TARGET]), ROWS_DIR, source)
+
+def ingest_marketplace(db_path=None):
+    # Listings only carry a quantity, not farm features, so they are kept as
+    # target observations and only feed the drift check on Yield
+    state = _load_state()
+    last_id = state.get('last_listing_id', 0)
+    conn = get_db(db_path)
+    try:
+        where = ' OR '.join('LOWER(produce_type) LIKE ?' for _ in CORN_NAMES)
+        rows = conn.execute(f'''SELECT id, farmer_id, quantity, created_at FROM listings
+                                WHERE id > ? AND ({where}) ORDER BY id''',
+                            (last_id, *[f'%{name}%' for name in CORN_NAMES])).fetchall()
+    finally:
+        conn.close()
+    if not rows:
+        return 0
+    df = pd.DataFrame(rows, columns=['listing_id', 'farmer_id', TARGET, 'created_at'])
+    df['ingested_at'] = pd.Timestamp.now()
+    _write_part(df, OBSERVATIONS_DIR, 'marketplace')
+    state['last_listing_id'] = int(df['listing_id'].max())
+    _save_state(state)
+    return len(df)
+
+def load_training_frame():
+    base = load_dataset(BASE_DATA)[FEATURES + [TARGET]]
+    rows = _read_parts(ROWS_DIR, FEATURES + [TARGET])
+    return pd.concat([base, rows], ignore_index=True) if len(rows) else base
+
+def load_manifest(version_dir=None):
+    version_dir = version_dir or current_version_dir()
+    if not version_dir:
+        return None
+    with open(os.path.join(version_dir, MANIFEST_FILE)) as f:
+        return json.load(f)
+
+def psi(expected, actual, eps=1e-4):
+    expected = np.clip(np.asarray(expected, dtype=float), eps, None)
+    actual = np.clip(np.asarray(actual, dtype=float), eps, None)
+    return float(np.sum((actual - expected) * np.log(actual / expected)))
+
+def drift_report(profile, df):
+    report = {}
+    for col, spec in profile.items():
+        if col not in df.columns:
+            continue
+        values = df[col].dropna()
+        if values.empty:
+            continue
+        if spec['type'] == 'numeric':
+            edges = np.asarray(spec['edges'])
+            if len(edges) < 2:
+                continue
+            # Out-of-range values land in the outer bins
+            counts, _ = np.histogram(np.clip(values.astype(float), edges[0], edges[-1]), bins=edges)
+            report[col] = psi(spec['proportions'], counts / counts.sum())
+        else:
+            expected = spec['proportions']
+            shares = values.astype(str).value_counts(normalize=True)
+            categories = sorted(set(expected) | set(shares.index))
+            report[col] = psi([expected.get(c, 0) for c in categories],
+                              [shares.get(c, 0) for c in categories])
+    return report
+
+def check_drift(manifest=None):
+    manifest = manifest or load_manifest()
+    if not manifest:
+        return {}
+    created_at = pd.Timestamp(manifest['created_at'])
+    profile = manifest['feature_profile']
+    report = {}
+
+    rows = _read_parts(ROWS_DIR)
+    rows = rows[rows['ingested_at'] > created_at] if len(rows) else rows
+    if len(rows):
+        report.update(drift_report(profile, rows))
+
+    observations = _read_parts(OBSERVATIONS_DIR)
+    observations = observations[observations['ingested_at'] > created_at] if len(observations) else observations
+    if len(observations):
+        report[MARKETPLACE_DRIFT] = drift_report({TARGET: profile[TARGET]}, observations)[TARGET]
+    return report
+
+class Retrainer:
+    """Retrains in a background thread when drift crosses the threshold."""
+
+    def __init__(self, threshold=DRIFT_THRESHOLD, **train_kwargs):
+        self.threshold = threshold
+        self.train_kwargs = train_kwargs
+        self._thread = None
+        self.last_report = {}
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def _retrain(self):
+        try:
+            # promote=True repoints models/CURRENT; ModelRegistry picks it up
+            train(df=load_training_frame(), promote=True, **self.train_kwargs)
+        except Exception:
+            logger.exception("Background retrain failed")
+
+    def maybe_retrain(self):
+        if self.running:
+            return False
+        self.last_report = check_drift()
+        drifted = {col: value for col, value in self.last_report.items() if value > self.threshold}
+        if drifted.pop(MARKETPLACE_DRIFT, None) is not None:
+            logger.warning(f"Marketplace {TARGET} has drifted from the training data "
+                           f"(PSI {self.last_report[MARKETPLACE_DRIFT]:.3f}); retraining won't change that")
+        if not drifted:
+            return False
+        logger.info(f"Drift detected, retraining: {drifted}")
+        self._thread = threading.Thread(target=self._retrain, name='yield-retrain', daemon=True)
+        self._thread.start()
+        return True
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Incremental training store for the yield model")
+    sub = parser.add_subparsers(dest='command', required=True)
+    ingest = sub.add_parser('ingest', help="Append farm records from a CSV in the corn_data.csv schema")
+    ingest.add_argument('csv')
+    ingest.add_argument('--source', default='csv')
+    market = sub.add_parser('ingest-marketplace', help="Pull new corn listings as yield observations")
+    market.add_argument('--db', help="SQLite file (default: DATABASE_URL or FOOD_DONATION_DB)")
+    sub.add_parser('drift', help="Print PSI per feature against the served model")
+    watch = sub.add_parser('watch', help="Ingest, check drift and retrain in the background")
+    watch.add_argument('--db', help="SQLite file (default: DATABASE_URL or FOOD_DONATION_DB)")
+    watch.add_argument('--interval', type=int, default=3600)
+    watch.add_argument('--threshold', type=float, default=DRIFT_THRESHOLD)
+    args = parser.parse_args(argv)
+
+    if args.command == 'ingest':
+        print(append_rows(pd.read_csv(args.csv), args.source))
+    elif args.command == 'ingest-marketplace':
+        print(f"Ingested {ingest_marketplace(args.db)} listings")
+    elif args.command == 'drift':
+        for col, value in sorted(check_drift().items(), key=lambda item: -item[1]):
+            print(f"{col:25s} {value:.4f}")
+    elif args.command == 'watch':
+        retrainer = Retrainer(args.threshold)
+        while True:
+            ingest_marketplace(args.db)
+            retrainer.maybe_retrain()
+            time.sleep(args.interval)
+
+if __name__ == '__main__':
+    main()
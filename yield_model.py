@@ -0,0 +1,85 @@
+import numpy as np
+
+# Column order matches the ColumnTransformer output: numeric block, then categorical
+NUMERIC_FEATURES = ['Acreage', 'Fertilizer amount', 'Laborers', 'Household size']
+CATEGORICAL_FEATURES = ['Education', 'Gender', 'Age bracket', 'Water source',
+                        'Main credit source', 'Advisory language']
+FUSED_FILE = 'yield_model_fused.pkl'
+
+class FusedYieldModel:
+    """Label encoding, imputation, scaling and the regressor as one array transform.
+
+    Unknown categories (e.g. "Other" credit source) map to missing and are then
+    filled with the training mode, the same fallback the pipeline imputer uses.
+    """
+
+    def __init__(self, lookups, num_fill, num_mean, num_scale, cat_fill, regressor, version=None):
+        self.lookups = lookups
+        self.num_fill = np.asarray(num_fill, dtype=float)
+        self.num_mean = np.asarray(num_mean, dtype=float)
+        self.num_scale = np.asarray(num_scale, dtype=float)
+        self.cat_fill = np.asarray(cat_fill, dtype=float)
+        self.regressor = regressor
+        self.version = version
+
+    @classmethod
+    def from_pipeline(cls, pipeline, label_encoders, version=None):
+        preprocessor = pipeline.named_steps['preprocessor']
+        num = preprocessor.named_transformers_['num']
+        cat = preprocessor.named_transformers_['cat']
+        scaler = num.named_steps['scaler']
+        lookups = {
+            col: {str(label): code for code, label in enumerate(label_encoders[col].classes_)}
+            for col in CATEGORICAL_FEATURES
+        }
+        return cls(lookups,
+                   num.named_steps['imputer'].statistics_,
+                   scaler.mean_ if scaler.with_mean else np.zeros(len(NUMERIC_FEATURES)),
+                   scaler.scale_ if scaler.with_std else np.ones(len(NUMERIC_FEATURES)),
+                   cat.named_steps['imputer'].statistics_,
+                   pipeline.named_steps['regressor'],
+                   version)
+
+    def _column(self, data, col):
+        values = data[col]
+        if np.isscalar(values) or values is None:
+            values = [values]
+        return np.asarray(values, dtype=object)
+
+    def _encode(self, col, values):
+        # Look up each distinct value once, then broadcast back to the rows
+        values = np.where(values == None, 'nan', values).astype(str)  # noqa: E711
+        uniques, inverse = np.unique(values, return_inverse=True)
+        lookup = self.lookups[col]
+        codes = np.array([lookup.get(value, np.nan) for value in uniques], dtype=float)
+        return codes[inverse]
+
+    def transform(self, data):
+        """data: a dict of scalars/sequences or a DataFrame keyed by feature name."""
+        numeric = np.column_stack([
+            np.asarray(self._column(data, col), dtype=float) for col in NUMERIC_FEATURES
+        ])
+        numeric = np.where(np.isnan(numeric), self.num_fill, numeric)
+        numeric = (numeric - self.num_mean) / self.num_scale
+
+        categorical = np.column_stack([
+            self._encode(col, self._column(data, col)) for col in CATEGORICAL_FEATURES
+        ])
+        categorical = np.where(np.isnan(categorical), self.cat_fill, categorical)
+        return np.hstack([numeric, categorical])
+
+    def unknown_categories(self, data):
+        unknown = {}
+        for col in CATEGORICAL_FEATURES:
+            values = {str(v) for v in self._column(data, col) if v is not None}
+            missing = sorted(values - set(self.lookups[col]))
+            if missing:
+                unknown[col] = missing
+        return unknown
+
+    def predict(self, data):
+        return self.regressor.predict(self.transform(data))
+
+def build_fused_model(model_path, encoders_path, version=None):
+    import joblib
+    return FusedYieldModel.from_pipeline(joblib.load(model_path), joblib.load(encoders_path), version)